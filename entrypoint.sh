@@ -10,9 +10,13 @@ if [ "$DJANGO_ENV" = "production" ]; then
     # Default Gunicorn timeout is 30s; large Wagtail/media uploads exceed it (WORKER TIMEOUT).
     # Override on the host if needed, e.g. GUNICORN_TIMEOUT=3600 docker compose up -d
     GUNICORN_TIMEOUT="${GUNICORN_TIMEOUT:-1200}"
+    # Threaded workers: an open run event stream (long poll) holds a thread, not a whole worker
+    GUNICORN_THREADS="${GUNICORN_THREADS:-8}"
     exec gunicorn ruzivoflow.wsgi:application \
         --bind 0.0.0.0:8000 \
         --workers 3 \
+        --worker-class gthread \
+        --threads "$GUNICORN_THREADS" \
         --timeout "$GUNICORN_TIMEOUT" \
         --graceful-timeout 120
 else
@@ -0,0 +1,225 @@
+"""
+Vectorization advisor for python_code submissions.
+
+An AST pass over the user's code finds the row-at-a-time pandas patterns that
+are usually 100x slower than their vectorized equivalents (iterrows, apply with
+axis=1, Python loops over a column, pd.concat inside a loop). The analysis is
+cached by code hash. When the node's previous run profiled the same code, each
+warning is annotated with the time measured for it, so the loops that actually
+dominate come first. cProfile times functions, not lines: a loop at module level
+(outside any function) can't be measured, and its warning says so instead.
+"""
+import ast
+
+from django.core.cache import cache
+
+from node_editor.sandbox import code_hash
+
+CACHE_PREFIX = 'python_code_advice'
+CACHE_TIMEOUT = 24 * 60 * 60
+# A warning is flagged as dominant when it accounts for this share of exec time
+DOMINANT_SHARE = 0.2
+
+SUGGESTIONS = {
+    'iterrows': (
+        'DataFrame.iterrows() builds a Series per row.',
+        "Use column expressions instead, e.g. df['total'] = df['price'] * df['qty'], "
+        "or df.itertuples() if a loop is unavoidable.",
+    ),
+    'apply_axis_1': (
+        'DataFrame.apply(axis=1) calls Python once per row.',
+        "Combine whole columns instead, e.g. df['a'] + df['b'], np.where(cond, x, y) "
+        "for conditionals, or Series.map for lookups.",
+    ),
+    'column_loop': (
+        'Looping over a column in Python processes one value at a time.',
+        "Use Series methods on the whole column (df['col'].str.upper(), df['col'] * 2, "
+        ".where/.mask) or build a list comprehension into a new column once.",
+    ),
+    'range_len_loop': (
+        'for i in range(len(df)) indexes the DataFrame row by row.',
+        'Operate on whole columns; use .shift() for neighbouring rows and .cumsum()/.cumprod() for running values.',
+    ),
+    'concat_in_loop': (
+        'pd.concat inside a loop copies all accumulated data on every iteration (quadratic).',
+        'Collect the pieces in a list and call pd.concat(pieces) once after the loop.',
+    ),
+}
+# Pandas functions whose profile entries measure a rule's cost
+PROFILE_FUNCTIONS = {
+    'iterrows': 'iterrows',
+    'apply_axis_1': 'apply',
+    'concat_in_loop': 'concat',
+}
+UNMEASURED_NOTE = (
+    'Not ranked: the profile times functions, and this loop runs at module level. '
+    'Move it into a function to have it measured.'
+)
+
+
+def _is_axis_1(call):
+    for keyword in call.keywords:
+        if keyword.arg == 'axis' and isinstance(keyword.value, ast.Constant):
+            return keyword.value.value in (1, 'columns')
+    return False
+
+
+def _is_column(node):
+    """df['col']"""
+    return isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant) \
+        and isinstance(node.slice.value, str)
+
+
+def _is_range_len(node):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name) and node.func.id == 'range'
+        and len(node.args) == 1
+        and isinstance(node.args[0], ast.Call)
+        and isinstance(node.args[0].func, ast.Name) and node.args[0].func.id == 'len'
+    )
+
+
+def _is_concat(call):
+    func = call.func
+    return (isinstance(func, ast.Attribute) and func.attr == 'concat') or \
+        (isinstance(func, ast.Name) and func.id == 'concat')
+
+
+def _callee(call):
+    """Name of the user function passed to apply, as cProfile reports it."""
+    if call.args:
+        func = call.args[0]
+    else:
+        func = next((k.value for k in call.keywords if k.arg == 'func'), None)
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Lambda):
+        return '<lambda>'
+    return None
+
+
+class _Visitor(ast.NodeVisitor):
+    def __init__(self):
+        self.findings = []
+        self._functions = []
+        self._loops = 0
+
+    def _add(self, rule, node, callee=None):
+        self.findings.append({
+            'rule': rule,
+            'line': node.lineno,
+            'col': node.col_offset,
+            'function_line': self._functions[-1] if self._functions else None,
+            'callee': callee,
+        })
+
+    def _visit_function(self, node):
+        self._functions.append(node.lineno)
+        loops, self._loops = self._loops, 0
+        self.generic_visit(node)
+        self._loops = loops
+        self._functions.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def _visit_loop(self, node):
+        if isinstance(node, ast.For):
+            if _is_column(node.iter):
+                self._add('column_loop', node)
+            elif _is_range_len(node.iter):
+                self._add('range_len_loop', node)
+        self._loops += 1
+        self.generic_visit(node)
+        self._loops -= 1
+
+    visit_For = _visit_loop
+    visit_While = _visit_loop
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute):
+            if node.func.attr == 'iterrows':
+                self._add('iterrows', node)
+            elif node.func.attr == 'apply' and _is_axis_1(node):
+                self._add('apply_axis_1', node, _callee(node))
+        if self._loops and _is_concat(node):
+            self._add('concat_in_loop', node)
+        self.generic_visit(node)
+
+
+def analyze_code(code):
+    """
+    Warnings for slow row-at-a-time patterns in code, cached by code hash.
+    Returns [] for code that doesn't parse (execution reports the syntax error).
+    """
+    key = f'{CACHE_PREFIX}:{code_hash(code)}'
+    findings = cache.get(key)
+    if findings is None:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+        visitor = _Visitor()
+        visitor.visit(tree)
+        findings = sorted(visitor.findings, key=lambda f: (f['line'], f['col']))
+        cache.set(key, findings, CACHE_TIMEOUT)
+
+    advice = []
+    for finding in findings:
+        message, suggestion = SUGGESTIONS[finding['rule']]
+        advice.append({**finding, 'message': message, 'suggestion': suggestion})
+    return advice
+
+
+def _measurable(warning):
+    """Whether any profile entry can be attributed to the warning."""
+    return bool(warning['function_line'] or warning['callee'] or warning['rule'] in PROFILE_FUNCTIONS)
+
+
+def _measured_ms(warning, functions, rule_counts):
+    """Largest cumulative time in the profile attributable to this warning, or None."""
+    lines = {warning['line'], warning['function_line']}
+    candidates = [
+        f['cumulative_time_ms'] for f in functions
+        if f['file'] == '<python_code>' and f['function'] != '<module>'
+        and (f['line'] in lines or f['function'] == warning['callee'])
+    ]
+    pandas_function = PROFILE_FUNCTIONS.get(warning['rule'])
+    if pandas_function and rule_counts[warning['rule']] == 1:
+        # Only unambiguous when the code has a single call of this kind
+        candidates += [
+            f['cumulative_time_ms'] for f in functions
+            if f['function'] == pandas_function and f['file'] != '<python_code>'
+        ]
+    return max(candidates) if candidates else None
+
+
+def rank_by_profile(advice, profile):
+    """
+    Annotate warnings with measured_ms / share of exec time from a previous run's
+    profile (response_data['profile']) and put the most expensive first. The
+    profile must come from the same code. Warnings that can't be measured (module
+    level loops) keep measured_ms None, get a note and go last.
+    """
+    functions = (profile or {}).get('functions') or []
+    if not functions:
+        return advice
+    exec_ms = (profile.get('phases_ms') or {}).get('exec_ms') or 0
+    rule_counts = {}
+    for warning in advice:
+        rule_counts[warning['rule']] = rule_counts.get(warning['rule'], 0) + 1
+
+    ranked = []
+    for warning in advice:
+        if not _measurable(warning):
+            ranked.append({**warning, 'measured_ms': None, 'note': UNMEASURED_NOTE})
+            continue
+        measured = _measured_ms(warning, functions, rule_counts)
+        warning = {**warning, 'measured_ms': measured}
+        if measured is not None and exec_ms:
+            warning['share'] = round(min(measured / exec_ms, 1.0), 3)
+            warning['dominant'] = warning['share'] >= DOMINANT_SHARE
+        ranked.append(warning)
+    ranked.sort(key=lambda w: (w['measured_ms'] is None, -(w['measured_ms'] or 0), w['line']))
+    return ranked
@@ -0,0 +1,217 @@
+"""
+Garbage collection of parquet artifacts.
+
+Two kinds of garbage pile up in the documents storage:
+- Documents in the "Parquet" collection that no node references any more: no
+  NodeArtifact points at them and no NodeItem has them as parquet_file_id.
+- Parquet artifact files under documents/ that no Document row points at:
+  files superseded before re-saves deleted the old file, written by a save that
+  never committed, or whose Document was deleted while its file cleanup task
+  never ran. Other files (uploads, exports) are never touched.
+
+Both are only collected once they are older than a grace period, so an
+artifact that is still being saved is never touched. Finished NodeRuns (and
+their output/progress NodeRunEvents) are deleted once they are older than
+NODE_RUN_RETENTION_SECONDS. Candidates are handled in
+batches and re-checked right before deletion; with dry_run nothing is deleted
+and the report says what would be reclaimed. Run it with
+`manage.py gc_artifacts`, or periodically with the collect_artifact_garbage
+task, which re-enqueues itself; the worker service starts that chain with
+`manage.py gc_artifacts --schedule-only` before db_worker.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.models import NodeArtifact, NodeItem, NodeRun, NodeRunEvent
+
+DEFAULT_MIN_AGE_SECONDS = 3600
+DEFAULT_RUN_RETENTION_SECONDS = 7 * 24 * 3600
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_INTERVAL_SECONDS = 6 * 3600
+DOCUMENTS_DIR = 'documents'
+ARTIFACT_SUFFIX = '.parquet'
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _size(storage, name):
+    try:
+        return storage.size(name)
+    except (OSError, NotImplementedError):
+        return 0
+
+
+def referenced_document_ids(document_ids=None):
+    """Ids of documents a node still uses (optionally only among document_ids)."""
+    artifacts = NodeArtifact.objects.all()
+    references = NodeItem.objects.filter(response_data__parquet_file_id__isnull=False)
+    if document_ids is not None:
+        artifacts = artifacts.filter(document_id__in=document_ids)
+        references = references.filter(response_data__parquet_file_id__in=document_ids)
+    ids = set(artifacts.values_list('document_id', flat=True))
+    for value in references.values_list('response_data__parquet_file_id', flat=True).iterator():
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
+def collect_documents(cutoff, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Delete unreferenced Parquet-collection Documents created before cutoff and their files."""
+    report = {'documents': 0, 'document_bytes': 0}
+    collection = Collection.objects.filter(name='Parquet').first()
+    if collection is None:
+        return report
+    referenced = referenced_document_ids()
+    candidates = (
+        Document.objects.filter(collection=collection, created_at__lt=cutoff)
+        .order_by('id').values_list('id', flat=True).iterator()
+    )
+    for batch in _batches((pk for pk in candidates if pk not in referenced), batch_size):
+        with transaction.atomic():
+            # A node may have picked one up since the references were read
+            ids = set(batch) - referenced_document_ids(batch)
+            documents = list(Document.objects.select_for_update().filter(id__in=ids))
+            sizes = {document.file.name: _size(document.file.storage, document.file.name) for document in documents}
+            if not dry_run:
+                Document.objects.filter(id__in=ids).delete()
+        if not dry_run:
+            for document in documents:
+                document.file.storage.delete(document.file.name)
+        report['documents'] += len(documents)
+        report['document_bytes'] += sum(sizes.values())
+    return report
+
+
+def _walk(storage, path):
+    try:
+        directories, files = storage.listdir(path)
+    except (FileNotFoundError, NotImplementedError):
+        return
+    for name in files:
+        yield f'{path}/{name}'
+    for directory in directories:
+        yield from _walk(storage, f'{path}/{directory}')
+
+
+def _older_than(storage, name, cutoff):
+    try:
+        modified = storage.get_modified_time(name)
+    except (OSError, NotImplementedError):
+        # Age unknown: keep it
+        return False
+    if timezone.is_naive(modified):
+        modified = timezone.make_aware(modified)
+    return modified < cutoff
+
+
+def collect_files(cutoff, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Delete parquet artifact files under documents/ that no Document points at and
+    were last modified before cutoff.
+    """
+    report = {'files': 0, 'file_bytes': 0}
+    storage = Document._meta.get_field('file').storage
+    known = set(Document.objects.values_list('file', flat=True).iterator())
+    candidates = (
+        name for name in _walk(storage, DOCUMENTS_DIR)
+        if name.endswith(ARTIFACT_SUFFIX) and name not in known and _older_than(storage, name, cutoff)
+    )
+    for batch in _batches(candidates, batch_size):
+        # A Document may have been saved with one of these names since
+        orphans = set(batch) - set(Document.objects.filter(file__in=batch).values_list('file', flat=True))
+        for name in orphans:
+            report['file_bytes'] += _size(storage, name)
+            if not dry_run:
+                storage.delete(name)
+        report['files'] += len(orphans)
+    return report
+
+
+def collect_runs(cutoff, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Delete NodeRuns that finished before cutoff, with their events."""
+    report = {'runs': 0, 'run_events': 0}
+    candidates = (
+        NodeRun.objects.filter(status__in=NodeRun.FINISHED_STATUSES, finished__lt=cutoff)
+        .order_by('finished').values_list('id', flat=True).iterator()
+    )
+    for batch in _batches(candidates, batch_size):
+        events = NodeRunEvent.objects.filter(run_id__in=batch)
+        if dry_run:
+            report['run_events'] += events.count()
+        else:
+            with transaction.atomic():
+                report['run_events'] += events.delete()[0]
+                NodeRun.objects.filter(id__in=batch).delete()
+        report['runs'] += len(batch)
+    return report
+
+
+def collect_garbage(min_age_seconds=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, run_retention_seconds=None):
+    """
+    Collect orphaned artifact Documents, then artifact files no Document references, then
+    old finished runs. Returns counts and bytes reclaimed (or reclaimable, with dry_run).
+    """
+    if min_age_seconds is None:
+        min_age_seconds = getattr(settings, 'ARTIFACT_GC_MIN_AGE_SECONDS', DEFAULT_MIN_AGE_SECONDS)
+    if run_retention_seconds is None:
+        run_retention_seconds = getattr(settings, 'NODE_RUN_RETENTION_SECONDS', DEFAULT_RUN_RETENTION_SECONDS)
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=min_age_seconds)
+    report = {
+        **collect_documents(cutoff, batch_size, dry_run),
+        **collect_files(cutoff, batch_size, dry_run),
+        **collect_runs(now - datetime.timedelta(seconds=run_retention_seconds), batch_size, dry_run),
+        'dry_run': dry_run,
+    }
+    report['bytes_reclaimed'] = report['document_bytes'] + report['file_bytes']
+    return report
+
+
+def _pending_run(task):
+    """The queued (not yet started) result of task on the database task backend, if any."""
+    from django_tasks.backends.database import DatabaseBackend
+    from django_tasks.backends.database.models import DBTaskResult
+    from django_tasks.task import ResultStatus
+
+    backend = task.get_backend()
+    if not isinstance(backend, DatabaseBackend):
+        return None
+    pending = DBTaskResult.objects.filter(
+        task_path=task.module_path, backend_name=backend.alias, status=ResultStatus.READY,
+    ).order_by('run_after').first()
+    return pending.task_result if pending is not None else None
+
+
+def schedule_garbage_collection():
+    """
+    Enqueue the next collect_artifact_garbage run ARTIFACT_GC_INTERVAL_SECONDS from
+    now, unless one is already queued: the task re-enqueues itself, so there is
+    only ever one chain. Returns the queued task result, or None when the
+    interval is 0 or the task backend can't defer tasks.
+    """
+    from node_editor.tasks import collect_artifact_garbage
+
+    interval = getattr(settings, 'ARTIFACT_GC_INTERVAL_SECONDS', DEFAULT_INTERVAL_SECONDS)
+    if interval <= 0 or not collect_artifact_garbage.get_backend().supports_defer:
+        return None
+    pending = _pending_run(collect_artifact_garbage)
+    if pending is not None:
+        return pending
+    run_after = timezone.now() + datetime.timedelta(seconds=interval)
+    return collect_artifact_garbage.using(run_after=run_after).enqueue()
@@ -0,0 +1,98 @@
+"""
+Cancellation of in-flight node runs.
+
+DELETE /node_editor/run/<id>/ marks a NodeRun 'cancelled'. The process executing
+it (db_worker, or the web process for a formData PUT) notices the flag
+cooperatively: readers check it between record batches and python_code polls it
+while queued for an execution slot and while waiting for its sandbox worker,
+which is killed on cancel. Every artifact
+save writes its file first and then records it under unless_cancelled, so a
+cancelled run never replaces the node's output. The run stops with
+RunCancelled; partial output only ever lives in temporary or not yet recorded
+files, which are removed as the exception unwinds.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.utils import timezone
+
+from node_editor.models import NodeRun
+
+# Seconds between two status reads of the same run
+CHECK_INTERVAL = 0.5
+
+
+class RunCancelled(Exception):
+    """The NodeRun this work belongs to was cancelled."""
+
+    def __init__(self, message='Run was cancelled.'):
+        super().__init__(message)
+
+
+def cancel_run(run):
+    """Mark a queued or running NodeRun cancelled. Returns False if it had already finished."""
+    cancelled = NodeRun.objects.filter(pk=run.pk, status__in=('queued', 'running')).update(
+        status='cancelled', finished=timezone.now(),
+    )
+    run.refresh_from_db()
+    return bool(cancelled)
+
+
+def is_cancelled(run_id):
+    return NodeRun.objects.filter(pk=run_id, status='cancelled').exists()
+
+
+class CancelCheck:
+    """
+    Callable that raises RunCancelled once the run has been cancelled. The status
+    is read at most every interval seconds, so it is cheap to call per batch.
+    """
+
+    def __init__(self, run_id, interval=CHECK_INTERVAL):
+        self.run_id = run_id
+        self.interval = interval
+        self._checked = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def cancelled(self):
+        with self._lock:
+            now = time.monotonic()
+            if not self._cancelled and (self._checked is None or now - self._checked >= self.interval):
+                self._checked = now
+                self._cancelled = is_cancelled(self.run_id)
+            return self._cancelled
+
+    def __call__(self):
+        if self.cancelled():
+            raise RunCancelled()
+
+
+@contextmanager
+def unless_cancelled(run_id):
+    """
+    Guard the database side of an artifact save: raise RunCancelled if the run
+    was cancelled, else hold its row lock for the block, so a cancel (or
+    supersede) issued meanwhile waits until the save has committed. Keep the
+    block short (no file copies): runs of one workflow share the lock. A no-op
+    lock without a run_id.
+    """
+    with transaction.atomic():
+        if run_id:
+            status = NodeRun.objects.select_for_update().filter(pk=run_id).values_list('status', flat=True).first()
+            if status == 'cancelled':
+                raise RunCancelled()
+        yield
+
+
+def _never_cancelled():
+    return None
+
+
+def cancel_check(run_id):
+    """CancelCheck for a NodeRun id (formData's run_id); a no-op when there is no run."""
+    if not run_id:
+        return _never_cancelled
+    return CancelCheck(run_id)
@@ -19,3 +19,11 @@ def get_reader_function(original_id):
     return READER_FUNCTIONS.get(original_id)
 
 
+def run_reader(original_id, form_data):
+    """Run the node's reader function, skipping it when its fingerprint is unchanged."""
+    from node_editor.memo import run_memoized
+
+    reader_function = get_reader_function(original_id)
+    if not reader_function:
+        return {}
+    return run_memoized(original_id, reader_function, form_data)
@@ -0,0 +1,232 @@
+"""
+Workflow executor: runs a whole workflow server-side.
+
+The workflow's NodeItem/Connection graph is sorted topologically and every node
+is run through the same reader functions the formData PUT and PATCH use.
+Independent branches run concurrently in a bounded thread pool (pyarrow/pandas
+I/O releases the GIL); a node only starts once all of its upstream nodes have
+succeeded.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+
+from node_editor.cancellation import cancel_check
+from node_editor.dispatcher import get_reader_function, run_reader
+from node_editor.models import NodeItem, Connection
+from node_editor.planner import build_plan, execute_stage
+from node_editor.progress import WorkflowProgress
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class WorkflowCycleError(ValueError):
+    """Raised when a workflow's connections do not form a DAG."""
+
+
+def topological_order(node_ids, edges):
+    """
+    Return node_ids in dependency order (Kahn's algorithm).
+    Ties keep the order of node_ids so the result is deterministic.
+    """
+    node_ids = list(node_ids)
+    edges = list(dict.fromkeys(edges))
+    successors = {node_id: [] for node_id in node_ids}
+    in_degree = {node_id: 0 for node_id in node_ids}
+    for source, target in edges:
+        successors[source].append(target)
+        in_degree[target] += 1
+
+    ready = [node_id for node_id in node_ids if in_degree[node_id] == 0]
+    order = []
+    while ready:
+        node_id = ready.pop(0)
+        order.append(node_id)
+        for target in successors[node_id]:
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                ready.append(target)
+
+    if len(order) != len(node_ids):
+        cyclic = [node_id for node_id in node_ids if in_degree[node_id] > 0]
+        raise WorkflowCycleError(f'Workflow contains a cycle between nodes: {cyclic}')
+    return order
+
+
+def execute_dag(node_ids, edges, run_fn, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run run_fn(node_id) for every node, starting each node as soon as all of its
+    upstream nodes have succeeded. Nodes downstream of a failure are skipped.
+    Returns {node_id: {'status': ..., 'result' | 'error': ...}}.
+    """
+    edges = list(dict.fromkeys(edges))
+    order = topological_order(node_ids, edges)
+    predecessors = {node_id: set() for node_id in order}
+    successors = {node_id: [] for node_id in order}
+    for source, target in edges:
+        predecessors[target].add(source)
+        successors[source].append(target)
+
+    results = {}
+    pending = {node_id: len(predecessors[node_id]) for node_id in order}
+
+    def skip_descendants(node_id):
+        stack = list(successors[node_id])
+        while stack:
+            child = stack.pop()
+            if child in results:
+                continue
+            results[child] = {'status': 'skipped', 'error': f'Upstream node {node_id} did not succeed.'}
+            stack.extend(successors[child])
+
+    def record(node_id, outcome):
+        results[node_id] = outcome
+        if outcome['status'] != 'success':
+            skip_descendants(node_id)
+            return []
+        ready = []
+        for child in successors[node_id]:
+            pending[child] -= 1
+            if pending[child] == 0 and child not in results:
+                ready.append(child)
+        return ready
+
+    def call(node_id):
+        try:
+            return {'status': 'success', 'result': run_fn(node_id)}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+
+    ready = [node_id for node_id in order if pending[node_id] == 0]
+
+    # Run inline when no concurrency is wanted (also keeps tests in one DB connection)
+    if max_workers <= 1:
+        while ready:
+            node_id = ready.pop(0)
+            ready.extend(record(node_id, call(node_id)))
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {pool.submit(call, node_id): node_id for node_id in ready}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = running.pop(future)
+                for child in record(node_id, future.result()):
+                    running[pool.submit(call, child)] = child
+    return results
+
+
+def build_form_data(node_item, run_id=None):
+    """formData as the frontend would send it for a run of this node."""
+    form_data = dict(node_item.formData or {})
+    form_data['node_item_id'] = node_item.id
+    if run_id is not None:
+        form_data['run_id'] = str(run_id)
+    if node_item.original_id == 'python_code':
+        # python_code only executes when input_data is present (otherwise it is a save)
+        parent_response = node_item.parent.response_data if node_item.parent else None
+        form_data['input_data'] = parent_response or {'node_item_id': node_item.id}
+    return form_data
+
+
+def run_node_item(node_item, run_id=None):
+    """Run one NodeItem through its reader function and store its response_data."""
+    reader_function = get_reader_function(node_item.original_id)
+    if not reader_function:
+        return node_item.response_data or {}
+    response_data = run_reader(node_item.original_id, build_form_data(node_item, run_id))
+    NodeItem.objects.filter(pk=node_item.pk).update(response_data=response_data)
+    if isinstance(response_data, dict) and response_data.get('status') == 'error':
+        raise RuntimeError(response_data.get('error') or 'Node execution failed.')
+    return response_data
+
+
+def workflow_graph(workflow):
+    """
+    Return (node_items by html_id, edges, order) for a workflow.
+    Raises WorkflowCycleError if the connections contain a cycle.
+    """
+    node_items = {
+        node_item.html_id: node_item
+        for node_item in NodeItem.objects.filter(workflow=workflow).select_related('parent')
+    }
+    edges = [
+        (c.sourceId, c.targetId)
+        for c in Connection.objects.filter(workflow=workflow)
+        if c.sourceId in node_items and c.targetId in node_items
+    ]
+    return node_items, edges, topological_order(node_items, edges)
+
+
+def run_workflow(workflow, max_workers=None, lazy=False, preview=(), run_id=None):
+    """
+    Execute every node of the workflow in dependency order.
+    With lazy=True, select_columns chains are fused into their consumer (see
+    node_editor.planner) and only sinks and the nodes in preview are materialized.
+    run_id (a NodeRun) is passed on to the nodes so they can record run events
+    and stop when the run is cancelled; nodes not started by then fail with
+    RunCancelled and their descendants are skipped.
+    Returns a summary with per-node status and response_data.
+    """
+    if max_workers is None:
+        max_workers = getattr(settings, 'WORKFLOW_RUN_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+
+    node_items, edges, order = workflow_graph(workflow)
+    plan = build_plan(node_items, edges, order, preview) if lazy else {'deferred': {}, 'stages': {}}
+    check_cancel = cancel_check(run_id)
+    progress = WorkflowProgress(run_id, len(order))
+
+    def run_one(html_id):
+        check_cancel()
+        if html_id in plan['deferred']:
+            return None
+        if html_id in plan['stages']:
+            response_data = execute_stage(plan['stages'][html_id], node_items, run_id)
+            NodeItem.objects.filter(pk=node_items[html_id].pk).update(response_data=response_data)
+            return response_data
+        # Reload so parent.response_data reflects upstream runs in this workflow
+        return run_node_item(
+            NodeItem.objects.select_related('parent').get(pk=node_items[html_id].pk), run_id
+        )
+
+    def run(html_id):
+        try:
+            result = run_one(html_id)
+        except Exception:
+            progress.node_finished(html_id, 'error')
+            raise
+        else:
+            progress.node_finished(html_id, 'success')
+            return result
+        finally:
+            if max_workers > 1:
+                # Worker threads get their own DB connection; don't leak it
+                connection.close()
+
+    start = time.perf_counter()
+    results = execute_dag(order, edges, run, max_workers=max_workers)
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+
+    nodes = {}
+    for html_id in order:
+        outcome = results[html_id]
+        entry = {'status': outcome['status']}
+        if outcome['status'] == 'success' and html_id in plan['deferred']:
+            entry = {'status': 'fused', 'fused_into': plan['deferred'][html_id]}
+        elif outcome['status'] == 'success':
+            entry['response_data'] = outcome['result']
+        else:
+            entry['error'] = outcome['error']
+        nodes[html_id] = entry
+
+    failed = any(entry['status'] not in ('success', 'fused') for entry in nodes.values())
+    return {
+        'workflow_id': workflow.id,
+        'status': 'error' if failed else 'success',
+        'order': order,
+        'nodes': nodes,
+        'execution_time_ms': elapsed_ms,
+    }
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from node_editor.artifact_gc import DEFAULT_BATCH_SIZE, collect_garbage, schedule_garbage_collection
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete parquet artifact Documents no node references, parquet files under documents/ '
+        'no Document references and old finished runs, in batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--min-age', type=int, default=None,
+            help='Only collect garbage older than this many seconds (default ARTIFACT_GC_MIN_AGE_SECONDS).',
+        )
+        parser.add_argument(
+            '--schedule', action='store_true',
+            help='Also enqueue the periodic collect_artifact_garbage task unless it is already queued '
+                 '(it re-enqueues itself).',
+        )
+        parser.add_argument(
+            '--schedule-only', action='store_true',
+            help='Only enqueue the periodic task, without collecting now (run on worker start).',
+        )
+
+    def handle(self, *args, **options):
+        if options['schedule_only']:
+            self.schedule()
+            return
+        report = collect_garbage(
+            min_age_seconds=options['min_age'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'Would delete' if report['dry_run'] else 'Deleted'
+        self.stdout.write(f"{verb} {report['documents']} documents ({report['document_bytes']} bytes)")
+        self.stdout.write(f"{verb} {report['files']} unreferenced files ({report['file_bytes']} bytes)")
+        self.stdout.write(f"{verb} {report['runs']} finished runs ({report['run_events']} events)")
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Reclaimable' if report['dry_run'] else 'Reclaimed'}: {report['bytes_reclaimed']} bytes"
+        ))
+        if options['schedule']:
+            self.schedule()
+
+    def schedule(self):
+        result = schedule_garbage_collection()
+        if result is None:
+            self.stdout.write(self.style.WARNING(
+                'Not scheduled: ARTIFACT_GC_INTERVAL_SECONDS is 0 or the task backend cannot defer tasks.'
+            ))
+        else:
+            self.stdout.write(f'The periodic collect_artifact_garbage task runs next at {result.task.run_after}.')
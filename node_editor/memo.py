@@ -0,0 +1,129 @@
+"""
+Content-hash memoization for node runs.
+
+Each node's output is recorded against a fingerprint made of its reader id, its
+normalized formData and the hashes of its input artifacts. A re-run with the same
+fingerprint returns the stored response_data without touching pandas.
+"""
+import hashlib
+import json
+
+from django.utils import timezone
+from wagtail.documents.models import Document
+
+from node_editor.models import NodeArtifact, NodeItem
+
+MEMOIZED_READERS = {'read_csv', 'read_json', 'read_excel', 'select_columns', 'python_code'}
+
+# formData keys that do not change a node's output (input_data is covered by the input hash)
+VOLATILE_KEYS = {'node_item_id', 'input_data', 'force', 'run_id'}
+
+
+def _hash_text(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def normalize_form_data(form_data):
+    """Canonical JSON of the formData keys that affect a node's output."""
+    relevant = {k: v for k, v in (form_data or {}).items() if k not in VOLATILE_KEYS}
+    return json.dumps(relevant, sort_keys=True, default=str, separators=(',', ':'))
+
+
+def document_hash(document_id):
+    """Content hash of a Wagtail Document (computed once and stored on the row)."""
+    try:
+        document = Document.objects.get(id=document_id)
+    except (Document.DoesNotExist, ValueError, TypeError):
+        return None
+    return document.get_file_hash()
+
+
+def input_hashes(form_data, node_item):
+    """
+    Hashes of everything a node reads: the uploaded file for readers, the parent's
+    artifact for transforms. Returns None when an input cannot be resolved.
+    """
+    hashes = []
+
+    file_id = form_data.get('file_id')
+    if file_id is not None:
+        file_hash = document_hash(file_id)
+        if file_hash is None:
+            return None
+        hashes.append(f'file:{file_hash}')
+
+    if node_item.parent:
+        parent_response = node_item.parent.response_data or {}
+        if parent_response.get('fingerprint'):
+            # The parent's fingerprint identifies the artifact it produced
+            hashes.append(f"parent:{parent_response['fingerprint']}")
+        elif parent_response.get('parquet_file_id') is not None:
+            parent_hash = document_hash(parent_response['parquet_file_id'])
+            if parent_hash is None:
+                return None
+            hashes.append(f'parent:{parent_hash}')
+        else:
+            return None
+    elif form_data.get('input_data'):
+        input_data = form_data['input_data']
+        if input_data.get('parquet_file_id') is not None:
+            input_hash = document_hash(input_data['parquet_file_id'])
+            if input_hash is None:
+                return None
+            hashes.append(f'input:{input_hash}')
+        else:
+            hashes.append(f"input:{_hash_text(input_data.get('html_table', ''))}")
+
+    return hashes
+
+
+def compute_fingerprint(original_id, form_data, node_item):
+    """Fingerprint of a node run, or None when it cannot be determined."""
+    hashes = input_hashes(form_data, node_item)
+    if hashes is None:
+        return None
+    return _hash_text('|'.join([original_id, normalize_form_data(form_data), *hashes]))
+
+
+def _artifact_exists(response_data):
+    parquet_file_id = response_data.get('parquet_file_id')
+    return parquet_file_id is not None and Document.objects.filter(id=parquet_file_id).exists()
+
+
+def run_memoized(original_id, reader_function, form_data):
+    """Call reader_function(form_data) unless a run with the same fingerprint is stored."""
+    if original_id not in MEMOIZED_READERS:
+        return reader_function(form_data)
+    # python_code without input_data is a plain save, not a run
+    if original_id == 'python_code' and not form_data.get('input_data'):
+        return reader_function(form_data)
+
+    node_item = NodeItem.objects.select_related('parent').filter(
+        id=form_data.get('node_item_id')
+    ).first()
+    if node_item is None:
+        return reader_function(form_data)
+
+    fingerprint = compute_fingerprint(original_id, form_data, node_item)
+    stored = node_item.response_data or {}
+    if (
+        fingerprint is not None
+        and not form_data.get('force')
+        and stored.get('fingerprint') == fingerprint
+        and _artifact_exists(stored)
+    ):
+        NodeArtifact.objects.filter(document_id=stored['parquet_file_id']).update(accessed=timezone.now())
+        return {**stored, 'memoized': True}
+
+    response_data = reader_function(form_data)
+    if (
+        fingerprint is not None
+        and isinstance(response_data, dict)
+        and response_data.get('status') != 'error'
+        and response_data.get('parquet_file_id') is not None
+    ):
+        response_data = {**response_data, 'fingerprint': fingerprint, 'memoized': False}
+        NodeArtifact.objects.filter(
+            node_item=node_item, document_id=response_data['parquet_file_id'],
+        ).update(fingerprint=fingerprint)
+    return response_data
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:46
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('form_data', models.JSONField(blank=True, null=True)),
+                ('response_data', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('task_id', models.CharField(blank=True, max_length=64, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('node_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='node_editor.nodeitem')),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='node_editor.workflow')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
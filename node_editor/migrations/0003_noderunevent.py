@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0002_noderun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeRunEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('stdout', 'Stdout'), ('stderr', 'Stderr')], max_length=20)),
+                ('data', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('node_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='run_events', to='node_editor.nodeitem')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='node_editor.noderun')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
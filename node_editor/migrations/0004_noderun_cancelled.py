@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0003_noderunevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='noderun',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20),
+        ),
+    ]
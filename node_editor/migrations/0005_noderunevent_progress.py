@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0004_noderun_cancelled'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='noderunevent',
+            name='kind',
+            field=models.CharField(choices=[('stdout', 'Stdout'), ('stderr', 'Stderr'), ('progress', 'Progress')], max_length=20),
+        ),
+    ]
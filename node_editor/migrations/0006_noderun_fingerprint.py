@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0005_noderunevent_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noderun',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
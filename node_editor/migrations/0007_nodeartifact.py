@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0006_noderun_fingerprint'),
+        ('wagtaildocs', '0014_alter_document_file_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('byte_size', models.BigIntegerField(blank=True, null=True)),
+                ('row_count', models.BigIntegerField(blank=True, null=True)),
+                ('schema', models.JSONField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('accessed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='node_artifacts', to='wagtaildocs.document')),
+                ('node_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='artifact', to='node_editor.nodeitem')),
+            ],
+            options={
+                'ordering': ['-accessed'],
+            },
+        ),
+    ]
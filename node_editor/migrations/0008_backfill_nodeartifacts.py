@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+def backfill_node_artifacts(apps, schema_editor):
+    """
+    Link each node to the Document its parquet artifact was found by until now
+    (title == html_id in the "Parquet" collection). Row count and schema come from
+    the stats kept in the node's response_data, so no file is read here.
+    """
+    Collection = apps.get_model('wagtailcore', 'Collection')
+    Document = apps.get_model('wagtaildocs', 'Document')
+    NodeItem = apps.get_model('node_editor', 'NodeItem')
+    NodeArtifact = apps.get_model('node_editor', 'NodeArtifact')
+
+    collection = Collection.objects.filter(name='Parquet').first()
+    if collection is None:
+        return
+    documents = {}
+    # On a title collision the lowest id wins, as with the old .first() lookup
+    for document in Document.objects.filter(collection=collection).order_by('id'):
+        documents.setdefault(document.title, document)
+
+    artifacts = []
+    for node_item in NodeItem.objects.filter(html_id__in=list(documents)).iterator():
+        document = documents[node_item.html_id]
+        response_data = node_item.response_data or {}
+        stats = response_data.get('stats') or {}
+        column_types = stats.get('column_types') or {}
+        artifacts.append(NodeArtifact(
+            node_item=node_item,
+            document=document,
+            fingerprint=response_data.get('fingerprint'),
+            byte_size=document.file_size,
+            row_count=stats.get('rows'),
+            schema=[{'name': name, 'type': column_types.get(name)} for name in stats.get('column_names') or []] or None,
+        ))
+    NodeArtifact.objects.bulk_create(artifacts, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('node_editor', '0007_nodeartifact'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_node_artifacts, migrations.RunPython.noop),
+    ]
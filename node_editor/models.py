@@ -1,7 +1,10 @@
+import uuid
+
 from django.db import models, transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 from wagtail.images.models import Image
 from wagtail.admin.panels import FieldPanel
@@ -129,6 +132,13 @@ class NodeItem(models.Model):
             nodes_to_check.extend(node.children.all())
         return descendants
 
+    def delete_documents(self):
+        """Delete the node's parquet artifact and, for save_file, its export document."""
+        document_ids = list(NodeArtifact.objects.filter(node_item=self).values_list('document_id', flat=True))
+        if self.original_id == 'save_file' and (self.response_data or {}).get('file_id') is not None:
+            document_ids.append(self.response_data['file_id'])
+        Document.objects.filter(id__in=document_ids).delete()
+
     def delete(self, *args, **kwargs):
         # Use transaction to ensure all deletions succeed or fail together
         with transaction.atomic():
@@ -137,7 +147,7 @@ class NodeItem(models.Model):
             Connection.objects.filter(workflow=self.workflow, targetId=self.html_id).delete()
 
             # Delete associated documents
-            Document.objects.filter(title=self.html_id).delete()
+            self.delete_documents()
 
             # Delete the NodeItem itself
             super(NodeItem, self).delete(*args, **kwargs)
@@ -159,6 +169,88 @@ class Connection(models.Model):
     ]
 
 
+class NodeRun(models.Model):
+    """One queued execution of a NodeItem, or of a whole Workflow when node_item is empty."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    workflow = models.ForeignKey(Workflow, on_delete=models.CASCADE, related_name='runs')
+    node_item = models.ForeignKey(NodeItem, null=True, blank=True, on_delete=models.CASCADE, related_name='runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    form_data = models.JSONField(null=True, blank=True)
+    response_data = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    task_id = models.CharField(max_length=64, null=True, blank=True)
+    # Identifies what a node run computes; identical in-flight runs are coalesced
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        target = self.node_item.html_id if self.node_item_id else f'workflow {self.workflow_id}'
+        return f'{target} ({self.status})'
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+
+class NodeRunEvent(models.Model):
+    """Output and progress produced while a NodeRun executes, streamed to clients in id order."""
+    KIND_CHOICES = [
+        ('stdout', 'Stdout'),
+        ('stderr', 'Stderr'),
+        ('progress', 'Progress'),
+    ]
+
+    run = models.ForeignKey(NodeRun, on_delete=models.CASCADE, related_name='events')
+    node_item = models.ForeignKey(NodeItem, null=True, blank=True, on_delete=models.CASCADE, related_name='run_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    data = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.run_id} {self.kind}'
+
+
+class NodeArtifact(models.Model):
+    """
+    The parquet output of a NodeItem, stored as a Document in the "Parquet"
+    collection. Size, row count and schema are read from the file when it is
+    saved; accessed is bumped whenever the artifact is read or reused.
+    """
+    node_item = models.OneToOneField(NodeItem, on_delete=models.CASCADE, related_name='artifact')
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='node_artifacts')
+    # Fingerprint of the run that produced the file (see node_editor.memo)
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    byte_size = models.BigIntegerField(null=True, blank=True)
+    row_count = models.BigIntegerField(null=True, blank=True)
+    # [{'name': ..., 'type': ...}] in column order
+    schema = models.JSONField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    accessed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-accessed']
+
+    def __str__(self):
+        return f'{self.node_item.html_id} -> {self.document_id}'
+
+
 @receiver(post_save, sender=Connection)
 def connection_post_save_set_parent(sender, instance, created, **kwargs):
     """On new connection, set target NodeItem's parent to source NodeItem."""
@@ -193,7 +285,7 @@ def connection_post_delete_clear_parent(sender, instance, **kwargs):
         workflow=instance.workflow, html_id=instance.targetId
     ).first()
     if target:
-        Document.objects.filter(title=target.html_id).delete()
+        target.delete_documents()
         target.parent = None
         target.formData = None
         target.response_data = None
@@ -0,0 +1,169 @@
+"""
+Lazy query planner for workflow runs.
+
+In lazy mode a node does not materialize its parquet when nothing needs it:
+every select_columns → ... → save_file (or select_columns) hop becomes an
+operation in a plan, and each linear chain is fused into one pyarrow dataset
+scan of the nearest materialized ancestor with the combined projection.
+Data is only written at sinks and at nodes the user is previewing.
+"""
+import tempfile
+
+import pyarrow.parquet as pq
+from django.core.files import File
+from wagtail.documents.models import Document
+
+from node_editor.models import NodeItem
+from node_editor.utils.artifacts import parquet_metadata, save_parquet_document, scan_parquet
+from node_editor.utils.preview import parquet_response, table_preview
+from node_editor.utils.save_file import export_format, write_export
+
+# Nodes whose work is a pure projection of their input
+FUSABLE = {'select_columns'}
+# Nodes that consume a plan and write a final output
+SINKS = {'save_file'}
+
+
+def node_operation(node_item):
+    """The plan operation a node contributes: {'node', 'op', ...}."""
+    form_data = node_item.formData or {}
+    if node_item.original_id == 'select_columns':
+        columns = form_data.get('selected_columns') or form_data.get('columns') or []
+        return {'node': node_item.html_id, 'op': 'project', 'columns': list(columns)}
+    if node_item.original_id == 'save_file':
+        return {'node': node_item.html_id, 'op': 'write', 'format': form_data.get('format')}
+    return {'node': node_item.html_id, 'op': 'materialize', 'type': node_item.original_id}
+
+
+def build_plan(node_items, edges, order, preview=()):
+    """
+    Group the workflow into stages. A fusable node is deferred when it is not being
+    previewed and its only consumer is another fusable node or a sink; each
+    remaining fusable node or sink with deferred ancestors becomes a fused stage
+    that scans the nearest materialized ancestor.
+    Returns {'deferred': {html_id: target}, 'stages': {target: stage}}.
+    """
+    preview = set(preview)
+    parents = {html_id: [] for html_id in order}
+    children = {html_id: [] for html_id in order}
+    for source, target in dict.fromkeys(edges):
+        parents[target].append(source)
+        children[source].append(target)
+
+    def fusable(html_id, kinds=FUSABLE):
+        return node_items[html_id].original_id in kinds and len(parents[html_id]) == 1
+
+    deferred = set()
+    for html_id in order:
+        consumers = children[html_id]
+        if (
+            fusable(html_id)
+            and html_id not in preview
+            and len(consumers) == 1
+            and fusable(consumers[0], FUSABLE | SINKS)
+        ):
+            deferred.add(html_id)
+
+    stages = {}
+    assigned = {}
+    for html_id in order:
+        if html_id in deferred or not fusable(html_id, FUSABLE | SINKS):
+            continue
+        chain = []
+        source = parents[html_id][0]
+        while source in deferred:
+            chain.insert(0, source)
+            source = parents[source][0]
+        if not chain:
+            continue
+        stages[html_id] = {
+            'target': html_id,
+            'source': source,
+            'fused': chain,
+            'operations': [node_operation(node_items[h]) for h in chain + [html_id]],
+        }
+        for fused_id in chain:
+            assigned[fused_id] = html_id
+
+    return {'deferred': assigned, 'stages': stages}
+
+
+def explain(node_items, order, plan):
+    """Human-readable description of what a lazy run would do, node by node."""
+    steps = []
+    for html_id in order:
+        if html_id in plan['deferred']:
+            steps.append({'node': html_id, 'action': 'fused', 'into': plan['deferred'][html_id]})
+        elif html_id in plan['stages']:
+            stage = plan['stages'][html_id]
+            steps.append({
+                'node': html_id,
+                'action': 'scan',
+                'source': stage['source'],
+                'fused': stage['fused'],
+                'columns': stage_columns(stage),
+                'operations': stage['operations'],
+            })
+        else:
+            steps.append({'node': html_id, 'action': 'run', 'type': node_items[html_id].original_id})
+    return steps
+
+
+def stage_columns(stage):
+    """Columns the fused scan has to read: the last projection in the chain (None = all)."""
+    columns = None
+    for operation in stage['operations']:
+        if operation['op'] == 'project':
+            columns = operation['columns']
+    return columns
+
+
+def _projected_columns(stage, available):
+    """Check each projection against the columns its input has and return the final one."""
+    columns = list(available)
+    for operation in stage['operations']:
+        if operation['op'] != 'project':
+            continue
+        if not operation['columns']:
+            raise ValueError(f"No columns selected in {operation['node']}. Please select at least one column.")
+        missing = [c for c in operation['columns'] if c not in columns]
+        if missing:
+            raise ValueError(f"Columns not found in data for {operation['node']}: {missing}")
+        columns = operation['columns']
+    return columns
+
+
+def execute_stage(stage, node_items, run_id=None):
+    """
+    Run a fused stage: one projected scan of the source's parquet, then write the
+    target's output (its own parquet for select_columns, the export for save_file)
+    unless run_id's NodeRun was cancelled. Returns the target's response_data.
+    """
+    # Reload: the source ran earlier in this workflow run
+    source = NodeItem.objects.get(pk=node_items[stage['source']].pk)
+    target = node_items[stage['target']]
+    parquet_file_id = (source.response_data or {}).get('parquet_file_id')
+    if parquet_file_id is None:
+        raise ValueError(f"No input data. Node {source.html_id} has no parquet output.")
+    try:
+        parquet_doc = Document.objects.get(id=parquet_file_id)
+    except Document.DoesNotExist:
+        raise ValueError(f'Parquet document with id {parquet_file_id} does not exist.')
+
+    _, schema = parquet_metadata(parquet_doc)
+    table = scan_parquet(parquet_doc, columns=_projected_columns(stage, schema.names))
+
+    if target.original_id in SINKS:
+        document = write_export(target, table, export_format(target.formData or {}), run_id)
+        response_data = {
+            **table_preview(table),
+            'file_id': document.id,
+            'file_url': document.file.url,
+            'file_title': document.title,
+        }
+    else:
+        with tempfile.NamedTemporaryFile(suffix='.parquet') as tmp:
+            pq.write_table(table, tmp.name)
+            response_data = parquet_response(save_parquet_document(target, File(tmp), run_id))
+    response_data['fused'] = stage['fused']
+    return response_data
@@ -0,0 +1,139 @@
+"""
+Progress events for node runs.
+
+Readers and writers report the phase they are in (parse / convert / write), the
+bytes and rows handled so far and, when the total is known, an ETA. Each report
+is stored as a 'progress' NodeRunEvent, so clients follow it on the run's SSE
+stream (GET run/<id>/events/) instead of holding the request open. Updates
+within a phase are throttled to one event per PROGRESS_INTERVAL seconds, and a
+node keeps a single progress row per run: each report replaces the previous
+one under a new id, so streams still pick every report up.
+"""
+import json
+import threading
+import time
+
+from django.db import transaction
+
+from node_editor.models import NodeRunEvent
+
+PROGRESS_INTERVAL = 0.5
+
+
+class ProgressReporter:
+    """
+    Progress of one node inside a NodeRun. Without a run_id every call is a no-op,
+    so readers can report unconditionally. Safe to share between threads.
+    """
+
+    def __init__(self, run_id=None, node_item_id=None, interval=None):
+        self.run_id = run_id
+        self.node_item_id = node_item_id
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.phase_name = None
+        self.bytes_read = 0
+        self.rows = 0
+        self.total_bytes = None
+        self.total_rows = None
+        self._phase_started = None
+        self._last_emit = None
+        self._lock = threading.Lock()
+
+    def phase(self, name, total_bytes=None, total_rows=None, restart=False):
+        """
+        Enter a new phase. Byte/row counters carry over unless restart is set
+        (e.g. a reader that starts the input again); totals are replaced.
+        """
+        with self._lock:
+            if restart:
+                self.bytes_read = self.rows = 0
+            self.phase_name = name
+            self.total_bytes = total_bytes
+            self.total_rows = total_rows
+            self._phase_started = time.monotonic()
+            self._emit()
+
+    def advance(self, bytes_read=0, rows=0):
+        """Count more bytes/rows handled in the current phase."""
+        with self._lock:
+            self.bytes_read += bytes_read
+            self.rows += rows
+            if self._last_emit is None or time.monotonic() - self._last_emit >= self.interval:
+                self._emit()
+
+    def done(self):
+        with self._lock:
+            self.phase_name = 'done'
+            self.total_bytes = self.total_rows = None
+            self._emit()
+
+    def eta_seconds(self):
+        """Remaining seconds of the current phase, extrapolated from bytes (else rows) done so far."""
+        for done, total in ((self.bytes_read, self.total_bytes), (self.rows, self.total_rows)):
+            if total and done:
+                elapsed = time.monotonic() - self._phase_started
+                return round(elapsed * max(total - done, 0) / done, 1)
+        return None
+
+    def snapshot(self):
+        data = {'phase': self.phase_name, 'bytes_read': self.bytes_read, 'rows': self.rows}
+        if self.total_bytes:
+            data['total_bytes'] = self.total_bytes
+            data['percent'] = round(min(100 * self.bytes_read / self.total_bytes, 100), 1)
+        elif self.total_rows:
+            data['total_rows'] = self.total_rows
+            data['percent'] = round(min(100 * self.rows / self.total_rows, 100), 1)
+        data['eta_seconds'] = self.eta_seconds()
+        return data
+
+    def _emit(self):
+        self._last_emit = time.monotonic()
+        if not self.run_id:
+            return
+        with transaction.atomic():
+            NodeRunEvent.objects.filter(
+                run_id=self.run_id, node_item_id=self.node_item_id, kind='progress',
+            ).delete()
+            NodeRunEvent.objects.create(
+                run_id=self.run_id,
+                node_item_id=self.node_item_id,
+                kind='progress',
+                data=json.dumps(self.snapshot()),
+            )
+
+
+def progress_reporter(form_data):
+    """ProgressReporter for the run and node in formData (run_id, node_item_id)."""
+    form_data = form_data or {}
+    return ProgressReporter(form_data.get('run_id'), form_data.get('node_item_id'))
+
+
+class WorkflowProgress:
+    """
+    Node-level progress of a workflow run: one 'progress' event (without a
+    node_item) each time a node finishes, with an ETA from the average node time.
+    """
+
+    def __init__(self, run_id, total_nodes):
+        self.run_id = run_id
+        self.total_nodes = total_nodes
+        self.finished = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def node_finished(self, html_id, status):
+        with self._lock:
+            self.finished += 1
+            elapsed = time.monotonic() - self._started
+            remaining = max(self.total_nodes - self.finished, 0)
+            data = {
+                'phase': 'workflow',
+                'node': html_id,
+                'status': status,
+                'finished_nodes': self.finished,
+                'total_nodes': self.total_nodes,
+                'percent': round(100 * self.finished / self.total_nodes, 1) if self.total_nodes else 100.0,
+                'eta_seconds': round(elapsed * remaining / self.finished, 1),
+            }
+            if self.run_id:
+                NodeRunEvent.objects.create(run_id=self.run_id, kind='progress', data=json.dumps(data))
@@ -0,0 +1,302 @@
+"""
+Node runs: queue node and workflow executions on the django-tasks backend so the
+API can answer immediately with a run id. The work itself happens in a separate
+`manage.py db_worker` process.
+"""
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from node_editor.cancellation import RunCancelled
+from node_editor.dispatcher import run_reader
+from node_editor.memo import compute_fingerprint
+from node_editor.models import NodeItem, NodeRun, NodeRunEvent
+
+EVENT_POLL_INTERVAL = 0.25
+EVENT_BATCH_SIZE = 500
+KEEPALIVE_SECONDS = 15
+# Event streams are long polls: each open one holds a server thread
+DEFAULT_EVENT_STREAM_MAX_SECONDS = 25
+# How often a run attached to an identical in-flight run checks whether it finished
+SINGLE_FLIGHT_POLL_INTERVAL = 0.1
+DEFAULT_SINGLE_FLIGHT_MAX_WAIT_SECONDS = 900
+
+
+class LeaderTimedOut(Exception):
+    """The identical run being followed didn't finish in time; run independently."""
+
+
+def single_flight_max_wait():
+    return timedelta(seconds=getattr(
+        settings, 'NODE_RUN_SINGLE_FLIGHT_MAX_WAIT_SECONDS', DEFAULT_SINGLE_FLIGHT_MAX_WAIT_SECONDS,
+    ))
+
+
+def enqueue_run(run):
+    """Hand a NodeRun to the task backend and remember its task id."""
+    from node_editor.tasks import execute_node_run
+
+    def enqueue():
+        result = execute_node_run.enqueue(str(run.pk))
+        NodeRun.objects.filter(pk=run.pk).update(task_id=result.id)
+        run.task_id = result.id
+
+    # The worker must be able to see the run row before it picks the task up
+    transaction.on_commit(enqueue)
+    return run
+
+
+def start_node_run(node_item, form_data, run_id=None):
+    """Create and enqueue a run of a single NodeItem; run_id lets the client choose its id."""
+    form_data = dict(form_data or {})
+    form_data.setdefault('node_item_id', node_item.id)
+    run = NodeRun.objects.create(
+        id=run_id or uuid.uuid4(),
+        workflow_id=node_item.workflow_id,
+        node_item=node_item,
+        form_data=form_data,
+    )
+    return enqueue_run(run)
+
+
+def node_run_fingerprint(node_item, form_data):
+    """
+    What a run of node_item with form_data computes (see node_editor.memo), or
+    None when that can't be determined. A python_code save is not an execution
+    and never coalesces.
+    """
+    if node_item.original_id == 'python_code' and not form_data.get('input_data'):
+        return None
+    return compute_fingerprint(node_item.original_id, form_data, node_item)
+
+
+def claim_node_run(run):
+    """
+    Single-flight per NodeItem. Under a row lock on the node: if a run with the
+    same fingerprint started running within single_flight_max_wait(), return it
+    so the caller attaches to it. Otherwise cancel the node's older in-flight
+    runs with other parameters (their artifact saves check for this, see
+    unless_cancelled) and mark run 'running'. Only runs with a fingerprint take
+    part in superseding: a python_code save neither cancels nor is cancelled.
+    Raises RunCancelled if run was cancelled before it could start.
+    """
+    with transaction.atomic():
+        # Serializes claims for the same node across processes
+        NodeItem.objects.select_for_update().get(pk=run.node_item_id)
+        in_flight = NodeRun.objects.filter(
+            node_item_id=run.node_item_id, status__in=('queued', 'running'),
+        ).exclude(pk=run.pk)
+
+        leader = None
+        if run.fingerprint:
+            leader = in_flight.filter(
+                status='running',
+                fingerprint=run.fingerprint,
+                started__gte=timezone.now() - single_flight_max_wait(),
+            ).order_by('created').first()
+        if leader is None and run.fingerprint:
+            # Older identical runs that haven't started will attach to this one
+            in_flight.filter(created__lt=run.created, fingerprint__isnull=False).exclude(
+                fingerprint=run.fingerprint,
+            ).update(status='cancelled', finished=timezone.now())
+        claimed = NodeRun.objects.filter(pk=run.pk, status='queued').update(status='running', started=timezone.now())
+    if not claimed:
+        raise RunCancelled()
+    return leader
+
+
+def follow_run(run, leader):
+    """
+    Wait for the run this one attached to and adopt its outcome. Returns the
+    leader's response_data; re-raises its error, and RunCancelled if either run
+    is cancelled meanwhile. Raises LeaderTimedOut once the leader has been
+    running for single_flight_max_wait() (e.g. its worker was killed).
+    """
+    deadline = (leader.started or timezone.now()) + single_flight_max_wait()
+    while True:
+        if NodeRun.objects.filter(pk=run.pk, status='cancelled').exists():
+            raise RunCancelled()
+        leader.refresh_from_db()
+        if leader.is_finished:
+            break
+        if timezone.now() >= deadline:
+            raise LeaderTimedOut()
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+    if leader.status == 'cancelled':
+        NodeRun.objects.filter(pk=run.pk, status='running').update(status='cancelled', finished=timezone.now())
+        raise RunCancelled('The identical run this one was waiting for was cancelled.')
+    if leader.status == 'failed' and leader.response_data is None:
+        raise RuntimeError(leader.error or 'Node execution failed.')
+    return leader.response_data
+
+
+def _execute_node_run(run, node_item):
+    """
+    Run a node's reader under single-flight. Returns (response_data, leader),
+    where leader is the identical in-flight run whose result was adopted, if any.
+    """
+    form_data = dict(run.form_data or {})
+    # Taken when the run starts: a queued run's inputs may have changed since it was created
+    run.fingerprint = node_run_fingerprint(node_item, form_data)
+    NodeRun.objects.filter(pk=run.pk).update(fingerprint=run.fingerprint)
+    leader = claim_node_run(run)
+    if leader is not None:
+        try:
+            return follow_run(run, leader), leader
+        except LeaderTimedOut:
+            pass
+    response_data = run_reader(node_item.original_id, {**form_data, 'run_id': str(run.pk)})
+    if NodeRun.objects.filter(pk=run.pk, status='cancelled').exists():
+        raise RunCancelled()
+    return response_data, None
+
+
+def _finish(run, response_data, error=None, failed=None):
+    """Store a run's outcome, unless it was cancelled while finishing."""
+    if failed is None:
+        failed = isinstance(response_data, dict) and response_data.get('status') == 'error'
+        error = response_data.get('error') if failed else None
+    NodeRun.objects.filter(pk=run.pk, status='running').update(
+        response_data=response_data,
+        error=error,
+        status='failed' if failed else 'succeeded',
+        finished=timezone.now(),
+    )
+    run.refresh_from_db()
+
+
+def run_node_inline(node_item, form_data, run_id=None):
+    """
+    Run a NodeItem in the current process (the formData PUT) under a NodeRun, so
+    the request can be cancelled with DELETE run/<id>/ while it is in flight and
+    duplicate requests are coalesced (see claim_node_run). run_id lets the client
+    choose the id up front. Reader errors and RunCancelled propagate to the
+    caller. Returns (run, response_data, leader).
+    """
+    form_data = dict(form_data or {})
+    run = NodeRun.objects.create(
+        id=run_id or uuid.uuid4(),
+        workflow_id=node_item.workflow_id,
+        node_item=node_item,
+        form_data=form_data,
+    )
+    try:
+        response_data, leader = _execute_node_run(run, node_item)
+    except RunCancelled:
+        raise
+    except Exception as e:
+        _finish(run, None, error=str(e), failed=True)
+        raise
+    _finish(run, response_data)
+    return run, response_data, leader
+
+
+def start_workflow_run(workflow, options=None):
+    """
+    Create and enqueue a run of every node in a workflow. options ('lazy',
+    'preview') are kept on the run's form_data and passed to run_workflow.
+    """
+    run = NodeRun.objects.create(workflow=workflow, form_data=options or {})
+    return enqueue_run(run)
+
+
+def execute_run(run):
+    """
+    Execute a NodeRun in the current process and store its outcome. A run that
+    was cancelled (or superseded) before it started is not executed; one
+    cancelled while running keeps its 'cancelled' status and doesn't touch the
+    node's response_data. A node run identical to one already running waits for
+    it and adopts its result.
+    """
+    from node_editor.executor import run_workflow
+
+    try:
+        if run.node_item_id is None:
+            if not NodeRun.objects.filter(pk=run.pk, status='queued').update(
+                status='running', started=timezone.now(),
+            ):
+                raise RunCancelled()
+            options = run.form_data or {}
+            response_data = run_workflow(
+                run.workflow,
+                lazy=bool(options.get('lazy')),
+                preview=options.get('preview') or (),
+                run_id=run.pk,
+            )
+            failed = response_data['status'] == 'error'
+            error = 'One or more nodes failed.' if failed else None
+        else:
+            node_item = run.node_item
+            response_data, leader = _execute_node_run(run, node_item)
+            if leader is None:
+                node_item.response_data = response_data
+                node_item.save(update_fields=['response_data'])
+            failed = isinstance(response_data, dict) and response_data.get('status') == 'error'
+            error = response_data.get('error') if failed else None
+    except RunCancelled:
+        run.refresh_from_db()
+        return run
+    except Exception as e:
+        response_data, failed, error = None, True, str(e)
+
+    _finish(run, response_data, error=error, failed=failed)
+    return run
+
+
+class RunEventWriter:
+    """
+    on_output callback for python_code: stores each output chunk as a NodeRunEvent
+    so clients following the run see it while the code is still running.
+    """
+
+    def __init__(self, run_id, node_item_id=None):
+        self.run_id = run_id
+        self.node_item_id = node_item_id
+
+    def __call__(self, kind, data):
+        NodeRunEvent.objects.create(run_id=self.run_id, node_item_id=self.node_item_id, kind=kind, data=data)
+
+
+def _sse(event):
+    # Progress events hold a JSON object; output events hold text
+    data = json.loads(event.data) if event.kind == 'progress' else event.data
+    payload = json.dumps({'node_item_id': event.node_item_id, 'data': data})
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {payload}\n\n'
+
+
+def stream_run_events(run_id, after=0, max_seconds=None):
+    """
+    Server-sent events for a run: every NodeRunEvent with id > after, then an
+    'end' event once the run has finished. Stops with a 'timeout' event after
+    max_seconds; clients reconnect with Last-Event-ID to resume.
+    """
+    started = time.monotonic()
+    last_sent = started
+    while True:
+        # Read the status before the events so nothing written before it finished is missed
+        status = NodeRun.objects.filter(pk=run_id).values_list('status', flat=True).first()
+        events = list(NodeRunEvent.objects.filter(run_id=run_id, id__gt=after)[:EVENT_BATCH_SIZE])
+        for event in events:
+            after = event.id
+            yield _sse(event)
+        if events:
+            last_sent = time.monotonic()
+            if len(events) == EVENT_BATCH_SIZE:
+                continue
+        if status is None or status in NodeRun.FINISHED_STATUSES:
+            yield f'event: end\ndata: {json.dumps({"status": status})}\n\n'
+            return
+        now = time.monotonic()
+        if max_seconds is not None and now - started >= max_seconds:
+            yield f'event: timeout\ndata: {json.dumps({"last_event_id": after})}\n\n'
+            return
+        if now - last_sent >= KEEPALIVE_SECONDS:
+            last_sent = now
+            yield ': keepalive\n\n'
+        time.sleep(EVENT_POLL_INTERVAL)
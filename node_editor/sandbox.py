@@ -0,0 +1,658 @@
+"""
+Warm sandbox workers for the python_code node.
+
+Worker processes are forked from a forkserver that has already imported pandas
+and pyarrow, so a run only pays for the user's code. Each worker keeps the
+compiled code objects of recent runs (keyed by code hash), and is recycled after
+a number of runs or once its memory grows past a limit. Output written by the
+user's code is forwarded to the parent while it runs. A run that exceeds its
+timeout, or is cancelled, kills the worker, exactly like the old
+one-subprocess-per-run model.
+
+Workers are shared by every user's runs. After each run a worker restores its
+pandas options, environment variables and sys.path, but modules the code
+imported (and any state it left in them) stay loaded until the worker is
+recycled. Set PYTHON_NODE_WORKER_MAX_RUNS=1 when runs must not share a process.
+
+Data is handed over as files: the input is the parent node's parquet when it is
+on local disk, otherwise an uncompressed Arrow IPC file; the output is always an
+Arrow IPC file. IPC files live in /dev/shm when available and both sides
+memory-map them, so no encode/decode pass is spent on the handoff itself.
+Batches mode reads its input instead: a mapping of the whole file would count
+against the run's RLIMIT_AS however little of it is in use.
+
+In batches mode the code gets `input_batches`, an iterator of DataFrame chunks
+read lazily from the input, and may set `output_batches` to any iterable of
+DataFrames (typically a generator over input_batches); each chunk is appended
+to the output as it is produced, so memory stays bounded by the chunk size.
+
+This module must not import Django: it is what the forkserver preloads.
+"""
+import contextlib
+import cProfile
+import hashlib
+import io
+import multiprocessing
+import os
+import pstats
+import resource
+import signal
+import sys
+import threading
+import time
+import traceback
+import warnings
+from collections import OrderedDict, deque
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_MAX_RUNS = 100
+DEFAULT_MAX_RSS_MB = 1024
+DEFAULT_MAX_OUTPUT_CHARS = 64 * 1024
+CODE_CACHE_SIZE = 64
+# Rows per input_batches chunk when formData doesn't set batch_size
+DEFAULT_BATCH_ROWS = 100_000
+# Functions listed in a profile report
+DEFAULT_PROFILE_TOP = 20
+# Output is forwarded to the parent when this much is buffered, or at this interval
+STREAM_CHUNK_CHARS = 4096
+STREAM_INTERVAL = 0.1
+# How often a waiting run asks should_cancel() whether it has been cancelled
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class SandboxError(Exception):
+    """Base for runs that did not report a result; carries the output seen so far."""
+    stdout = ''
+    stderr = ''
+
+
+class SandboxTimeout(SandboxError):
+    """The user's code did not finish in time; its worker has been killed."""
+
+
+class SandboxCancelled(SandboxError):
+    """The run was cancelled while the code was running; its worker has been killed."""
+
+
+class SandboxCrashed(SandboxError):
+    """The worker died without reporting a result (e.g. os._exit or a segfault)."""
+
+    def __init__(self, exitcode):
+        super().__init__(f'Process exited with code {exitcode}')
+        self.exitcode = exitcode
+
+
+class SandboxCPULimit(SandboxCrashed):
+    """The worker was killed for using more CPU time than the run allows."""
+
+    def __init__(self):
+        SandboxError.__init__(self, 'CPU time limit exceeded.')
+        self.exitcode = -signal.SIGXCPU
+
+
+class TailBuffer:
+    """Ring buffer of text chunks that keeps only the last max_chars characters."""
+
+    def __init__(self, max_chars=DEFAULT_MAX_OUTPUT_CHARS):
+        self.max_chars = max_chars
+        self._chunks = deque()
+        self._size = 0
+        self.dropped = 0
+
+    def append(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        while self._size > self.max_chars:
+            excess = self._size - self.max_chars
+            first = self._chunks[0]
+            if len(first) <= excess:
+                self._chunks.popleft()
+                cut = len(first)
+            else:
+                self._chunks[0] = first[excess:]
+                cut = excess
+            self._size -= cut
+            self.dropped += cut
+
+    def getvalue(self):
+        text = ''.join(self._chunks)
+        if self.dropped:
+            return f'[... {self.dropped} earlier characters truncated ...]\n{text}'
+        return text
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def _rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_ipc(table, path):
+    """
+    Write an Arrow table as an uncompressed Arrow IPC file (cheap to memory-map), in
+    record batches of at most DEFAULT_BATCH_ROWS rows so it can be read a batch at a time.
+    """
+    with pa.OSFile(str(path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=DEFAULT_BATCH_ROWS)
+
+
+def read_ipc(path):
+    """Memory-map an Arrow IPC file; the table's buffers point into the mapping."""
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def read_input(job):
+    """The job's input as a DataFrame, from the parent's parquet or an IPC handoff file."""
+    if job.get('input_format') == 'parquet':
+        table = pq.read_table(job['input_path'], memory_map=False)
+    else:
+        table = read_ipc(job['input_path'])
+    return table.to_pandas()
+
+
+def iter_input_batches(job):
+    """
+    The job's input as DataFrame chunks of at most job['batch_size'] rows, read and
+    decoded one at a time (parquet row groups lazily, IPC record batches by index).
+    The file is not memory-mapped, so only the current chunk counts against RLIMIT_AS.
+    """
+    batch_size = job.get('batch_size') or DEFAULT_BATCH_ROWS
+    if job.get('input_format') == 'parquet':
+        batches = pq.ParquetFile(job['input_path'], memory_map=False).iter_batches(batch_size=batch_size)
+    else:
+        batches = _iter_ipc_batches(job['input_path'], batch_size)
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+def _iter_ipc_batches(path, batch_size):
+    with pa.OSFile(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield batch.slice(offset, batch_size)
+
+
+def write_ipc_batches(frames, path):
+    """
+    Append DataFrame chunks to an Arrow IPC file as they are produced. Every chunk is
+    converted to the first chunk's schema; the file is empty when there are none.
+    """
+    writer = None
+    schema = None
+    sink = pa.OSFile(str(path), 'wb')
+    try:
+        for i, frame in enumerate(frames):
+            if not isinstance(frame, pd.DataFrame):
+                raise TypeError(f"output_batches must yield pandas DataFrames, got {type(frame).__name__} (chunk {i})")
+            if writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                schema = table.schema
+                writer = pa.ipc.new_file(sink, schema)
+            else:
+                try:
+                    table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, KeyError) as e:
+                    raise TypeError(f'Output chunk {i} does not match the columns/types of the first chunk: {e}')
+            writer.write_table(table)
+        if writer is None:
+            writer = pa.ipc.new_file(sink, pa.schema([]))
+    finally:
+        if writer is not None:
+            writer.close()
+        sink.close()
+
+
+def _compiled(code, cache):
+    """Code object for code, compiled once per worker and kept in a small LRU."""
+    key = code_hash(code)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    compiled = compile(code, '<python_code>', 'exec')
+    cache[key] = compiled
+    if len(cache) > CODE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return compiled
+
+
+def _apply_limits(limits):
+    """
+    Per-run resource limits. RLIMIT_CPU counts the process' whole CPU time, so the
+    soft limit is set relative to what this warm worker has already used.
+    Exceeding it kills the worker with SIGXCPU; exceeding RLIMIT_AS raises MemoryError.
+    """
+    memory_mb = limits.get('memory_mb')
+    _, as_hard = resource.getrlimit(resource.RLIMIT_AS)
+    if memory_mb:
+        soft = memory_mb * 1024 * 1024
+        if as_hard != resource.RLIM_INFINITY:
+            soft = min(soft, as_hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, as_hard))
+    else:
+        resource.setrlimit(resource.RLIMIT_AS, (as_hard, as_hard))
+
+    cpu_seconds = limits.get('cpu_seconds')
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        if cpu_hard != resource.RLIM_INFINITY:
+            soft = min(soft, cpu_hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, cpu_hard))
+    else:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard, cpu_hard))
+
+
+class _StreamWriter(io.TextIOBase):
+    """stdout/stderr replacement that forwards output to the parent while the code runs."""
+
+    def __init__(self, conn, name, lock):
+        self.conn = conn
+        self.name = name
+        self.lock = lock
+        self._pending = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f'write() argument must be str, not {type(text).__name__}')
+        with self.lock:
+            self._pending.append(text)
+            self._size += len(text)
+            if self._size >= STREAM_CHUNK_CHARS:
+                self._send()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+    def _send(self):
+        if self._pending:
+            self.conn.send({'kind': 'output', 'stream': self.name, 'text': ''.join(self._pending)})
+            self._pending = []
+            self._size = 0
+
+
+@contextlib.contextmanager
+def _streamed_output(conn):
+    """Redirect stdout/stderr to the parent, flushing every STREAM_INTERVAL until the block ends."""
+    lock = threading.Lock()
+    stdout = _StreamWriter(conn, 'stdout', lock)
+    stderr = _StreamWriter(conn, 'stderr', lock)
+    done = threading.Event()
+
+    def flusher():
+        while not done.wait(STREAM_INTERVAL):
+            stdout.flush()
+            stderr.flush()
+
+    thread = threading.Thread(target=flusher, daemon=True)
+    thread.start()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            yield
+    finally:
+        done.set()
+        thread.join()
+        stdout.flush()
+        stderr.flush()
+
+
+@contextlib.contextmanager
+def _profiling(profiler):
+    if profiler is None:
+        yield
+        return
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def _profile_report(profiler, top):
+    """Top functions by cumulative time, as plain data."""
+    functions = []
+    for (filename, line, name), (primitive_calls, calls, total, cumulative, _) in pstats.Stats(profiler).stats.items():
+        if "_lsprof.Profiler" in name:
+            continue
+        functions.append({
+            'function': name,
+            'file': filename,
+            'line': line,
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'total_time_ms': round(total * 1000, 3),
+            'cumulative_time_ms': round(cumulative * 1000, 3),
+            'per_call_ms': round(cumulative * 1000 / calls, 3) if calls else 0,
+        })
+    functions.sort(key=lambda f: f['cumulative_time_ms'], reverse=True)
+    return functions[:top]
+
+
+def _ms_since(start):
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def _run_job(job, cache, conn):
+    """
+    Run one job inside a worker; errors are reported as a traceback on stderr.
+    The result carries the time spent loading the input, executing the code and
+    writing the output, and with job['profile'] a cProfile report of the user code.
+    """
+    _apply_limits(job.get('limits') or {})
+    cwd = os.getcwd()
+    ok = False
+    phases = {}
+    profiler = cProfile.Profile() if job.get('profile') else None
+    try:
+        os.chdir(job['cwd'])
+        with _streamed_output(conn):
+            try:
+                globs = {
+                    '__name__': '__main__',
+                    'pd': pd,
+                    'pandas': pd,
+                }
+                start = time.perf_counter()
+                if job.get('input_mode') == 'batches':
+                    # Chunks are decoded lazily, so most of the load happens during exec/write
+                    globs['input_batches'] = iter_input_batches(job)
+                else:
+                    globs['input_df'] = read_input(job)
+                phases['load_ms'] = _ms_since(start)
+
+                start = time.perf_counter()
+                with _profiling(profiler):
+                    exec(_compiled(job['code'], cache), globs)
+                phases['exec_ms'] = _ms_since(start)
+
+                start = time.perf_counter()
+                output_batches = globs.get('output_batches')
+                output_df = globs.get('output_df')
+                if output_batches is not None and output_df is None:
+                    # Consuming the iterator is what runs a lazy (generator) transform
+                    with _profiling(profiler):
+                        write_ipc_batches(output_batches, job['output_path'])
+                else:
+                    if output_df is None:
+                        raise NameError(
+                            "output_df must be defined by your code"
+                            + (" (or output_batches in batches mode)" if 'input_batches' in globs else "")
+                        )
+                    if not isinstance(output_df, pd.DataFrame):
+                        raise TypeError("output_df must be a pandas DataFrame")
+                    write_ipc(pa.Table.from_pandas(output_df, preserve_index=False), job['output_path'])
+                phases['write_ms'] = _ms_since(start)
+                ok = True
+            except BaseException:
+                traceback.print_exc()
+    finally:
+        os.chdir(cwd)
+    result = {'kind': 'result', 'ok': ok, 'phases': phases}
+    if profiler is not None:
+        result['profile'] = _profile_report(profiler, job.get('profile_top') or DEFAULT_PROFILE_TOP)
+    return result
+
+
+def _pandas_options():
+    """Every pandas option and its current value (pd.options is a tree of option groups)."""
+    def walk(group, prefix):
+        for name in dir(group):
+            value = getattr(group, name)
+            if isinstance(value, type(pd.options)):
+                yield from walk(value, f'{prefix}{name}.')
+            else:
+                yield f'{prefix}{name}', value
+
+    with warnings.catch_warnings():
+        # Deprecated options warn on access
+        warnings.simplefilter('ignore', FutureWarning)
+        return dict(walk(pd.options, ''))
+
+
+def _restore_state(options, environ, path):
+    """
+    Undo a run's changes to pandas options, os.environ and sys.path. Returns False
+    if that failed, in which case the worker is recycled.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            for key, value in _pandas_options().items():
+                if key in options and value != options[key]:
+                    pd.set_option(key, options[key])
+        if dict(os.environ) != environ:
+            os.environ.clear()
+            os.environ.update(environ)
+        sys.path[:] = path
+    except Exception:
+        return False
+    return True
+
+
+def _worker_main(conn, max_runs, max_rss_bytes):
+    cache = OrderedDict()
+    runs = 0
+    state = (_pandas_options(), dict(os.environ), list(sys.path))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        result = _run_job(job, cache, conn)
+        runs += 1
+        restored = _restore_state(*state)
+        result['recycle'] = not restored or runs >= max_runs or _rss_bytes() > max_rss_bytes
+        conn.send(result)
+        if result['recycle']:
+            return
+
+
+class SandboxWorker:
+    """One warm worker process and the pipe used to hand it jobs."""
+
+    def __init__(self, ctx, max_runs, max_rss_bytes):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, max_runs, max_rss_bytes),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.retired = False
+
+    @property
+    def usable(self):
+        return not self.retired and self.process.is_alive()
+
+    def run(self, job, timeout, on_output=None, max_output_chars=DEFAULT_MAX_OUTPUT_CHARS, should_cancel=None):
+        """
+        Send job and wait for its result; kill the worker if it takes longer than timeout,
+        or once should_cancel() returns True (asked every CANCEL_POLL_INTERVAL seconds).
+        Output chunks are passed to on_output(stream, text) as they arrive; the result's
+        stdout/stderr keep the last max_output_chars characters of each. If on_output or
+        should_cancel raises, the worker is killed too: it is still busy with the job.
+        """
+        self.conn.send(job)
+        try:
+            return self._receive(timeout, on_output, max_output_chars, should_cancel)
+        except SandboxError:
+            raise
+        except BaseException:
+            self.kill()
+            raise
+
+    def _receive(self, timeout, on_output, max_output_chars, should_cancel):
+        output = {'stdout': TailBuffer(max_output_chars), 'stderr': TailBuffer(max_output_chars)}
+        deadline = time.monotonic() + timeout
+        next_cancel_check = time.monotonic() + CANCEL_POLL_INTERVAL
+        while True:
+            now = time.monotonic()
+            remaining = deadline - now
+            error = None
+            if should_cancel is not None and now >= next_cancel_check:
+                next_cancel_check = now + CANCEL_POLL_INTERVAL
+                if should_cancel():
+                    self.kill()
+                    error = SandboxCancelled()
+            if error is None:
+                wait = remaining if should_cancel is None else min(remaining, CANCEL_POLL_INTERVAL)
+                if remaining <= 0:
+                    self.kill()
+                    error = SandboxTimeout()
+                elif not self.conn.poll(wait):
+                    continue
+                else:
+                    try:
+                        message = self.conn.recv()
+                    except EOFError:
+                        self.kill()
+                        if self.process.exitcode == -signal.SIGXCPU:
+                            error = SandboxCPULimit()
+                        else:
+                            error = SandboxCrashed(self.process.exitcode)
+            if error is not None:
+                error.stdout = output['stdout'].getvalue()
+                error.stderr = output['stderr'].getvalue()
+                raise error
+            if message['kind'] != 'output':
+                break
+            output[message['stream']].append(message['text'])
+            if on_output is not None:
+                on_output(message['stream'], message['text'])
+
+        result = {
+            'ok': message['ok'],
+            'stdout': output['stdout'].getvalue(),
+            'stderr': output['stderr'].getvalue(),
+            'phases': message['phases'],
+            'profile': message.get('profile'),
+        }
+        if message['recycle']:
+            self.retired = True
+            self.process.join(timeout=5)
+            self.conn.close()
+        return result
+
+    def kill(self):
+        self.retired = True
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Bounded pool of warm workers shared by the threads of one server process.
+    Callers block while all workers are busy.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_runs=DEFAULT_MAX_RUNS, max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.size = max(1, size)
+        self.max_runs = max_runs
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.ctx = _context()
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def _spawn(self):
+        return SandboxWorker(self.ctx, self.max_runs, self.max_rss_bytes)
+
+    def warm(self):
+        """Start workers up to the pool size so the first runs don't wait for them."""
+        with self._cond:
+            while self._count < self.size:
+                self._idle.append(self._spawn())
+                self._count += 1
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.usable:
+                        return worker
+                    self._count -= 1
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                self._cond.wait()
+        try:
+            return self._spawn()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, worker):
+        with self._cond:
+            if worker.usable:
+                self._idle.append(worker)
+            else:
+                # Replace a recycled or killed worker right away so the next run is warm
+                try:
+                    self._idle.append(self._spawn())
+                except Exception:
+                    self._count -= 1
+            self._cond.notify()
+
+    def run(self, job, timeout, **options):
+        worker = self.acquire()
+        try:
+            return worker.run(job, timeout, **options)
+        finally:
+            self.release(worker)
+
+    def shutdown(self):
+        with self._cond:
+            for worker in self._idle:
+                worker.kill()
+            self._count -= len(self._idle)
+            self._idle = []
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' in methods:
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(**options):
+    """The process-wide pool, created (and warmed) on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(**options)
+            _pool.warm()
+        return _pool
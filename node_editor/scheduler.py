@@ -0,0 +1,145 @@
+"""
+Host-wide admission control for python_code executions.
+
+Every server process on the host (gunicorn workers, db_worker) shares one small
+JSON state file guarded by flock. A run takes a slot before it is handed to a
+sandbox worker; when all slots are taken it waits in a queue. Waiting runs are
+admitted FIFO per user, and the user with the fewest running executions goes
+first, so one user's burst cannot starve everybody else.
+
+Entries carry the host name and pid of their process plus a lease, so slots held
+by a process that died are reclaimed instead of leaking. Containers (web and
+db_worker) share the file through a common volume; pids are only checked for
+entries of the same host name, others are reclaimed when their lease runs out.
+"""
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_QUEUE_TIMEOUT = 300
+POLL_INTERVAL = 0.05
+# A waiting entry that hasn't polled for this long belongs to a dead process
+WAITING_LEASE_SECONDS = 30
+
+
+class QueueTimeout(Exception):
+    """No execution slot became free within the queue timeout."""
+
+
+def _alive(entry, now):
+    if entry['expires'] < now:
+        return False
+    if entry['host'] != socket.gethostname():
+        return True
+    try:
+        os.kill(entry['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def next_ticket(state):
+    """
+    The waiting ticket to admit next: the oldest entry of the user with the fewest
+    running executions (ties go to the user who has waited longest).
+    """
+    running_per_user = {}
+    for entry in state['running']:
+        running_per_user[entry['user']] = running_per_user.get(entry['user'], 0) + 1
+    heads = {}
+    for entry in state['waiting']:
+        heads.setdefault(entry['user'], entry)
+    if not heads:
+        return None
+    head = min(heads.values(), key=lambda e: (running_per_user.get(e['user'], 0), e['enqueued']))
+    return head['ticket']
+
+
+class Scheduler:
+    def __init__(self, state_path=None, max_concurrent=DEFAULT_MAX_CONCURRENT, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.state_path = state_path or os.path.join(tempfile.gettempdir(), 'ruzivoflow-python-node.json')
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_timeout = queue_timeout
+
+    @contextmanager
+    def _state(self):
+        """Load, yield and save the shared state while holding the host-wide lock."""
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(f'{self.state_path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_path) as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {'running': [], 'waiting': []}
+                now = time.time()
+                state['running'] = [e for e in state['running'] if _alive(e, now)]
+                state['waiting'] = [e for e in state['waiting'] if _alive(e, now)]
+                yield state
+                tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entry(self, ticket, user, lease):
+        return {
+            'ticket': ticket,
+            'user': str(user),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'enqueued': time.time(),
+            'expires': time.time() + lease,
+        }
+
+    @contextmanager
+    def slot(self, user, run_timeout, check_cancel=None):
+        """
+        Hold one execution slot for the duration of the block; yields the time
+        spent queueing in ms. The slot's lease covers run_timeout plus a margin.
+        check_cancel() runs on every poll while waiting and may raise (e.g.
+        RunCancelled) to leave the queue.
+        """
+        ticket = uuid.uuid4().hex
+        start = time.monotonic()
+        with self._state() as state:
+            state['waiting'].append(self._entry(ticket, user, WAITING_LEASE_SECONDS))
+
+        try:
+            while True:
+                with self._state() as state:
+                    waiting = next((e for e in state['waiting'] if e['ticket'] == ticket), None)
+                    if waiting is None:
+                        # Our entry was pruned (e.g. the host clock jumped); queue again
+                        waiting = self._entry(ticket, user, WAITING_LEASE_SECONDS)
+                        state['waiting'].append(waiting)
+                    if len(state['running']) < self.max_concurrent and next_ticket(state) == ticket:
+                        state['waiting'].remove(waiting)
+                        state['running'].append(self._entry(ticket, user, run_timeout + WAITING_LEASE_SECONDS))
+                        break
+                    waiting['expires'] = time.time() + WAITING_LEASE_SECONDS
+                if check_cancel is not None:
+                    check_cancel()
+                if time.monotonic() - start > self.queue_timeout:
+                    raise QueueTimeout()
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            with self._state() as state:
+                state['waiting'] = [e for e in state['waiting'] if e['ticket'] != ticket]
+            raise
+
+        try:
+            yield int((time.monotonic() - start) * 1000)
+        finally:
+            with self._state() as state:
+                state['running'] = [e for e in state['running'] if e['ticket'] != ticket]
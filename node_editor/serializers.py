@@ -1,7 +1,7 @@
 import json
 
 from rest_framework import serializers
-from .models import NodeCategory, Node, Workflow, NodeItem, Connection
+from .models import NodeCategory, Node, Workflow, NodeItem, Connection, NodeRun
 
 
 class NodeCategorySerializer(serializers.ModelSerializer):
@@ -54,3 +54,10 @@ class ConnectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Connection
         fields = '__all__'
+
+
+class NodeRunSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = NodeRun
+        fields = '__all__'
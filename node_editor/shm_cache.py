@@ -0,0 +1,327 @@
+"""
+Host-wide cache of decoded parquet artifacts in shared memory.
+
+Every server process (gunicorn workers, db_worker) used to decode the same hot
+artifacts and keep its own copy. The first process to read a column of an
+artifact version now writes it once as an uncompressed Arrow IPC file under
+/dev/shm; every process memory-maps those files, so the data is shared zero-copy
+and memory scales with the number of distinct datasets, not datasets x workers.
+Only the columns somebody asked for are decoded, as with the parquet reads.
+
+A JSON index guarded by flock (like node_editor.scheduler) records, per artifact
+version, its column files and their sizes and the pids referencing it. A process
+takes its reference in the same locked section that finds the columns, and holds
+it while its in-process column cache (node_editor.table_cache) keeps columns of
+that artifact version. The index is only rewritten when it changes: a hit by a
+process that already holds a reference just touches the column files, whose
+mtimes are the last use, and hit/miss counters are folded in with the next
+write. When the cache grows past its byte budget, the least recently used
+artifacts nobody references are deleted. References of dead processes are
+dropped whenever the index is read. A mapped file stays readable after it is
+unlinked, so a reader is never invalidated by eviction; a column file deleted
+before it was mapped is a miss.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DIRECTORY_NAME = 'ruzivoflow-artifacts'
+# Decoding of artifact versions is serialized through this many lock files,
+# which are never deleted
+WRITE_LOCK_STRIPES = 256
+
+# Hits and misses of this process not yet in the index, per cache directory
+_pending_counts = {}
+_counts_lock = threading.Lock()
+os.register_at_fork(after_in_child=_pending_counts.clear)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+class SharedArtifactCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.join(directory, DIRECTORY_NAME)
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(self.directory, 'index.json')
+
+    @staticmethod
+    def key(artifact_id, version):
+        digest = hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+        return f'{artifact_id}-{digest}'
+
+    def _path(self, key, column):
+        digest = hashlib.sha1(column.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f'{key}.{digest}.arrow')
+
+    def _count(self, name):
+        with _counts_lock:
+            counts = _pending_counts.setdefault(self.directory, {'hits': 0, 'misses': 0})
+            counts[name] += 1
+
+    @contextmanager
+    def _index(self):
+        """
+        Load and yield the index while holding the host-wide lock; it is saved,
+        with this process's pending counters, only if the block changed it.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f'{self.index_path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.index_path) as f:
+                        text = f.read()
+                    index = json.loads(text)
+                except (OSError, ValueError):
+                    text = None
+                    index = {'entries': {}, 'hits': 0, 'misses': 0, 'evictions': 0}
+                for key, entry in list(index['entries'].items()):
+                    entry['columns'] = {
+                        name: size for name, size in entry['columns'].items()
+                        if os.path.exists(self._path(key, name))
+                    }
+                    if not entry['columns']:
+                        del index['entries'][key]
+                        continue
+                    if entry['names'] and len(entry['columns']) < len(entry['names']):
+                        entry['names'] = None
+                    entry['refs'] = [pid for pid in entry['refs'] if _alive(pid)]
+                yield index
+                if json.dumps(index) == text:
+                    return
+                with _counts_lock:
+                    counts = _pending_counts.pop(self.directory, {})
+                for name, count in counts.items():
+                    index[name] += count
+                tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, self.index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self, key):
+        """Serializes decoding of one artifact version, so each column is decoded only once."""
+        stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % WRITE_LOCK_STRIPES
+        with open(os.path.join(self.directory, f'write-{stripe}.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _acquire(self, index, key, columns):
+        """
+        Reference key for this process if it holds columns (None for all) and mark
+        them used; returns the column names to map, or None when some are missing.
+        """
+        entry = index['entries'].get(key)
+        if entry is None:
+            return None
+        names = entry['names'] if columns is None else list(columns)
+        if names is None or any(name not in entry['columns'] for name in names):
+            return None
+        if os.getpid() not in entry['refs']:
+            entry['refs'].append(os.getpid())
+        for name in names:
+            try:
+                os.utime(self._path(key, name))
+            except FileNotFoundError:
+                pass
+        return names
+
+    def _last_used(self, key, entry):
+        return max(_mtime(self._path(key, name)) for name in entry['columns'])
+
+    def _remove(self, index, key):
+        entry = index['entries'].pop(key)
+        for name in entry['columns']:
+            _unlink(self._path(key, name))
+        index['evictions'] += 1
+
+    def _shrink(self, index):
+        """Delete unreferenced artifacts, least recently used first, until within budget."""
+        entries = index['entries']
+        total = sum(sum(e['columns'].values()) for e in entries.values())
+        for key in sorted(entries, key=lambda k: self._last_used(k, entries[k])):
+            if total <= self.max_bytes:
+                break
+            if not entries[key]['refs']:
+                total -= sum(entries[key]['columns'].values())
+                self._remove(index, key)
+
+    def get_table(self, artifact_id, version, columns, decode):
+        """
+        Memory-mapped table of columns (None for all) of an artifact version.
+        Columns no process has decoded yet are decoded with decode(names) ->
+        pa.Table and written for everybody. The calling process holds a
+        reference until release(). Columns that can't be stored (over budget,
+        or the filesystem is full) are returned as decoded.
+        """
+        key = self.key(artifact_id, version)
+        with self._index() as index:
+            names = self._acquire(index, key, columns)
+        if names is not None:
+            table = self._map(key, names)
+            if table is not None:
+                self._count('hits')
+                return table
+        self._count('misses')
+        with self._writing(key):
+            with self._index() as index:
+                # Another process may have written them while we waited
+                names = self._acquire(index, key, columns)
+                entry = index['entries'].get(key)
+                have = set(entry['columns']) if entry else set()
+            if names is None:
+                missing = None if columns is None else [n for n in columns if n not in have]
+                table = decode(missing)
+                if not self._write(artifact_id, key, columns is None, table):
+                    return table if missing == columns else self._merge(key, columns, table, decode)
+                names = table.schema.names if columns is None else list(columns)
+        table = self._map(key, names)
+        return table if table is not None else decode(columns)
+
+    def _map(self, key, names):
+        """Table of the mapped column files, or None if one was deleted meanwhile."""
+        columns, fields, metadata = [], [], None
+        try:
+            for name in names:
+                table = pa.ipc.open_file(pa.memory_map(self._path(key, name))).read_all()
+                columns.append(table.column(0))
+                fields.append(table.schema.field(0))
+                metadata = table.schema.metadata
+        except FileNotFoundError:
+            return None
+        return pa.Table.from_arrays(columns, schema=pa.schema(fields, metadata=metadata))
+
+    def _merge(self, key, columns, decoded, decode):
+        """columns from the mapped files this process already found plus the decoded rest."""
+        with self._index() as index:
+            names = self._acquire(index, key, [n for n in columns if n not in decoded.schema.names])
+        mapped = None if names is None else self._map(key, names)
+        if mapped is None:
+            # Evicted meanwhile
+            return decode(columns)
+        parts = {name: (mapped, name) for name in names}
+        parts.update({name: (decoded, name) for name in decoded.schema.names})
+        return pa.Table.from_arrays(
+            [table.column(name) for table, name in (parts[n] for n in columns)],
+            schema=pa.schema(
+                [table.schema.field(name) for table, name in (parts[n] for n in columns)],
+                metadata=decoded.schema.metadata,
+            ),
+        )
+
+    def _write(self, artifact_id, key, complete, table):
+        """
+        Store each column of table as its own IPC file; False if they don't fit the
+        budget or the filesystem (e.g. a full /dev/shm), leaving no files behind.
+        """
+        if table.nbytes > self.max_bytes:
+            return False
+        sizes = {}
+        try:
+            for field, column in zip(table.schema, table.columns):
+                path = self._path(key, field.name)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                sizes[field.name] = (tmp_path, path, 0)
+                schema = pa.schema([field], metadata=table.schema.metadata)
+                with pa.OSFile(tmp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, schema) as writer:
+                        writer.write_table(pa.Table.from_arrays([column], schema=schema))
+                sizes[field.name] = (tmp_path, path, os.path.getsize(tmp_path))
+        except OSError:
+            for tmp_path, _, _ in sizes.values():
+                _unlink(tmp_path)
+            return False
+
+        with self._index() as index:
+            # Older versions of the artifact are unreachable once unreferenced
+            for old_key, old in list(index['entries'].items()):
+                if old['artifact_id'] == artifact_id and old_key != key and not old['refs']:
+                    self._remove(index, old_key)
+            entry = index['entries'].setdefault(
+                key, {'artifact_id': artifact_id, 'columns': {}, 'names': None, 'refs': []},
+            )
+            for name, (tmp_path, path, size) in sizes.items():
+                os.replace(tmp_path, path)
+                entry['columns'][name] = size
+            if complete:
+                entry['names'] = table.schema.names
+            if os.getpid() not in entry['refs']:
+                entry['refs'].append(os.getpid())
+            self._shrink(index)
+        return True
+
+    def release(self, artifact_id, version):
+        """Drop this process's reference to an artifact version."""
+        key = self.key(artifact_id, version)
+        with self._index() as index:
+            entry = index['entries'].get(key)
+            if entry is not None and os.getpid() in entry['refs']:
+                entry['refs'].remove(os.getpid())
+            self._shrink(index)
+
+    def evict(self, artifact_id):
+        """Delete an artifact's unreferenced files (e.g. after its file was replaced)."""
+        with self._index() as index:
+            for key, entry in list(index['entries'].items()):
+                if entry['artifact_id'] == artifact_id and not entry['refs']:
+                    self._remove(index, key)
+
+    def clear(self):
+        """Delete every file no process references."""
+        with self._index() as index:
+            for key, entry in list(index['entries'].items()):
+                if not entry['refs']:
+                    self._remove(index, key)
+
+    def stats(self):
+        with _counts_lock:
+            pending = dict(_pending_counts.get(self.directory, {}))
+        with self._index() as index:
+            entries = index['entries'].values()
+            hits = index['hits'] + pending.get('hits', 0)
+            misses = index['misses'] + pending.get('misses', 0)
+            lookups = hits + misses
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / lookups, 3) if lookups else None,
+                'evictions': index['evictions'],
+                'artifacts': len(index['entries']),
+                'referenced': sum(1 for e in entries if e['refs']),
+                'bytes': sum(sum(e['columns'].values()) for e in entries),
+                'max_bytes': self.max_bytes,
+                'directory': self.directory,
+            }
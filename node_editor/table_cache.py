@@ -0,0 +1,175 @@
+"""
+In-process LRU cache of decoded Arrow columns for parquet artifacts.
+
+Clicking through a select_columns node (or re-running anything downstream of the
+same parent) decodes the same parquet file over and over. Each server process
+keeps the columns it has decoded, keyed by artifact id, a version of the file
+(name, mtime, size) and column name, so a repeated read is assembled from memory
+without touching parquet at all, and a read of new columns only decodes those.
+
+The cache is bounded in bytes; the least recently used columns are evicted first.
+Arrow arrays are immutable, so cached columns are shared safely between readers.
+on_release(artifact_id, version) is called once no column of an artifact version
+is left, so a host-wide cache (node_editor.shm_cache) backing the columns can
+drop this process's reference.
+"""
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ArrowTableCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, on_release=None):
+        self.max_bytes = max_bytes
+        self.on_release = on_release
+        # (artifact_id, version, column name) -> (field, ChunkedArray), oldest first
+        self._columns = OrderedDict()
+        # (artifact_id, version) -> all column names, once the whole table was read
+        self._names = {}
+        # (artifact_id, version) -> schema metadata (pandas index/dtype info)
+        self._metadata = {}
+        # (artifact_id, version) -> number of its columns in the cache
+        self._counts = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (artifact_id, version) whose last column was dropped, for on_release
+        self._released = []
+        self._lock = threading.Lock()
+
+    def get_table(self, artifact_id, version, columns, load):
+        """
+        Table of columns (None for all) of an artifact. Columns not in the cache are
+        decoded with load(columns) -> pa.Table and kept for the next read.
+        """
+        if self.max_bytes <= 0:
+            table = load(columns)
+            self._release([(artifact_id, version)])
+            return table
+        key = (artifact_id, version)
+        with self._lock:
+            names = list(columns) if columns is not None else self._names.get(key)
+            cached = {}
+            for name in names or ():
+                entry = self._columns.get((*key, name))
+                if entry is not None:
+                    self._columns.move_to_end((*key, name))
+                    cached[name] = entry
+            if names is not None and len(cached) == len(names):
+                self.hits += 1
+                return self._assemble(key, names, cached)
+            self.misses += 1
+
+        missing = None if names is None else [n for n in names if n not in cached]
+        table = load(missing)
+        with self._lock:
+            # A new version of the file makes the old one's columns unreachable
+            self._evict(artifact_id, keep=key)
+            self._metadata[key] = table.schema.metadata
+            if names is None:
+                names = table.schema.names
+                self._names[key] = names
+            for field, column in zip(table.schema, table.columns):
+                cached[field.name] = (field, column)
+                self._put((*key, field.name), field, column)
+            table = self._assemble(key, names, cached)
+            if key not in self._counts:
+                # Nothing fit in the cache
+                self._names.pop(key, None)
+                self._metadata.pop(key, None)
+                self._released.append(key)
+            released, self._released = self._released, []
+        self._release(released)
+        return table
+
+    def _release(self, keys):
+        # Called without the lock held: on_release may block on other processes
+        if self.on_release is not None:
+            for key in keys:
+                self.on_release(*key)
+
+    def _assemble(self, key, names, entries):
+        fields = [entries[name][0] for name in names]
+        return pa.Table.from_arrays(
+            [entries[name][1] for name in names],
+            schema=pa.schema(fields, metadata=self._metadata.get(key)),
+        )
+
+    def _put(self, column_key, field, column):
+        if column_key in self._columns:
+            return
+        size = column.nbytes
+        if size > self.max_bytes:
+            return
+        self._columns[column_key] = (field, column)
+        self._bytes += size
+        self._counts[column_key[:2]] = self._counts.get(column_key[:2], 0) + 1
+        while self._bytes > self.max_bytes:
+            old_key = next(iter(self._columns))
+            self._drop(old_key)
+
+    def _drop(self, column_key):
+        _, column = self._columns.pop(column_key)
+        self._bytes -= column.nbytes
+        self.evictions += 1
+        key = column_key[:2]
+        # The table is no longer complete in the cache
+        self._names.pop(key, None)
+        self._counts[key] -= 1
+        if not self._counts[key]:
+            del self._counts[key]
+            self._metadata.pop(key, None)
+            self._released.append(key)
+
+    def _evict(self, artifact_id, keep=None):
+        for column_key in [k for k in self._columns if k[0] == artifact_id and k[:2] != keep]:
+            self._drop(column_key)
+
+    def evict(self, artifact_id):
+        """Drop every cached column of an artifact (e.g. after its file was replaced)."""
+        with self._lock:
+            self._evict(artifact_id)
+            released, self._released = self._released, []
+        self._release(released)
+
+    def clear(self):
+        with self._lock:
+            released = list(self._counts)
+            self.evictions += len(self._columns)
+            self._columns.clear()
+            self._names.clear()
+            self._metadata.clear()
+            self._counts.clear()
+            self._bytes = 0
+        self._release(released)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'columns': len(self._columns),
+                'artifacts': len({k[0] for k in self._columns}),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_table_cache(max_bytes=DEFAULT_MAX_BYTES, on_release=None):
+    """The process-wide cache, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArrowTableCache(max_bytes, on_release)
+        return _cache
@@ -0,0 +1,26 @@
+from django_tasks import task
+
+from node_editor.models import NodeRun
+
+
+@task()
+def execute_node_run(run_id):
+    """Worker entry point for a queued NodeRun (see node_editor.runs)."""
+    from node_editor.runs import execute_run
+
+    run = NodeRun.objects.select_related('node_item', 'workflow').get(pk=run_id)
+    return execute_run(run).status
+
+
+@task()
+def collect_artifact_garbage():
+    """
+    Periodic artifact garbage collection (see node_editor.artifact_gc). Each run
+    enqueues the next one; start the chain with `manage.py gc_artifacts --schedule`.
+    """
+    from node_editor.artifact_gc import collect_garbage, schedule_garbage_collection
+
+    try:
+        return collect_garbage()
+    finally:
+        schedule_garbage_collection()
@@ -0,0 +1,108 @@
+"""
+Advisor Tests for Node Editor App
+
+Crucial tests for the python_code vectorization advisor:
+- iterrows, apply(axis=1), column loops, range(len()) loops and concat in a loop are flagged with line numbers
+- Vectorized code and code that doesn't parse produce no warnings
+- The analysis is cached by code hash
+- A previous run's profile ranks the warnings and marks the dominant one;
+  module-level loops are left unranked with a note
+"""
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from node_editor.advisor import analyze_code, rank_by_profile
+
+SLOW_CODE = """\
+import pandas as pd
+def label(row):
+    return row['a'] * 2
+df = input_df.copy()
+df['b'] = df.apply(label, axis=1)
+for _, row in df.iterrows():
+    pass
+for value in df['a']:
+    pass
+parts = []
+for i in range(len(df)):
+    parts = pd.concat([df.iloc[[i]]])
+output_df = df
+"""
+
+
+class AnalyzeCodeTestCase(SimpleTestCase):
+    """Test the AST pass"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_slow_patterns_are_flagged(self):
+        advice = analyze_code(SLOW_CODE)
+        self.assertEqual(
+            [(w['rule'], w['line']) for w in advice],
+            [
+                ('apply_axis_1', 5),
+                ('iterrows', 6),
+                ('column_loop', 8),
+                ('range_len_loop', 11),
+                ('concat_in_loop', 12),
+            ],
+        )
+        self.assertTrue(all(w['suggestion'] for w in advice))
+
+    def test_vectorized_code_has_no_warnings(self):
+        code = "output_df = input_df.assign(b=input_df['a'] * 2)\ntotals = input_df.apply(sum)"
+        self.assertEqual(analyze_code(code), [])
+
+    def test_syntax_error_has_no_warnings(self):
+        self.assertEqual(analyze_code('for x in'), [])
+
+    def test_analysis_is_cached(self):
+        analyze_code(SLOW_CODE)
+        with mock.patch('node_editor.advisor.ast.parse') as parse:
+            self.assertEqual(len(analyze_code(SLOW_CODE)), 5)
+        parse.assert_not_called()
+
+
+class RankByProfileTestCase(SimpleTestCase):
+    """Test ranking warnings with a previous run's measurements"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_dominant_warning_comes_first(self):
+        profile = {
+            'phases_ms': {'exec_ms': 100.0},
+            'functions': [
+                {'function': 'label', 'file': '<python_code>', 'line': 2, 'cumulative_time_ms': 5.0},
+                {'function': 'iterrows', 'file': 'frame.py', 'line': 1, 'cumulative_time_ms': 80.0},
+            ],
+        }
+        advice = rank_by_profile(analyze_code(SLOW_CODE), profile)
+
+        self.assertEqual(advice[0]['rule'], 'iterrows')
+        self.assertEqual(advice[0]['measured_ms'], 80.0)
+        self.assertTrue(advice[0]['dominant'])
+        self.assertEqual(advice[1]['rule'], 'apply_axis_1')
+        self.assertFalse(advice[1]['dominant'])
+        self.assertIsNone(advice[-1]['measured_ms'])
+        unranked = {w['rule']: w for w in advice if 'note' in w}
+        self.assertEqual(set(unranked), {'column_loop', 'range_len_loop'})
+        self.assertTrue(all(w['measured_ms'] is None for w in unranked.values()))
+
+    def test_loop_in_a_function_is_measured(self):
+        code = "def step(df):\n    for value in df['a']:\n        pass\nstep(input_df)\noutput_df = input_df"
+        profile = {
+            'phases_ms': {'exec_ms': 10.0},
+            'functions': [{'function': 'step', 'file': '<python_code>', 'line': 1, 'cumulative_time_ms': 9.0}],
+        }
+        advice = rank_by_profile(analyze_code(code), profile)
+
+        self.assertEqual(advice[0]['measured_ms'], 9.0)
+        self.assertNotIn('note', advice[0])
+
+    def test_without_profile_order_is_unchanged(self):
+        advice = analyze_code(SLOW_CODE)
+        self.assertEqual(rank_by_profile(advice, None), advice)
@@ -0,0 +1,204 @@
+"""
+Artifact Garbage Collection Tests for Node Editor App
+
+Crucial tests for gc_artifacts:
+- Parquet documents no node references are deleted with their files
+- Documents still referenced (NodeArtifact or parquet_file_id) are kept
+- Parquet files no Document points at are deleted; recent garbage and other
+  files (uploads, exports) are left alone
+- Dry runs only report what would be reclaimed
+- Re-saving an artifact deletes the file it replaces
+- Finished runs past their retention are deleted with their events
+- Scheduling the periodic collection again doesn't start a second chain;
+  --schedule-only (run on worker start) schedules without collecting
+"""
+import datetime
+import io
+import os
+import tempfile
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_tasks.backends.database.models import DBTaskResult
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.artifact_gc import collect_garbage, schedule_garbage_collection
+from node_editor.models import Node, NodeArtifact, NodeItem, NodeRun, NodeRunEvent, Workflow
+from node_editor.tasks import collect_artifact_garbage
+from node_editor.utils.artifacts import save_parquet_document
+
+IMMEDIATE_TASKS = {
+    'default': {
+        'BACKEND': 'django_tasks.backends.immediate.ImmediateBackend',
+        'ENQUEUE_ON_COMMIT': False,
+    }
+}
+OLD = timezone.now() - datetime.timedelta(days=2)
+
+
+class ArtifactGarbageCollectionTestCase(TestCase):
+    """Test collect_garbage and the gc_artifacts command"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.collection = Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        self.workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        self.node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+
+        self.artifact_doc = self.add_document('artifact')
+        NodeArtifact.objects.create(node_item=self.add_node('reader'), document=self.artifact_doc)
+        self.referenced_doc = self.add_document('referenced')
+        self.add_node('child', response_data={'parquet_file_id': self.referenced_doc.id})
+        self.orphan_doc = self.add_document('orphan')
+        self.recent_orphan_doc = self.add_document('recent', old=False)
+
+    def add_node(self, html_id, response_data=None):
+        return NodeItem.objects.create(
+            workflow=self.workflow, node=self.node, original_name='read_csv', original_id='read_csv',
+            name=html_id, html_id=html_id, type='type', response_data=response_data,
+        )
+
+    def add_document(self, title, old=True):
+        document = Document.objects.create(
+            title=title, file=ContentFile(b'x' * 100, name=f'{title}.parquet'), collection=self.collection,
+        )
+        if old:
+            Document.objects.filter(pk=document.pk).update(created_at=OLD)
+        return document
+
+    def add_file(self, name, old=True):
+        path = os.path.join(self.media_root, 'documents', name)
+        with open(path, 'wb') as f:
+            f.write(b'y' * 50)
+        if old:
+            os.utime(path, (OLD.timestamp(), OLD.timestamp()))
+        return path
+
+    def test_orphaned_documents_and_files_are_deleted(self):
+        orphan_path = self.orphan_doc.file.path
+        stray = self.add_file('superseded_ab12cd.parquet')
+        recent_stray = self.add_file('being_saved.parquet', old=False)
+
+        report = collect_garbage()
+
+        self.assertEqual((report['documents'], report['files']), (1, 1))
+        self.assertEqual(report['bytes_reclaimed'], 150)
+        self.assertEqual(
+            set(Document.objects.values_list('title', flat=True)), {'artifact', 'referenced', 'recent'},
+        )
+        self.assertFalse(os.path.exists(orphan_path))
+        self.assertFalse(os.path.exists(stray))
+        self.assertTrue(os.path.exists(recent_stray))
+        self.assertTrue(os.path.exists(self.artifact_doc.file.path))
+
+    def test_only_parquet_files_are_collected(self):
+        export = self.add_file('node_1.csv')
+        upload = self.add_file('sales.xlsx')
+
+        report = collect_garbage()
+
+        self.assertEqual(report['files'], 0)
+        self.assertTrue(os.path.exists(export))
+        self.assertTrue(os.path.exists(upload))
+
+    def test_dry_run_deletes_nothing(self):
+        stray = self.add_file('superseded_ab12cd.parquet')
+
+        report = collect_garbage(dry_run=True)
+
+        self.assertEqual((report['documents'], report['files'], report['bytes_reclaimed']), (1, 1, 150))
+        self.assertTrue(Document.objects.filter(pk=self.orphan_doc.pk).exists())
+        self.assertTrue(os.path.exists(stray))
+
+    def test_small_batches(self):
+        for i in range(3):
+            self.add_document(f'orphan{i}')
+
+        report = collect_garbage(batch_size=2)
+
+        self.assertEqual(report['documents'], 4)
+        self.assertEqual(Document.objects.count(), 3)
+
+    def test_old_finished_runs_are_deleted_with_their_events(self):
+        old = NodeRun.objects.create(workflow=self.workflow, status='succeeded', finished=OLD)
+        NodeRunEvent.objects.create(run=old, kind='stdout', data='hello')
+        recent = NodeRun.objects.create(workflow=self.workflow, status='failed', finished=timezone.now())
+        running = NodeRun.objects.create(workflow=self.workflow, status='running')
+
+        report = collect_garbage(run_retention_seconds=24 * 3600)
+
+        self.assertEqual((report['runs'], report['run_events']), (1, 1))
+        self.assertEqual(set(NodeRun.objects.values_list('pk', flat=True)), {recent.pk, running.pk})
+        self.assertFalse(NodeRunEvent.objects.exists())
+
+    def test_command_reports_bytes(self):
+        out = io.StringIO()
+        call_command('gc_artifacts', '--dry-run', stdout=out)
+
+        self.assertIn('Would delete 1 documents (100 bytes)', out.getvalue())
+        self.assertIn('Reclaimable: 100 bytes', out.getvalue())
+
+    def test_task_runs_collection(self):
+        with override_settings(TASKS=IMMEDIATE_TASKS):
+            result = collect_artifact_garbage.enqueue()
+            next_run = schedule_garbage_collection()
+
+        self.assertEqual(result.return_value['documents'], 1)
+        # The immediate backend can't defer the next run
+        self.assertIsNone(next_run)
+
+    def test_schedule_defers_next_run(self):
+        with override_settings(ARTIFACT_GC_INTERVAL_SECONDS=600):
+            result = schedule_garbage_collection()
+
+        self.assertGreater(result.task.run_after, timezone.now() + datetime.timedelta(seconds=590))
+
+    def test_schedule_keeps_a_single_pending_run(self):
+        out = io.StringIO()
+        with override_settings(ARTIFACT_GC_INTERVAL_SECONDS=600):
+            # The database backend saves enqueued tasks on commit
+            with self.captureOnCommitCallbacks(execute=True):
+                first = schedule_garbage_collection()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('gc_artifacts', '--dry-run', '--schedule', stdout=out)
+                second = schedule_garbage_collection()
+
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(DBTaskResult.objects.filter(task_path=collect_artifact_garbage.module_path).count(), 1)
+        self.assertIn('runs next at', out.getvalue())
+
+    def test_schedule_only_does_not_collect(self):
+        out = io.StringIO()
+        with override_settings(ARTIFACT_GC_INTERVAL_SECONDS=600):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('gc_artifacts', '--schedule-only', stdout=out)
+
+        self.assertTrue(Document.objects.filter(pk=self.orphan_doc.pk).exists())
+        self.assertEqual(DBTaskResult.objects.filter(task_path=collect_artifact_garbage.module_path).count(), 1)
+        self.assertIn('runs next at', out.getvalue())
+
+    def test_resave_deletes_replaced_file(self):
+        node_item = NodeItem.objects.get(html_id='reader')
+        buffer = io.BytesIO()
+        pd.DataFrame({'a': [1]}).to_parquet(buffer, index=False)
+        old_path = self.artifact_doc.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document = save_parquet_document(node_item, ContentFile(buffer.getvalue()))
+
+        self.assertEqual(document.pk, self.artifact_doc.pk)
+        self.assertNotEqual(document.file.path, old_path)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(document.file.path))
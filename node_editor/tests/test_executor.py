@@ -0,0 +1,365 @@
+"""
+Workflow Executor Tests for Node Editor App
+
+Crucial tests for server-side workflow runs:
+- Topological ordering and cycle detection
+- Independent branches run concurrently, failures skip descendants
+- POST /node_editor/<workflow_id>/run/ queues a run of all nodes in dependency order
+- GET /node_editor/run/<id>/events/ streams a run's output as server-sent events
+- Workflow runs stream per-node progress events
+- DELETE /node_editor/run/<id>/ cancels a run; formData PUT runs get a run id too
+- A formData PATCH queues a run and answers 202 with it
+- Identical concurrent node runs coalesce, a run with new parameters supersedes the old one
+- A stale or overdue identical run is not waited for; python_code saves never supersede
+"""
+import json
+import threading
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import User
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from node_editor.dispatcher import READER_FUNCTIONS
+from node_editor.executor import WorkflowCycleError, execute_dag, topological_order
+from node_editor.models import Connection, Node, NodeItem, NodeRun, NodeRunEvent, Workflow
+from node_editor.runs import (
+    LeaderTimedOut, RunEventWriter, claim_node_run, execute_run, follow_run, node_run_fingerprint, start_node_run,
+)
+
+IMMEDIATE_TASKS = {
+    'default': {
+        'BACKEND': 'django_tasks.backends.immediate.ImmediateBackend',
+        'ENQUEUE_ON_COMMIT': False,
+    }
+}
+
+
+class TopologicalOrderTestCase(TestCase):
+    """Test dependency ordering of workflow graphs"""
+
+    def test_parents_come_before_children(self):
+        order = topological_order(['c', 'b', 'a'], [('a', 'b'), ('b', 'c')])
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    def test_cycle_raises(self):
+        with self.assertRaises(WorkflowCycleError):
+            topological_order(['a', 'b'], [('a', 'b'), ('b', 'a')])
+
+
+class ExecuteDagTestCase(TestCase):
+    """Test scheduling of nodes across the thread pool"""
+
+    def test_independent_branches_run_concurrently(self):
+        # Both roots must be running at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run(node_id):
+            if node_id in ('a', 'b'):
+                barrier.wait()
+            return node_id
+
+        results = execute_dag(['a', 'b', 'c'], [('a', 'c'), ('b', 'c')], run, max_workers=2)
+        self.assertEqual({r['status'] for r in results.values()}, {'success'})
+
+    def test_failure_skips_descendants(self):
+        def run(node_id):
+            if node_id == 'a':
+                raise ValueError('boom')
+            return node_id
+
+        results = execute_dag(['a', 'b', 'c', 'd'], [('a', 'b'), ('b', 'c')], run, max_workers=2)
+        self.assertEqual(results['a']['status'], 'error')
+        self.assertEqual(results['b']['status'], 'skipped')
+        self.assertEqual(results['c']['status'], 'skipped')
+        self.assertEqual(results['d']['status'], 'success')
+
+
+@override_settings(WORKFLOW_RUN_MAX_WORKERS=1, TASKS=IMMEDIATE_TASKS)
+class WorkflowRunViewTestCase(APITestCase):
+    """Test POST /node_editor/<workflow_id>/run/"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(user=self.user)
+        self.workflow = Workflow.objects.create(user=self.user, name='Workflow 1')
+        self.node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+
+        self.items = {}
+        for html_id, original_id in [('src', 'fake_source'), ('mid', 'fake_step'), ('end', 'fake_step')]:
+            self.items[html_id] = NodeItem.objects.create(
+                workflow=self.workflow,
+                node=self.node,
+                original_name=original_id,
+                original_id=original_id,
+                name=html_id,
+                html_id=html_id,
+                type='type',
+            )
+        # Created in reverse so the run cannot rely on insertion order
+        Connection.objects.create(workflow=self.workflow, sourceId='mid', targetId='end')
+        Connection.objects.create(workflow=self.workflow, sourceId='src', targetId='mid')
+
+    def test_run_executes_nodes_in_dependency_order(self):
+        calls = []
+
+        def fake_source(form_data):
+            calls.append(form_data['node_item_id'])
+            return {'value': 1}
+
+        def fake_step(form_data):
+            calls.append(form_data['node_item_id'])
+            node_item = NodeItem.objects.get(id=form_data['node_item_id'])
+            return {'value': node_item.parent.response_data['value'] + 1}
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source, 'fake_step': fake_step}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/node_editor/{self.workflow.id}/run/')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        run = NodeRun.objects.get(pk=response.data['id'])
+        self.assertEqual(run.status, 'succeeded')
+        self.assertEqual(run.response_data['order'], ['src', 'mid', 'end'])
+        self.assertEqual(calls, [self.items[h].id for h in ('src', 'mid', 'end')])
+        self.assertEqual(NodeItem.objects.get(html_id='end').response_data, {'value': 3})
+
+    def test_node_progress_is_streamed(self):
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': lambda f: {}, 'fake_step': lambda f: {}}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/node_editor/{self.workflow.id}/run/')
+
+        stream = self.client.get(f"/node_editor/run/{response.data['id']}/events/", HTTP_ACCEPT='text/event-stream')
+        body = b''.join(stream.streaming_content).decode()
+        progress = [
+            json.loads(line[len('data: '):])['data']
+            for block in body.split('\n\n') if 'event: progress' in block
+            for line in block.split('\n') if line.startswith('data: ')
+        ]
+        self.assertEqual([p['node'] for p in progress], ['src', 'mid', 'end'])
+        self.assertEqual(progress[-1]['finished_nodes'], 3)
+        self.assertEqual(progress[-1]['percent'], 100.0)
+
+    def test_run_rejects_cycles(self):
+        Connection.objects.create(workflow=self.workflow, sourceId='end', targetId='src')
+        response = self.client.post(f'/node_editor/{self.workflow.id}/run/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(NodeRun.objects.exists())
+
+
+@override_settings(TASKS=IMMEDIATE_TASKS)
+class NodeItemRunViewTestCase(APITestCase):
+    """Test POST /node_editor/node_item/run/<pk>/ and GET /node_editor/run/<id>/"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(user=self.user)
+        workflow = Workflow.objects.create(user=self.user, name='Workflow 1')
+        node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+        self.node_item = NodeItem.objects.create(
+            workflow=workflow,
+            node=node,
+            original_name='fake_source',
+            original_id='fake_source',
+            name='src',
+            html_id='src',
+            type='type',
+        )
+
+    def test_run_is_queued_and_result_is_pollable(self):
+        def fake_source(form_data):
+            return {'rows': form_data['rows']}
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    f'/node_editor/node_item/run/{self.node_item.id}/',
+                    {'formData': {'rows': 3}},
+                    format='json',
+                )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+
+        detail = self.client.get(f"/node_editor/run/{response.data['id']}/")
+        self.assertEqual(detail.status_code, status.HTTP_200_OK)
+        self.assertEqual(detail.data['status'], 'succeeded')
+        self.assertEqual(detail.data['response_data'], {'rows': 3})
+        self.node_item.refresh_from_db()
+        self.assertEqual(self.node_item.formData, {'rows': 3})
+        self.assertEqual(self.node_item.response_data, {'rows': 3})
+
+    def test_failed_run_reports_error(self):
+        def fake_source(form_data):
+            raise ValueError('bad input')
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    f'/node_editor/node_item/run/{self.node_item.id}/', {'formData': {}}, format='json'
+                )
+
+        run = NodeRun.objects.get(pk=response.data['id'])
+        self.assertEqual(run.status, 'failed')
+        self.assertEqual(run.error, 'bad input')
+
+
+    def test_cancelled_queued_run_never_executes(self):
+        fake_source = mock.Mock(return_value={})
+        run = start_node_run(self.node_item, {})
+
+        response = self.client.delete(f'/node_editor/run/{run.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'cancelled')
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source}):
+            self.assertEqual(execute_run(run).status, 'cancelled')
+        fake_source.assert_not_called()
+
+    def test_finished_run_cannot_be_cancelled(self):
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item, status='succeeded')
+        response = self.client.delete(f'/node_editor/run/{run.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def put_form_data(self, form_data, **extra):
+        url = f'/node_editor/node_item/form_data/{self.node_item.id}/'
+        node = self.client.get(url).data
+        return self.client.put(url, {**node, 'formData': form_data, **extra}, format='json')
+
+    def test_form_data_put_runs_under_a_client_chosen_run_id(self):
+        run_id = uuid.uuid4()
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': lambda form_data: {'run_id': form_data['run_id']}}):
+            response = self.put_form_data({}, run_id=str(run_id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['run_id'], str(run_id))
+        self.assertEqual(response.data['response_data'], {'run_id': str(run_id)})
+        self.assertEqual(NodeRun.objects.get(pk=run_id).status, 'succeeded')
+
+    def test_form_data_patch_queues_a_run(self):
+        run_id = uuid.uuid4()
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': lambda form_data: {'rows': form_data['rows']}}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(
+                    f'/node_editor/node_item/form_data/{self.node_item.id}/',
+                    {'formData': {'rows': 3}, 'run_id': str(run_id)},
+                    format='json',
+                )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['id'], str(run_id))
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertEqual(NodeRun.objects.get(pk=run_id).status, 'succeeded')
+        self.node_item.refresh_from_db()
+        self.assertEqual(self.node_item.formData, {'rows': 3})
+        self.assertEqual(self.node_item.response_data, {'rows': 3})
+
+    def make_run(self, status, fingerprint, started=None):
+        if started is None and status == 'running':
+            started = timezone.now()
+        return NodeRun.objects.create(
+            workflow=self.node_item.workflow, node_item=self.node_item, status=status, fingerprint=fingerprint,
+            started=started,
+        )
+
+    def test_run_with_new_parameters_supersedes_older_run(self):
+        older = self.make_run('running', 'a')
+        newer = self.make_run('queued', 'b')
+
+        self.assertIsNone(claim_node_run(newer))
+
+        older.refresh_from_db()
+        newer.refresh_from_db()
+        self.assertEqual(older.status, 'cancelled')
+        self.assertEqual(newer.status, 'running')
+
+    def test_run_without_fingerprint_supersedes_nothing(self):
+        older = self.make_run('running', 'a')
+        save = self.make_run('queued', None)
+
+        self.assertIsNone(claim_node_run(save))
+
+        older.refresh_from_db()
+        self.assertEqual(older.status, 'running')
+
+    def test_run_without_fingerprint_is_not_superseded(self):
+        save = self.make_run('running', None)
+        newer = self.make_run('queued', 'b')
+
+        claim_node_run(newer)
+
+        save.refresh_from_db()
+        self.assertEqual(save.status, 'running')
+
+    def test_stale_identical_run_is_not_attached_to(self):
+        fingerprint = node_run_fingerprint(self.node_item, {'rows': 3})
+        self.make_run('running', fingerprint, started=timezone.now() - timedelta(hours=1))
+
+        with override_settings(NODE_RUN_SINGLE_FLIGHT_MAX_WAIT_SECONDS=60), \
+                mock.patch.dict(READER_FUNCTIONS, {'fake_source': lambda form_data: {'rows': 3}}):
+            response = self.put_form_data({'rows': 3})
+
+        self.assertNotIn('coalesced_with', response.data)
+        self.assertEqual(response.data['response_data'], {'rows': 3})
+
+    def test_following_stops_at_the_deadline(self):
+        leader = self.make_run('running', 'a', started=timezone.now() - timedelta(seconds=61))
+        follower = self.make_run('running', 'a')
+
+        with override_settings(NODE_RUN_SINGLE_FLIGHT_MAX_WAIT_SECONDS=60), \
+                mock.patch('node_editor.runs.time.sleep') as sleep:
+            with self.assertRaises(LeaderTimedOut):
+                follow_run(follower, leader)
+        sleep.assert_not_called()
+
+    def test_identical_put_attaches_to_the_running_run(self):
+        fake_source = mock.Mock(return_value={'rows': 0})
+        leader = self.make_run('running', node_run_fingerprint(self.node_item, {'rows': 3}))
+
+        def leader_finishes(seconds):
+            NodeRun.objects.filter(pk=leader.pk).update(status='succeeded', response_data={'rows': 3})
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source}), \
+                mock.patch('node_editor.runs.time.sleep', side_effect=leader_finishes):
+            response = self.put_form_data({'rows': 3})
+
+        fake_source.assert_not_called()
+        self.assertEqual(response.data['coalesced_with'], str(leader.pk))
+        self.assertEqual(response.data['response_data'], {'rows': 3})
+        self.assertEqual(NodeRun.objects.get(pk=response.data['run_id']).status, 'succeeded')
+
+    def test_events_are_streamed_until_the_run_ends(self):
+        def fake_source(form_data):
+            writer = RunEventWriter(form_data['run_id'], form_data['node_item_id'])
+            writer('stdout', 'hello\n')
+            writer('stderr', 'careful\n')
+            return {}
+
+        with mock.patch.dict(READER_FUNCTIONS, {'fake_source': fake_source}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    f'/node_editor/node_item/run/{self.node_item.id}/', {'formData': {}}, format='json'
+                )
+
+        run_id = response.data['id']
+        first_id = NodeRunEvent.objects.filter(run_id=run_id).first().id
+        stream = self.client.get(f'/node_editor/run/{run_id}/events/', HTTP_ACCEPT='text/event-stream')
+        body = b''.join(stream.streaming_content).decode()
+
+        self.assertEqual(stream['Content-Type'], 'text/event-stream')
+        self.assertIn(f'id: {first_id}\nevent: stdout\n', body)
+        self.assertIn('event: stderr', body)
+        self.assertTrue(body.endswith('event: end\ndata: {"status": "succeeded"}\n\n'))
+
+        resumed = self.client.get(
+            f'/node_editor/run/{run_id}/events/', HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(first_id)
+        )
+        resumed_body = b''.join(resumed.streaming_content).decode()
+        self.assertNotIn('event: stdout', resumed_body)
+        self.assertIn('event: stderr', resumed_body)
@@ -0,0 +1,99 @@
+"""
+Memoization Tests for Node Editor App
+
+Crucial tests for content-hash memoization of node runs:
+- A re-run with the same file and formData returns the stored response_data
+- Changing the input file or formData re-executes the node
+- Downstream fingerprints follow the parent's fingerprint
+- A replaced artifact file gets a new content hash
+"""
+from unittest import mock
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.dispatcher import run_reader
+from node_editor.memo import compute_fingerprint, document_hash, normalize_form_data
+from node_editor.models import Node, NodeItem, Workflow
+
+
+class MemoizedRunTestCase(TestCase):
+    """Test that unchanged read_csv runs are skipped"""
+
+    def setUp(self):
+        Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        node = Node.objects.create(name='Read CSV', html_id='read_csv', type='reader', order=1)
+        self.node_item = NodeItem.objects.create(
+            workflow=workflow,
+            node=node,
+            original_name='Read CSV',
+            original_id='read_csv',
+            name='Read CSV',
+            html_id='read_csv_1',
+            type='reader',
+        )
+        self.csv_doc = Document.objects.create(
+            title='data.csv', file=ContentFile(b'a,b\n1,2\n3,4\n', name='data.csv')
+        )
+
+    def run_node(self, form_data):
+        form_data = {'file_id': self.csv_doc.id, 'node_item_id': self.node_item.id, **form_data}
+        response_data = run_reader('read_csv', form_data)
+        self.node_item.response_data = response_data
+        self.node_item.save()
+        return response_data
+
+    def test_unchanged_rerun_skips_reader(self):
+        with mock.patch('node_editor.utils.read_csv.pd.read_csv', wraps=pd.read_csv) as read:
+            first = self.run_node({})
+            second = self.run_node({})
+
+        self.assertEqual(read.call_count, 1)
+        self.assertFalse(first['memoized'])
+        self.assertTrue(second['memoized'])
+        self.assertEqual(first['fingerprint'], second['fingerprint'])
+        self.assertEqual(first['parquet_file_id'], second['parquet_file_id'])
+
+    def test_changed_file_reruns_reader(self):
+        first = self.run_node({})
+        self.csv_doc.file.save('data.csv', ContentFile(b'a,b\n5,6\n'), save=False)
+        self.csv_doc.file_hash = ''
+        self.csv_doc.save()
+
+        second = self.run_node({})
+        self.assertFalse(second['memoized'])
+        self.assertNotEqual(first['fingerprint'], second['fingerprint'])
+        self.assertEqual(second['stats']['rows'], 1)
+
+    def test_replaced_artifact_changes_its_hash(self):
+        # Children without the parent's fingerprint (e.g. fused stages) key on this hash
+        parquet_file_id = self.run_node({})['parquet_file_id']
+        before = document_hash(parquet_file_id)
+        self.csv_doc.file.save('data.csv', ContentFile(b'a,b\n5,6\n'), save=False)
+        self.csv_doc.file_hash = ''
+        self.csv_doc.save()
+
+        self.assertEqual(self.run_node({})['parquet_file_id'], parquet_file_id)
+        self.assertNotEqual(document_hash(parquet_file_id), before)
+        document = Document.objects.get(id=parquet_file_id)
+        self.assertEqual(document.get_file_size(), document.file.size)
+
+    def test_force_reruns_reader(self):
+        self.run_node({})
+        self.assertFalse(self.run_node({'force': True})['memoized'])
+
+    def test_fingerprint_ignores_volatile_keys(self):
+        self.assertEqual(
+            normalize_form_data({'b': 1, 'a': 2, 'node_item_id': 3, 'input_data': {}}),
+            normalize_form_data({'a': 2, 'b': 1}),
+        )
+        self.assertNotEqual(
+            compute_fingerprint('read_csv', {'file_id': self.csv_doc.id}, self.node_item),
+            compute_fingerprint('read_csv', {'file_id': self.csv_doc.id, 'sep': ';'}, self.node_item),
+        )
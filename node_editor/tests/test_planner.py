@@ -0,0 +1,148 @@
+"""
+Planner Tests for Node Editor App
+
+Crucial tests for lazy workflow runs:
+- select_columns chains are fused into the sink that consumes them
+- Previewed and branching nodes are still materialized
+- A lazy run writes only the sink's output and matches the eager result
+- Re-running a save_file node replaces its own export, never another node's
+- GET /node_editor/<workflow_id>/plan/ explains the fusion
+"""
+import io
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.executor import run_workflow, workflow_graph
+from node_editor.models import Connection, Node, NodeItem, Workflow
+from node_editor.planner import build_plan
+
+
+@override_settings(WORKFLOW_RUN_MAX_WORKERS=1)
+class PlannerTestCase(APITestCase):
+    """read (parquet) → pick → narrow → save chain"""
+
+    def setUp(self):
+        root = Collection.get_first_root_node()
+        self.parquet_collection = root.add_child(name='Parquet')
+        root.add_child(instance=Collection(pk=4, name='Files'))
+        user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(user=user)
+        self.workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        self.node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+
+        self.df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z'], 'c': [1.5, None, 3.5]})
+        buffer = io.BytesIO()
+        self.df.to_parquet(buffer, index=False, engine='pyarrow')
+        self.source_doc = Document.objects.create(
+            title='read',
+            file=ContentFile(buffer.getvalue(), name='read.parquet'),
+            collection=self.parquet_collection,
+        )
+        # Source without a reader function: its response_data is used as is
+        self.add_node('read', 'source', response_data={'parquet_file_id': self.source_doc.id})
+        self.add_node('pick', 'select_columns', {'selected_columns': ['c', 'a']})
+        self.add_node('narrow', 'select_columns', {'selected_columns': ['a']})
+        self.add_node('save', 'save_file', {'format': 'csv'})
+        self.connect('read', 'pick')
+        self.connect('pick', 'narrow')
+        self.connect('narrow', 'save')
+
+    def add_node(self, html_id, original_id, form_data=None, response_data=None):
+        return NodeItem.objects.create(
+            workflow=self.workflow,
+            node=self.node,
+            original_name=original_id,
+            original_id=original_id,
+            name=html_id,
+            html_id=html_id,
+            type='type',
+            formData=form_data,
+            response_data=response_data,
+        )
+
+    def connect(self, source, target):
+        Connection.objects.create(workflow=self.workflow, sourceId=source, targetId=target)
+
+    def plan(self, preview=()):
+        return build_plan(*workflow_graph(self.workflow), preview=preview)
+
+    def exported_csv(self):
+        document = Document.objects.get(id=NodeItem.objects.get(html_id='save').response_data['file_id'])
+        with document.file.open(mode='rb') as f:
+            return f.read().decode('utf-8')
+
+
+class BuildPlanTestCase(PlannerTestCase):
+    """Test which nodes are fused"""
+
+    def test_chain_is_fused_into_sink(self):
+        plan = self.plan()
+        self.assertEqual(plan['deferred'], {'pick': 'save', 'narrow': 'save'})
+        self.assertEqual(plan['stages']['save']['source'], 'read')
+
+    def test_previewed_node_is_materialized(self):
+        plan = self.plan(preview=['pick'])
+        self.assertEqual(plan['deferred'], {'narrow': 'save'})
+        self.assertEqual(plan['stages']['save']['source'], 'pick')
+
+    def test_branching_node_is_materialized(self):
+        self.add_node('other', 'select_columns', {'selected_columns': ['c']})
+        self.connect('pick', 'other')
+        plan = self.plan()
+        self.assertEqual(plan['deferred'], {'narrow': 'save'})
+
+
+class LazyRunTestCase(PlannerTestCase):
+    """Test lazy workflow execution"""
+
+    def test_lazy_run_matches_eager_run(self):
+        eager = run_workflow(self.workflow)
+        eager_csv = self.exported_csv()
+        parquet_docs = Document.objects.filter(collection=self.parquet_collection).count()
+        Document.objects.filter(title__in=['pick', 'narrow']).delete()
+
+        lazy = run_workflow(self.workflow, lazy=True)
+
+        self.assertEqual(eager['status'], 'success')
+        self.assertEqual(lazy['status'], 'success')
+        self.assertEqual(lazy['nodes']['pick'], {'status': 'fused', 'fused_into': 'save'})
+        self.assertEqual(lazy['nodes']['save']['response_data']['fused'], ['pick', 'narrow'])
+        self.assertEqual(self.exported_csv(), eager_csv)
+        self.assertEqual(eager_csv, 'a\n1\n2\n3\n')
+        # No intermediate parquet was written by the lazy run
+        self.assertEqual(Document.objects.filter(collection=self.parquet_collection).count(), parquet_docs - 2)
+
+    def test_rerun_replaces_the_nodes_own_export(self):
+        # Another workflow's save node has the same html_id and export collection
+        other = Document.objects.create(title='save', file=ContentFile(b'other', name='save.csv'), collection_id=4)
+
+        run_workflow(self.workflow)
+        first_id = NodeItem.objects.get(html_id='save').response_data['file_id']
+        run_workflow(self.workflow, lazy=True)
+
+        self.assertNotEqual(first_id, other.id)
+        self.assertEqual(NodeItem.objects.get(html_id='save').response_data['file_id'], first_id)
+        self.assertEqual(self.exported_csv(), 'a\n1\n2\n3\n')
+        with Document.objects.get(pk=other.pk).file.open(mode='rb') as f:
+            self.assertEqual(f.read(), b'other')
+
+    def test_invalid_projection_fails_the_sink(self):
+        NodeItem.objects.filter(html_id='narrow').update(formData={'selected_columns': ['b']})
+        result = run_workflow(self.workflow, lazy=True)
+        self.assertEqual(result['nodes']['save']['status'], 'error')
+        self.assertIn('narrow', result['nodes']['save']['error'])
+
+    def test_plan_view_explains_fusion(self):
+        response = self.client.get(f'/node_editor/{self.workflow.id}/plan/')
+        steps = {step['node']: step for step in response.data['steps']}
+
+        self.assertEqual(steps['read']['action'], 'run')
+        self.assertEqual(steps['pick'], {'node': 'pick', 'action': 'fused', 'into': 'save'})
+        self.assertEqual(steps['save']['action'], 'scan')
+        self.assertEqual(steps['save']['columns'], ['a'])
@@ -0,0 +1,344 @@
+"""
+Python Code Tests for Node Editor App
+
+Crucial tests for the python_code node:
+- Warm sandbox workers are reused between runs and recycled after N runs
+- A run past its timeout, or cancelled, kills the worker and the pool recovers
+- A failing output or cancel callback kills the worker instead of returning it busy
+- A run's pandas options and environment changes don't leak into the next run
+- python_code persists output_df and reports user errors from stderr
+- A local parent parquet is handed to the worker as is, other inputs as Arrow IPC
+- Output is forwarded while the code runs and the stored log is capped
+- Runs report their queue/execute/write phases as progress events
+- Batches mode streams input chunks to the code and appends output chunks,
+  reading its input without memory-mapping it
+- profile: true returns phase timings and the user's hot functions
+- Vectorization advice is returned and ranked by the previous profiled run
+"""
+import io
+import json
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.cancellation import RunCancelled
+from node_editor.models import Connection, Node, NodeItem, NodeRun, Workflow
+from node_editor.sandbox import SandboxCancelled, SandboxPool, SandboxTimeout, iter_input_batches, write_ipc
+from node_editor.utils.python_code import python_code
+
+
+class SandboxPoolTestCase(SimpleTestCase):
+    """Test the warm worker pool directly"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.input_path = Path(self.tmp.name) / 'input.parquet'
+        pd.DataFrame({'a': [1, 2]}).to_parquet(self.input_path, index=False)
+
+    def job(self, code):
+        return {
+            'code': code,
+            'input_path': str(self.input_path),
+            'input_format': 'parquet',
+            'output_path': str(Path(self.tmp.name) / 'output.arrow'),
+            'cwd': self.tmp.name,
+        }
+
+    def make_pool(self, **options):
+        pool = SandboxPool(size=1, **options)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_worker_is_reused_then_recycled(self):
+        pool = self.make_pool(max_runs=2)
+        code = 'import os\nprint(os.getpid())\noutput_df = input_df'
+
+        pids = [pool.run(self.job(code), timeout=30)['stdout'].strip() for _ in range(3)]
+
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_user_error_is_reported(self):
+        result = self.make_pool().run(self.job('output_df = 1'), timeout=30)
+        self.assertFalse(result['ok'])
+        self.assertIn('TypeError: output_df must be a pandas DataFrame', result['stderr'])
+
+    def test_output_arrives_while_code_runs(self):
+        received = []
+        code = "import time\nprint('first')\ntime.sleep(0.5)\nprint('second')\noutput_df = input_df"
+
+        result = self.make_pool().run(
+            self.job(code), timeout=30, on_output=lambda stream, text: received.append((time.monotonic(), text)),
+        )
+
+        self.assertEqual(result['stdout'], 'first\nsecond\n')
+        self.assertEqual(received[0][1], 'first\n')
+        self.assertGreater(received[-1][0] - received[0][0], 0.3)
+
+    def test_output_is_capped_to_the_tail(self):
+        code = "for i in range(1000):\n    print(i)\noutput_df = input_df"
+        result = self.make_pool().run(self.job(code), timeout=30, max_output_chars=20)
+        self.assertTrue(result['stdout'].startswith('[... '))
+        self.assertTrue(result['stdout'].endswith('997\n998\n999\n'))
+
+    def test_timeout_keeps_partial_output(self):
+        with self.assertRaises(SandboxTimeout) as ctx:
+            self.make_pool().run(self.job("print('started')\nimport time\ntime.sleep(30)"), timeout=1)
+        self.assertEqual(ctx.exception.stdout, 'started\n')
+
+    def test_batches_mode_streams_chunks(self):
+        job = {**self.job(
+            "sizes = []\n"
+            "def transform():\n"
+            "    for chunk in input_batches:\n"
+            "        sizes.append(len(chunk))\n"
+            "        yield chunk.assign(b=chunk['a'] * 2)\n"
+            "output_batches = transform()\n"
+        ), 'input_mode': 'batches', 'batch_size': 1}
+
+        result = self.make_pool().run(job, timeout=30)
+
+        self.assertTrue(result['ok'], result['stderr'])
+        output = pa.ipc.open_file(pa.memory_map(job['output_path']))
+        self.assertEqual(output.num_record_batches, 2)
+        self.assertEqual(output.read_all().to_pydict(), {'a': [1, 2], 'b': [2, 4]})
+
+    def test_batches_input_is_read_without_memory_map(self):
+        ipc_path = Path(self.tmp.name) / 'input.arrow'
+        write_ipc(pa.table({'a': [1, 2, 3]}), ipc_path)
+        jobs = [
+            {'input_path': str(self.input_path), 'input_format': 'parquet', 'batch_size': 1},
+            {'input_path': str(ipc_path), 'input_format': 'ipc', 'batch_size': 2},
+        ]
+
+        with mock.patch('node_editor.sandbox.pa.memory_map', side_effect=AssertionError('mapped')), \
+                mock.patch('node_editor.sandbox.pq.ParquetFile', wraps=pq.ParquetFile) as parquet_file:
+            chunks = [[len(chunk) for chunk in iter_input_batches(job)] for job in jobs]
+
+        self.assertEqual(chunks, [[1, 1], [2, 1]])
+        self.assertFalse(parquet_file.call_args.kwargs['memory_map'])
+
+    def test_batches_with_mismatched_columns_fail(self):
+        job = {**self.job(
+            "output_batches = (chunk if i == 0 else chunk.rename(columns={'a': 'z'}) "
+            "for i, chunk in enumerate(input_batches))"
+        ), 'input_mode': 'batches', 'batch_size': 1}
+
+        result = self.make_pool().run(job, timeout=30)
+
+        self.assertFalse(result['ok'])
+        self.assertIn('does not match the columns/types of the first chunk', result['stderr'])
+
+    def test_timeout_kills_worker_and_pool_recovers(self):
+        pool = self.make_pool()
+        with self.assertRaises(SandboxTimeout):
+            pool.run(self.job('import time\ntime.sleep(30)'), timeout=0.5)
+
+        result = pool.run(self.job('output_df = input_df'), timeout=30)
+        self.assertTrue(result['ok'])
+
+    def test_cancel_kills_worker_and_pool_recovers(self):
+        pool = self.make_pool()
+        start = time.monotonic()
+        with self.assertRaises(SandboxCancelled) as ctx:
+            pool.run(
+                self.job("print('started', flush=True)\nimport time\ntime.sleep(30)"),
+                timeout=30,
+                should_cancel=lambda: time.monotonic() - start > 0.5,
+            )
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(ctx.exception.stdout, 'started\n')
+
+        result = pool.run(self.job('output_df = input_df'), timeout=30)
+        self.assertTrue(result['ok'])
+
+
+    def test_failing_callback_kills_worker_and_pool_recovers(self):
+        pool = self.make_pool()
+
+        def on_output(stream, text):
+            raise RuntimeError('event store unavailable')
+
+        with self.assertRaises(RuntimeError):
+            pool.run(self.job("print('first', flush=True)\noutput_df = input_df"), timeout=30, on_output=on_output)
+
+        result = pool.run(self.job("print('second')\noutput_df = input_df"), timeout=30)
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['stdout'], 'second\n')
+
+    def test_state_is_reset_between_runs(self):
+        pool = self.make_pool()
+        pool.run(self.job(
+            "import os\npd.set_option('display.max_rows', 3)\nos.environ['LEAK'] = '1'\noutput_df = input_df"
+        ), timeout=30)
+
+        result = pool.run(self.job(
+            "import os\nprint(pd.get_option('display.max_rows'), os.environ.get('LEAK'))\noutput_df = input_df"
+        ), timeout=30)
+
+        self.assertEqual(result['stdout'], f"{pd.get_option('display.max_rows')} None\n")
+
+
+class PythonCodeTestCase(TestCase):
+    """Test python_code end to end"""
+
+    def setUp(self):
+        collection = Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+
+        buffer = io.BytesIO()
+        pd.DataFrame({'a': [1, 2, 3]}).to_parquet(buffer, index=False, engine='pyarrow')
+        parent_doc = Document.objects.create(
+            title='parent', file=ContentFile(buffer.getvalue(), name='parent.parquet'), collection=collection,
+        )
+        items = {}
+        for html_id, original_id in [('parent', 'read_csv'), ('code', 'python_code')]:
+            items[html_id] = NodeItem.objects.create(
+                workflow=workflow,
+                node=node,
+                original_name=original_id,
+                original_id=original_id,
+                name=html_id,
+                html_id=html_id,
+                type='type',
+            )
+        NodeItem.objects.filter(pk=items['parent'].pk).update(response_data={'parquet_file_id': parent_doc.id})
+        Connection.objects.create(workflow=workflow, sourceId='parent', targetId='code')
+        self.node_item = items['code']
+        self.parent = items['parent']
+
+    def run_code(self, code):
+        return python_code({'node_item_id': self.node_item.id, 'code': code, 'input_data': {'x': 1}})
+
+    def test_output_is_persisted(self):
+        response = self.run_code("print('hi')\noutput_df = input_df.assign(b=input_df['a'] * 2)")
+
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['stdout'], 'hi\n')
+        self.assertEqual(response['stats']['column_names'], ['a', 'b'])
+
+    def test_error_is_last_stderr_line(self):
+        response = self.run_code("raise ValueError('bad input')")
+        self.assertEqual(response['status'], 'error')
+        self.assertEqual(response['error'], 'ValueError: bad input')
+
+    def test_local_parent_parquet_is_passed_through(self):
+        with mock.patch('node_editor.utils.python_code.write_ipc') as write_ipc:
+            response = self.run_code('output_df = input_df')
+        write_ipc.assert_not_called()
+        self.assertEqual(response['stats']['rows'], 3)
+
+    def test_html_table_input_is_handed_over_as_ipc(self):
+        NodeItem.objects.filter(pk=self.parent.pk).update(response_data={})
+        html_table = pd.DataFrame({'a': [1, 2]}).to_html(index=False)
+        with mock.patch('node_editor.utils.python_code.pd.read_html', return_value=[pd.DataFrame({'a': [1, 2]})]):
+            response = python_code({
+                'node_item_id': self.node_item.id,
+                'code': 'output_df = input_df * 10',
+                'input_data': {'html_table': html_table},
+            })
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['stats']['rows'], 2)
+
+    def test_output_is_recorded_as_run_events(self):
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item)
+        python_code({
+            'node_item_id': self.node_item.id,
+            'code': "print('hi')\noutput_df = input_df",
+            'input_data': {'x': 1},
+            'run_id': str(run.pk),
+        })
+        self.assertEqual(list(run.events.filter(kind='stdout').values_list('data', flat=True)), ['hi\n'])
+        self.assertEqual(set(run.events.values_list('node_item_id', flat=True)), {self.node_item.id})
+        # Each phase replaced the previous progress row
+        phases = [json.loads(data)['phase'] for data in run.events.filter(kind='progress').values_list('data', flat=True)]
+        self.assertEqual(phases, ['done'])
+
+    def test_batches_mode_end_to_end(self):
+        response = python_code({
+            'node_item_id': self.node_item.id,
+            'code': 'output_batches = (chunk[chunk.a > 1] for chunk in input_batches)',
+            'input_data': {'x': 1},
+            'input_mode': 'batches',
+            'batch_size': 2,
+        })
+        self.assertEqual(response['status'], 'success', response.get('error'))
+        self.assertEqual(response['stats']['rows'], 2)
+
+    def test_invalid_input_mode(self):
+        response = python_code({
+            'node_item_id': self.node_item.id, 'code': 'x', 'input_data': {'x': 1}, 'input_mode': 'rows',
+        })
+        self.assertEqual(response['status'], 'error')
+
+    def test_profile_reports_phases_and_hot_functions(self):
+        response = python_code({
+            'node_item_id': self.node_item.id,
+            'code': (
+                "def slow_step(df):\n"
+                "    return df.apply(lambda row: row['a'] * 2, axis=1)\n"
+                "output_df = input_df.assign(b=slow_step(input_df))"
+            ),
+            'input_data': {'x': 1},
+            'profile': True,
+            'profile_top': 50,
+        })
+
+        profile = response['profile']
+        self.assertEqual(set(profile['phases_ms']), {'load_ms', 'exec_ms', 'write_ms', 'persist_ms'})
+        self.assertLessEqual(len(profile['functions']), 50)
+        names = [f['function'] for f in profile['functions']]
+        self.assertIn('slow_step', names)
+        cumulative = [f['cumulative_time_ms'] for f in profile['functions']]
+        self.assertEqual(cumulative, sorted(cumulative, reverse=True))
+
+    def test_no_profile_by_default(self):
+        self.assertNotIn('profile', self.run_code('output_df = input_df'))
+
+    def test_advice_is_ranked_by_previous_profile(self):
+        code = (
+            "def double(row):\n"
+            "    return row['a'] * 2\n"
+            "for _, row in input_df.iterrows():\n"
+            "    pass\n"
+            "output_df = input_df.assign(b=input_df.apply(double, axis=1))"
+        )
+        first = python_code({
+            'node_item_id': self.node_item.id, 'code': code, 'input_data': {'x': 1},
+            'profile': True, 'profile_top': 100,
+        })
+        self.assertEqual({w['rule'] for w in first['advice']}, {'iterrows', 'apply_axis_1'})
+        self.assertNotIn('measured_ms', first['advice'][0])
+
+        NodeItem.objects.filter(pk=self.node_item.pk).update(response_data=first)
+        second = self.run_code(code)
+        self.assertTrue(all(w['measured_ms'] is not None for w in second['advice']))
+
+        # An edit moves the lines the profile was measured on
+        edited = self.run_code('x = 1\n' + code)
+        self.assertTrue(all('measured_ms' not in w for w in edited['advice']))
+
+    def test_cancelled_run_kills_the_code(self):
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item, status='cancelled')
+        start = time.monotonic()
+        with self.assertRaises(RunCancelled):
+            python_code({
+                'node_item_id': self.node_item.id,
+                'code': 'import time\ntime.sleep(30)\noutput_df = input_df',
+                'input_data': {'x': 1},
+                'run_id': str(run.pk),
+            })
+        self.assertLess(time.monotonic() - start, 10)
@@ -0,0 +1,329 @@
+"""
+Reader Tests for Node Editor App
+
+Crucial tests for the file reader nodes:
+- read_csv streaming mode writes the same data as the pandas path
+- Columns whose type changes after the first block fall back to string
+- read_json parses NDJSON with pyarrow and flattens nested records, however
+  long its first line; a single minified document still goes through json.load
+- read_excel keeps numeric types, widens columns instead of dropping late cells
+  that don't fit (all of them in one re-read), keeps cells right of the header
+  as "Unnamed: N" columns, and combines selected sheets
+- A cancelled run stops between batches and never saves an artifact; the
+  file written ahead of the status check is removed
+- Streaming reads report bytes read, rows and phases as progress events, kept
+  as one progress row per node and run
+"""
+import io
+import json
+from unittest import mock
+
+import openpyxl
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.cancellation import RunCancelled
+from node_editor.models import Node, NodeItem, NodeRun, Workflow
+from node_editor.progress import ProgressReporter
+from node_editor.utils.artifacts import save_parquet_document
+from node_editor.utils.read_csv import read_csv
+from node_editor.utils import read_excel as read_excel_module
+from node_editor.utils.read_excel import read_excel
+from node_editor.utils.read_json import read_json
+
+
+class ReaderTestCase(TestCase):
+    """Shared NodeItem/Document setup for reader tests"""
+
+    original_id = 'read_csv'
+
+    def setUp(self):
+        Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        node = Node.objects.create(name='Reader', html_id=self.original_id, type='reader', order=1)
+        self.node_item = NodeItem.objects.create(
+            workflow=workflow,
+            node=node,
+            original_name='Reader',
+            original_id=self.original_id,
+            name='Reader',
+            html_id=f'{self.original_id}_1',
+            type='reader',
+        )
+
+    def upload(self, name, content):
+        return Document.objects.create(title=name, file=ContentFile(content, name=name))
+
+    def read_artifact(self, response_data):
+        parquet_doc = Document.objects.get(id=response_data['parquet_file_id'])
+        with parquet_doc.file.open(mode='rb') as f:
+            return pd.read_parquet(f)
+
+
+class ReadCsvTestCase(ReaderTestCase):
+    """Test read_csv pandas and streaming modes"""
+
+    def test_streaming_matches_pandas(self):
+        doc = self.upload('data.csv', b'a,b\n1,x\n2,y\n3,z\n')
+        form_data = {'file_id': doc.id, 'node_item_id': self.node_item.id}
+
+        eager = read_csv({**form_data, 'streaming': False})
+        eager_df = self.read_artifact(eager)
+        streamed = read_csv({**form_data, 'streaming': True})
+        streamed_df = self.read_artifact(streamed)
+
+        self.assertEqual(streamed['stats'], eager['stats'])
+        self.assertEqual(streamed['html_table'], eager['html_table'])
+        pd.testing.assert_frame_equal(streamed_df, eager_df)
+
+    def test_streaming_rereads_mismatched_column_as_string(self):
+        rows = b''.join(b'%d,%d\n' % (i, i) for i in range(200))
+        doc = self.upload('data.csv', b'a,b\n' + rows + b'oops,1\n')
+
+        # Small blocks so the bad value lands after type inference
+        with mock.patch('node_editor.utils.read_csv.STREAMING_BLOCK_SIZE', 256):
+            response = read_csv({'file_id': doc.id, 'node_item_id': self.node_item.id, 'streaming': True})
+
+        df = self.read_artifact(response)
+        self.assertEqual(response['stats']['rows'], 201)
+        self.assertEqual(df['a'].iloc[-1], 'oops')
+        self.assertEqual(df['b'].dtype, 'int64')
+
+
+class ReadJsonTestCase(ReaderTestCase):
+    """Test read_json NDJSON and whole-document paths"""
+
+    original_id = 'read_json'
+
+    def test_ndjson_is_flattened(self):
+        doc = self.upload(
+            'data.json',
+            b'{"id": 1, "user": {"name": "a", "address": {"city": "x"}}}\n'
+            b'{"id": 2, "user": {"name": "b", "address": {"city": "y"}}}\n',
+        )
+        with mock.patch('node_editor.utils.read_json._read_json_dataframe') as fallback:
+            response = read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+
+        fallback.assert_not_called()
+        self.assertEqual(response['stats']['column_names'], ['id', 'user.name', 'user.address.city'])
+        df = self.read_artifact(response)
+        self.assertEqual(list(df['user.address.city']), ['x', 'y'])
+
+    def test_json_array_uses_fallback(self):
+        doc = self.upload('data.json', b'[{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]')
+        response = read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+        self.assertEqual(response['stats']['rows'], 2)
+        self.assertEqual(response['stats']['column_names'], ['a', 'b'])
+
+    def test_pretty_printed_object_uses_fallback(self):
+        doc = self.upload('data.json', b'{\n  "a": [1, 2],\n  "b": ["x", "y"]\n}\n')
+        with mock.patch('node_editor.utils.read_json.pa_json.read_json') as arrow_read:
+            response = read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+
+        arrow_read.assert_not_called()
+        self.assertEqual(response['stats']['rows'], 2)
+
+    def test_minified_object_uses_fallback(self):
+        doc = self.upload('data.json', b'{"a":[1,2,3],"b":[4,5,6]}')
+        response = read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+
+        self.assertEqual(response['stats']['rows'], 3)
+        self.assertEqual(list(self.read_artifact(response)['b']), [4, 5, 6])
+
+    def test_ndjson_with_a_first_line_longer_than_the_sniff_chunk(self):
+        doc = self.upload('data.json', b'{"a": 1, "b": "%s"}\n{"a": 2, "b": "y"}\n' % (b'x' * 100))
+
+        with mock.patch('node_editor.utils.read_json.SNIFF_CHUNK_SIZE', 16), \
+                mock.patch('node_editor.utils.read_json._read_json_dataframe') as fallback:
+            response = read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+
+        fallback.assert_not_called()
+        self.assertEqual(response['stats']['rows'], 2)
+        self.assertEqual(list(self.read_artifact(response)['a']), [1, 2])
+
+    def test_invalid_json_raises(self):
+        doc = self.upload('data.json', b'[{"a": 1}')
+        with self.assertRaises(ValueError):
+            read_json({'file_id': doc.id, 'node_item_id': self.node_item.id})
+
+
+class ReadExcelTestCase(ReaderTestCase):
+    """Test read_excel streaming mode and sheet selection"""
+
+    original_id = 'read_excel'
+
+    def setUp(self):
+        super().setUp()
+        workbook = openpyxl.Workbook()
+        sales = workbook.active
+        sales.title = 'Sales'
+        for row in [('item', 'qty', 'price'), ('a', 1, 2.5), ('b', 2, 3.0), ('c', 'n/a', 4.0)]:
+            sales.append(row)
+        costs = workbook.create_sheet('Costs')
+        for row in [('item', 'qty'), ('d', 1.5)]:
+            costs.append(row)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        self.doc = self.upload('book.xlsx', buffer.getvalue())
+
+    def test_first_sheet_keeps_types(self):
+        response = read_excel({'file_id': self.doc.id, 'node_item_id': self.node_item.id})
+        df = self.read_artifact(response)
+
+        self.assertEqual(response['stats']['column_names'], ['item', 'qty', 'price'])
+        self.assertEqual(df['price'].dtype, 'float64')
+        # 'qty' has a text cell, so the sample infers string for it
+        self.assertEqual(list(df['qty']), ['1', '2', 'n/a'])
+
+    def test_cells_after_sample_widen_their_column(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(('id', 'amount', 'code'))
+        for i in range(1, 1500):
+            sheet.append((i, i, i))
+        sheet.append((1500, 150.75, 'N/A'))
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        doc = self.upload('late.xlsx', buffer.getvalue())
+
+        response = read_excel({'file_id': doc.id, 'node_item_id': self.node_item.id})
+        df = self.read_artifact(response)
+
+        self.assertEqual(response['stats']['rows'], 1500)
+        self.assertNotIn('warnings', response)
+        self.assertEqual(df['id'].dtype, 'int64')
+        self.assertEqual(df['amount'].dtype, 'float64')
+        self.assertEqual(df['amount'].iloc[-1], 150.75)
+        self.assertEqual(df['amount'].iloc[0], 1.0)
+        self.assertEqual(df['code'].iloc[-1], 'N/A')
+        self.assertEqual(df['code'].iloc[0], '1')
+
+    def test_cells_right_of_the_header_are_kept(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(('id', 'name'))
+        sheet.append((1, 'a', 'extra'))
+        for i in range(2, 1500):
+            sheet.append((i, 'b'))
+        sheet.append((1500, 'c', None, 9.5))
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        doc = self.upload('wide.xlsx', buffer.getvalue())
+
+        response = read_excel({'file_id': doc.id, 'node_item_id': self.node_item.id})
+        df = self.read_artifact(response)
+
+        self.assertEqual(response['stats']['column_names'], ['id', 'name', 'Unnamed: 2', 'Unnamed: 3'])
+        self.assertEqual(df['Unnamed: 2'].iloc[0], 'extra')
+        # First seen after the sample, so typed like an empty sample column
+        self.assertEqual(df['Unnamed: 3'].iloc[-1], '9.5')
+
+    def test_mismatched_columns_are_widened_in_one_reread(self):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(('a', 'b'))
+        for i in range(1500):
+            sheet.append((i, i))
+        sheet.append((1.5, 1))
+        sheet.append(('x', 'y'))
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        doc = self.upload('mixed.xlsx', buffer.getvalue())
+
+        with mock.patch('node_editor.utils.read_excel.BATCH_ROWS', 500), \
+                mock.patch('node_editor.utils.read_excel._open_workbook', wraps=read_excel_module._open_workbook) as opened:
+            response = read_excel({'file_id': doc.id, 'node_item_id': self.node_item.id})
+        df = self.read_artifact(response)
+
+        # Sheet listing, the first pass and one re-read
+        self.assertEqual(opened.call_count, 3)
+        self.assertEqual(response['stats']['rows'], 1502)
+        self.assertEqual(list(df['a'].iloc[-2:]), ['1.5', 'x'])
+        self.assertEqual(list(df['b'].iloc[-2:]), ['1', 'y'])
+
+    def test_multiple_sheets_are_combined(self):
+        response = read_excel({
+            'file_id': self.doc.id,
+            'node_item_id': self.node_item.id,
+            'sheets': ['Sales', 'Costs'],
+        })
+        df = self.read_artifact(response)
+
+        self.assertEqual(response['stats']['rows'], 4)
+        self.assertEqual(list(df['sheet_name']), ['Sales'] * 3 + ['Costs'])
+        self.assertEqual(list(df['qty']), ['1', '2', 'n/a', '1.5'])
+
+    def test_unknown_sheet_raises(self):
+        with self.assertRaises(RuntimeError):
+            read_excel({'file_id': self.doc.id, 'node_item_id': self.node_item.id, 'sheets': ['Nope']})
+
+    def test_pandas_mode_is_kept(self):
+        response = read_excel({'file_id': self.doc.id, 'node_item_id': self.node_item.id, 'streaming': False})
+        self.assertEqual(self.read_artifact(response)['price'].dtype, 'object')
+
+
+class CancelledReadTestCase(ReaderTestCase):
+    """Test that readers stop when their run is cancelled"""
+
+    def test_streaming_read_stops_without_artifact(self):
+        doc = self.upload('data.csv', b'a,b\n1,x\n2,y\n3,z\n')
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item, status='cancelled')
+        documents = Document.objects.count()
+
+        with self.assertRaises(RunCancelled):
+            read_csv({'file_id': doc.id, 'node_item_id': self.node_item.id, 'streaming': True, 'run_id': str(run.pk)})
+
+        self.assertEqual(Document.objects.count(), documents)
+
+    def test_cancelled_run_never_saves_its_artifact(self):
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item, status='running')
+        # Cancelled after the last batch check, just before the save
+        NodeRun.objects.filter(pk=run.pk).update(status='cancelled')
+
+        buffer = io.BytesIO()
+        pd.DataFrame({'a': [1, 2]}).to_parquet(buffer)
+        storage = Document._meta.get_field('file').storage
+        files = set(storage.listdir('documents')[1]) if storage.exists('documents') else set()
+
+        with self.assertRaises(RunCancelled):
+            save_parquet_document(self.node_item, ContentFile(buffer.getvalue()), str(run.pk))
+
+        self.assertFalse(Document.objects.filter(collection__name='Parquet').exists())
+        # The file written ahead of the status check is removed again
+        self.assertEqual(set(storage.listdir('documents')[1]), files)
+
+
+class ReadProgressTestCase(ReaderTestCase):
+    """Test progress events published by readers"""
+
+    def test_streaming_csv_reports_bytes_and_rows(self):
+        content = b'a,b\n' + b''.join(b'%d,%d\n' % (i, i) for i in range(2000))
+        doc = self.upload('data.csv', content)
+        run = NodeRun.objects.create(workflow=self.node_item.workflow, node_item=self.node_item)
+
+        events = []
+        snapshot = ProgressReporter.snapshot
+
+        def recorded(reporter):
+            events.append(snapshot(reporter))
+            return events[-1]
+
+        with mock.patch('node_editor.utils.read_csv.STREAMING_BLOCK_SIZE', 4096), \
+                mock.patch('node_editor.progress.PROGRESS_INTERVAL', 0), \
+                mock.patch.object(ProgressReporter, 'snapshot', recorded):
+            read_csv({'file_id': doc.id, 'node_item_id': self.node_item.id, 'streaming': True, 'run_id': str(run.pk)})
+
+        stored = [json.loads(data) for data in run.events.filter(kind='progress').values_list('data', flat=True)]
+        self.assertEqual(stored, events[-1:])
+        parse = [e for e in events if e['phase'] == 'parse']
+        self.assertGreater(len(parse), 2)
+        self.assertEqual(parse[-1]['total_bytes'], len(content))
+        self.assertEqual(parse[-1]['percent'], 100.0)
+        self.assertEqual(parse[-1]['eta_seconds'], 0.0)
+        self.assertEqual([e['phase'] for e in events[-2:]], ['write', 'done'])
+        self.assertEqual(events[-1]['rows'], 2000)
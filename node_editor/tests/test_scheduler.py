@@ -0,0 +1,147 @@
+"""
+Scheduler Tests for Node Editor App
+
+Crucial tests for python_code admission control:
+- Waiting runs are admitted FIFO per user, least-served user first
+- The concurrency limit holds and queue wait time is reported
+- A cancelled run leaves the queue without taking a slot
+- Slots held by dead processes are reclaimed
+- Slots held in another container sharing the state file count against the limit
+- A run over its CPU limit is stopped
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+from django.test import SimpleTestCase
+
+from node_editor.cancellation import RunCancelled
+from node_editor.sandbox import SandboxCPULimit, SandboxPool
+from node_editor.scheduler import QueueTimeout, Scheduler, next_ticket
+
+
+class SchedulerTestCase(SimpleTestCase):
+    """Test slot admission across threads sharing one state file"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state_path = os.path.join(tmp.name, 'state.json')
+
+    def test_least_served_user_goes_first(self):
+        state = {
+            'running': [{'user': 'alice'}],
+            'waiting': [
+                {'ticket': 'a2', 'user': 'alice', 'enqueued': 1},
+                {'ticket': 'a3', 'user': 'alice', 'enqueued': 2},
+                {'ticket': 'b1', 'user': 'bob', 'enqueued': 3},
+            ],
+        }
+        self.assertEqual(next_ticket(state), 'b1')
+        state['running'] = []
+        self.assertEqual(next_ticket(state), 'a2')
+
+    def test_limit_holds_and_wait_is_reported(self):
+        scheduler = Scheduler(self.state_path, max_concurrent=1)
+        held = threading.Event()
+        release = threading.Event()
+
+        def holder():
+            with scheduler.slot('alice', run_timeout=10):
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        held.wait(5)
+        threading.Timer(0.3, release.set).start()
+
+        with scheduler.slot('bob', run_timeout=10) as queue_wait_ms:
+            self.assertGreaterEqual(queue_wait_ms, 250)
+        thread.join()
+
+    def test_queue_timeout(self):
+        scheduler = Scheduler(self.state_path, max_concurrent=1, queue_timeout=0.2)
+        with scheduler.slot('alice', run_timeout=10):
+            with self.assertRaises(QueueTimeout):
+                with scheduler.slot('bob', run_timeout=10):
+                    pass
+
+    def test_cancel_while_waiting_leaves_the_queue(self):
+        scheduler = Scheduler(self.state_path, max_concurrent=1, queue_timeout=5)
+
+        def cancelled():
+            raise RunCancelled()
+
+        with scheduler.slot('alice', run_timeout=10):
+            with self.assertRaises(RunCancelled):
+                with scheduler.slot('bob', run_timeout=10, check_cancel=cancelled):
+                    pass
+            with open(self.state_path) as f:
+                state = json.load(f)
+
+        self.assertEqual([e['user'] for e in state['running']], ['alice'])
+        self.assertEqual(state['waiting'], [])
+
+    def test_dead_process_slot_is_reclaimed(self):
+        scheduler = Scheduler(self.state_path, max_concurrent=1, queue_timeout=1)
+        with scheduler.slot('alice', run_timeout=10):
+            with open(self.state_path) as f:
+                state = json.load(f)
+        # Same slot, owned by a pid that no longer exists
+        state['running'][0]['pid'] = 2 ** 22 + 1
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+
+        with scheduler.slot('bob', run_timeout=10) as queue_wait_ms:
+            self.assertLess(queue_wait_ms, 500)
+
+
+    def test_other_container_slot_counts_until_its_lease_ends(self):
+        # e.g. the db_worker container, whose pids this process can't see
+        state_path = os.path.join(os.path.dirname(self.state_path), 'shared', 'state.json')
+        scheduler = Scheduler(state_path, max_concurrent=1, queue_timeout=0.2)
+        with scheduler.slot('alice', run_timeout=10):
+            with open(state_path) as f:
+                state = json.load(f)
+        state['running'][0].update(host='other-container', pid=2 ** 22 + 1)
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+        with self.assertRaises(QueueTimeout):
+            with scheduler.slot('bob', run_timeout=10):
+                pass
+
+        state['running'][0]['expires'] = time.time() - 1
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+        with scheduler.slot('bob', run_timeout=10) as queue_wait_ms:
+            self.assertLess(queue_wait_ms, 200)
+
+
+class ResourceLimitTestCase(SimpleTestCase):
+    """Test per-run rlimits in the sandbox worker"""
+
+    def test_cpu_limit_stops_run(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        input_path = Path(tmp.name) / 'input.parquet'
+        pd.DataFrame({'a': [1]}).to_parquet(input_path, index=False)
+        pool = SandboxPool(size=1)
+        self.addCleanup(pool.shutdown)
+
+        start = time.monotonic()
+        with self.assertRaises(SandboxCPULimit):
+            pool.run({
+                'code': 'while True:\n    pass',
+                'input_path': str(input_path),
+                'input_format': 'parquet',
+                'output_path': str(Path(tmp.name) / 'output.arrow'),
+                'cwd': tmp.name,
+                'limits': {'cpu_seconds': 1},
+            }, timeout=30)
+        self.assertLess(time.monotonic() - start, 10)
@@ -0,0 +1,188 @@
+"""
+Shared-Memory Cache Tests for Node Editor App
+
+Crucial tests for the host-wide artifact cache:
+- Columns decoded by one process are mapped by another without decoding
+- Only columns no process has decoded yet are decoded
+- Unreferenced artifacts are evicted least recently used first; referenced ones are kept
+- References of dead processes are dropped
+- The in-process column cache releases its reference once it drops an artifact
+- Tables over budget or hitting a full filesystem are returned as decoded, once, leaving no files
+- A hit by a process already holding a reference doesn't rewrite the index
+- Column files deleted before they were mapped are a miss; lock files are never deleted
+"""
+import multiprocessing
+import os
+import tempfile
+from unittest import mock
+
+import pyarrow as pa
+from django.test import SimpleTestCase
+
+from node_editor.shm_cache import SharedArtifactCache
+from node_editor.table_cache import ArrowTableCache
+
+TABLE = pa.table({'a': list(range(1000)), 'b': [float(i) for i in range(1000)]})
+
+
+def decoder():
+    return mock.Mock(side_effect=lambda names: TABLE if names is None else TABLE.select(names))
+
+
+def _decode_in_child(directory):
+    SharedArtifactCache(directory).get_table(1, 'v1', None, lambda names: TABLE)
+
+
+class SharedArtifactCacheTestCase(SimpleTestCase):
+    """Test the cache shared through a directory"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_other_process_maps_decoded_columns(self):
+        process = multiprocessing.get_context('fork').Process(target=_decode_in_child, args=(self.directory,))
+        process.start()
+        process.join()
+        decode = decoder()
+
+        table = SharedArtifactCache(self.directory).get_table(1, 'v1', None, decode)
+
+        decode.assert_not_called()
+        self.assertTrue(table.equals(TABLE))
+        stats = SharedArtifactCache(self.directory).stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_only_missing_columns_are_decoded(self):
+        cache = SharedArtifactCache(self.directory)
+        decode = decoder()
+
+        cache.get_table(1, 'v1', ['a'], decode)
+        table = cache.get_table(1, 'v1', ['b', 'a'], decode)
+
+        self.assertEqual(decode.call_args_list, [mock.call(['a']), mock.call(['b'])])
+        self.assertTrue(table.equals(TABLE.select(['b', 'a'])))
+
+    def test_over_budget_table_is_decoded_once_and_not_written(self):
+        cache = SharedArtifactCache(self.directory, max_bytes=TABLE.nbytes - 1)
+        decode = decoder()
+
+        table = cache.get_table(1, 'v1', None, decode)
+
+        decode.assert_called_once_with(None)
+        self.assertTrue(table.equals(TABLE))
+        self.assertFalse([f for f in os.listdir(cache.directory) if '.arrow' in f])
+
+    def test_rejected_columns_are_merged_with_cached_ones(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', ['a'], decoder())
+        cache.max_bytes = TABLE.column('b').nbytes - 1
+        decode = decoder()
+
+        table = cache.get_table(1, 'v1', ['b', 'a'], decode)
+
+        decode.assert_called_once_with(['b'])
+        self.assertTrue(table.equals(TABLE.select(['b', 'a'])))
+
+    def test_full_filesystem_leaves_no_temporary_files(self):
+        cache = SharedArtifactCache(self.directory)
+        decode = decoder()
+
+        with mock.patch('node_editor.shm_cache.pa.ipc.new_file', side_effect=OSError(28, 'No space left on device')):
+            table = cache.get_table(1, 'v1', None, decode)
+
+        decode.assert_called_once_with(None)
+        self.assertTrue(table.equals(TABLE))
+        self.assertFalse([f for f in os.listdir(cache.directory) if '.arrow' in f])
+
+    def test_lru_eviction_keeps_referenced_artifacts(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', None, decoder())
+        cache.max_bytes = cache.stats()['bytes'] * 2
+        cache.get_table(2, 'v1', None, decoder())
+        cache.release(2, 'v1')
+
+        # Artifact 1 is still referenced, so the least recently used unreferenced one goes
+        cache.get_table(3, 'v1', None, decoder())
+        decode = decoder()
+        cache.get_table(1, 'v1', None, decode)
+
+        decode.assert_not_called()
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['artifacts'], 2)
+
+    def test_dead_process_references_are_dropped(self):
+        process = multiprocessing.get_context('fork').Process(target=_decode_in_child, args=(self.directory,))
+        process.start()
+        process.join()
+
+        SharedArtifactCache(self.directory).clear()
+
+        self.assertEqual(SharedArtifactCache(self.directory).stats()['artifacts'], 0)
+
+    def test_new_version_replaces_unreferenced_old_one(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', None, decoder())
+        cache.release(1, 'v1')
+
+        cache.get_table(1, 'v2', None, decoder())
+
+        self.assertEqual(cache.stats()['artifacts'], 1)
+        self.assertEqual(len([f for f in os.listdir(cache.directory) if f.endswith('.arrow')]), 2)
+
+    def test_table_cache_releases_dropped_artifacts(self):
+        shared = SharedArtifactCache(self.directory)
+        tables = ArrowTableCache(max_bytes=TABLE.nbytes, on_release=shared.release)
+
+        tables.get_table(1, 'v1', None, lambda names: shared.get_table(1, 'v1', names, decoder()))
+        tables.get_table(2, 'v1', None, lambda names: shared.get_table(2, 'v1', names, decoder()))
+
+        # Artifact 1's columns left the in-process cache, so its files may go
+        self.assertEqual(shared.stats()['referenced'], 1)
+        shared.clear()
+        self.assertEqual(shared.stats()['artifacts'], 1)
+
+    def test_repeated_hit_does_not_rewrite_index(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', None, decoder())
+        cache.get_table(1, 'v1', None, decoder())
+        index = os.stat(cache.index_path)
+
+        cache.get_table(1, 'v1', ['a'], decoder())
+
+        self.assertEqual(os.stat(cache.index_path).st_ino, index.st_ino)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_deleted_column_file_is_a_miss(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', None, decoder())
+        acquire = cache._acquire
+        evicted = []
+
+        def acquire_then_evicted(index, key, columns):
+            names = acquire(index, key, columns)
+            if not evicted:
+                evicted.extend(f for f in os.listdir(cache.directory) if f.endswith('.arrow'))
+                for name in evicted:
+                    os.unlink(os.path.join(cache.directory, name))
+            return names
+
+        decode = decoder()
+        with mock.patch.object(cache, '_acquire', side_effect=acquire_then_evicted):
+            table = cache.get_table(1, 'v1', None, decode)
+
+        decode.assert_called_once_with(None)
+        self.assertTrue(table.equals(TABLE))
+
+    def test_lock_files_are_kept_on_eviction(self):
+        cache = SharedArtifactCache(self.directory)
+        cache.get_table(1, 'v1', None, decoder())
+        cache.release(1, 'v1')
+        locks = [f for f in os.listdir(cache.directory) if f.endswith('.lock')]
+
+        cache.clear()
+
+        self.assertEqual(cache.stats()['artifacts'], 0)
+        self.assertEqual([f for f in os.listdir(cache.directory) if f.endswith('.lock')], locks)
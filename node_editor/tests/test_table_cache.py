@@ -0,0 +1,151 @@
+"""
+Table Cache Tests for Node Editor App
+
+Crucial tests for the in-process Arrow column cache:
+- A repeated read is served from memory without decoding
+- Only columns missing from the cache are decoded
+- The cache stays within its byte budget, evicting least recently used columns
+- A new version of an artifact replaces the old one's columns
+- select_columns re-runs against the same parent skip parquet decoding
+- Repeated column names are decoded and returned once
+"""
+import io
+from unittest import mock
+
+import pyarrow as pa
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APITestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.models import Node, NodeItem, Workflow
+from node_editor.table_cache import ArrowTableCache
+from node_editor.utils.artifacts import _load_columns, read_parquet_table, scan_parquet
+from node_editor.utils.select_columns import select_columns
+
+TABLE = pa.table({'a': list(range(100)), 'b': [float(i) for i in range(100)], 'c': [str(i) for i in range(100)]})
+
+
+class ArrowTableCacheTestCase(SimpleTestCase):
+    """Test the cache itself"""
+
+    def loader(self):
+        return mock.Mock(side_effect=lambda columns: TABLE if columns is None else TABLE.select(columns))
+
+    def test_repeated_read_is_a_hit(self):
+        cache = ArrowTableCache(max_bytes=1024 * 1024)
+        load = self.loader()
+
+        first = cache.get_table(1, 'v1', None, load)
+        second = cache.get_table(1, 'v1', None, load)
+
+        load.assert_called_once_with(None)
+        self.assertTrue(second.equals(first))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_only_missing_columns_are_decoded(self):
+        cache = ArrowTableCache(max_bytes=1024 * 1024)
+        load = self.loader()
+
+        cache.get_table(1, 'v1', ['a'], load)
+        table = cache.get_table(1, 'v1', ['b', 'a'], load)
+
+        self.assertEqual(load.call_args_list[-1], mock.call(['b']))
+        self.assertEqual(table.column_names, ['b', 'a'])
+        self.assertTrue(table.equals(TABLE.select(['b', 'a'])))
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        column_bytes = TABLE.column('a').nbytes
+        cache = ArrowTableCache(max_bytes=column_bytes * 2)
+        load = self.loader()
+
+        cache.get_table(1, 'v1', ['a'], load)
+        cache.get_table(2, 'v1', ['a'], load)
+        cache.get_table(1, 'v1', ['a'], load)
+        cache.get_table(3, 'v1', ['a'], load)
+
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], cache.max_bytes)
+        self.assertEqual(stats['evictions'], 1)
+        # Artifact 2 was the least recently used
+        cache.get_table(1, 'v1', ['a'], load)
+        self.assertEqual(cache.hits, 2)
+
+    def test_new_version_replaces_old_columns(self):
+        cache = ArrowTableCache(max_bytes=1024 * 1024)
+        load = self.loader()
+
+        cache.get_table(1, 'v1', None, load)
+        cache.get_table(1, 'v2', None, load)
+
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(cache.stats()['columns'], 3)
+
+
+class SelectColumnsCacheTestCase(TestCase):
+    """Test that select_columns re-runs are served from the cache"""
+
+    def setUp(self):
+        collection = Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+        buffer = io.BytesIO()
+        TABLE.to_pandas().to_parquet(buffer, index=False)
+        parent_doc = Document.objects.create(
+            title='parent', file=ContentFile(buffer.getvalue(), name='parent.parquet'), collection=collection,
+        )
+        parent = NodeItem.objects.create(
+            workflow=workflow, node=node, original_name='read_csv', original_id='read_csv',
+            name='parent', html_id='parent', type='type', response_data={'parquet_file_id': parent_doc.id},
+        )
+        self.node_item = NodeItem.objects.create(
+            workflow=workflow, node=node, original_name='select_columns', original_id='select_columns',
+            name='select', html_id='select', type='type',
+        )
+        NodeItem.objects.filter(pk=self.node_item.pk).update(parent=parent)
+        self.cache = ArrowTableCache()
+        patcher = mock.patch('node_editor.utils.artifacts.table_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rerun_skips_decoding(self):
+        form_data = {'node_item_id': self.node_item.id, 'selected_columns': ['a', 'c']}
+        select_columns(form_data)
+
+        with mock.patch('node_editor.utils.artifacts.pq.read_table') as read_table:
+            response = select_columns({**form_data, 'selected_columns': ['c']})
+
+        read_table.assert_not_called()
+        self.assertEqual(response['stats']['column_names'], ['c'])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_repeated_columns_are_read_once(self):
+        parent_doc = Document.objects.get(title='parent')
+
+        for read in (read_parquet_table, scan_parquet):
+            self.cache.clear()
+            with self.subTest(read=read.__name__), \
+                    mock.patch('node_editor.utils.artifacts._load_columns', wraps=_load_columns) as load:
+                table = read(parent_doc, ['c', 'a', 'c'])
+
+                self.assertEqual(table.column_names, ['c', 'a'])
+                self.assertEqual(load.call_args.args[2], ['c', 'a'])
+
+class ArtifactCacheStatsViewTestCase(APITestCase):
+    """Test GET/DELETE /node_editor/artifact_cache/"""
+
+    def test_stats_and_clear(self):
+        cache = ArrowTableCache()
+        cache.get_table(1, 'v1', None, lambda columns: TABLE)
+        self.client.force_authenticate(user=User.objects.create_user(username='testuser', password='pass'))
+
+        with mock.patch('node_editor.views.table_cache', return_value=cache):
+            stats = self.client.get('/node_editor/artifact_cache/')
+            cleared = self.client.delete('/node_editor/artifact_cache/')
+
+        self.assertEqual(stats.data['misses'], 1)
+        self.assertEqual(stats.data['columns'], 3)
+        self.assertEqual(cleared.data['bytes'], 0)
@@ -0,0 +1,190 @@
+"""
+Transform Node Tests for Node Editor App
+
+Crucial tests for nodes that read their parent's parquet:
+- Connecting a node references the parent's parquet instead of copying it
+- select_columns writes its own parquet only when it runs
+- select_columns decodes only the selected columns
+- Local artifacts are memory-mapped; remote backends fall back to the file stream
+- Each node's parquet is recorded as a NodeArtifact and found through it, not by title
+- Stats and preview come from the parquet footer and first row group
+"""
+import io
+from unittest import mock
+
+import pandas as pd
+import pyarrow.parquet as pq
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor.dispatcher import run_reader
+from node_editor.models import Connection, Node, NodeArtifact, NodeItem, Workflow
+from node_editor.utils.preview import parquet_preview
+from node_editor.utils.select_columns import select_columns
+
+
+class TransformTestCase(TestCase):
+    """Parent node with a parquet artifact, plus helpers to add children"""
+
+    def setUp(self):
+        self.collection = Collection.get_first_root_node().add_child(name='Parquet')
+        user = User.objects.create_user(username='testuser', password='pass')
+        self.workflow = Workflow.objects.create(user=user, name='Workflow 1')
+        self.node = Node.objects.create(name='Node', html_id='node', type='type', order=1)
+
+        self.df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z'], 'c': [1.5, None, 3.5]})
+        buffer = io.BytesIO()
+        self.df.to_parquet(buffer, index=False, engine='pyarrow')
+        self.parent_doc = Document.objects.create(
+            title='parent',
+            file=ContentFile(buffer.getvalue(), name='parent.parquet'),
+            collection=self.collection,
+        )
+        self.parent = self.add_node('parent', 'read_csv', response_data={
+            'html_table': self.df.head().to_html(index=False),
+            'parquet_file_id': self.parent_doc.id,
+        })
+
+    def add_node(self, html_id, original_id, response_data=None):
+        return NodeItem.objects.create(
+            workflow=self.workflow,
+            node=self.node,
+            original_name=original_id,
+            original_id=original_id,
+            name=html_id,
+            html_id=html_id,
+            type='type',
+            response_data=response_data,
+        )
+
+    def connect(self, child):
+        Connection.objects.create(workflow=self.workflow, sourceId=self.parent.html_id, targetId=child.html_id)
+        child.refresh_from_db()
+        return child
+
+    def read_artifact(self, response_data):
+        parquet_doc = Document.objects.get(id=response_data['parquet_file_id'])
+        with parquet_doc.file.open(mode='rb') as f:
+            return pd.read_parquet(f)
+
+
+class ConnectInitTestCase(TransformTestCase):
+    """Test connect-time initialization of select_columns and save_file"""
+
+    def test_connect_references_parent_parquet(self):
+        for html_id, original_id in [('select', 'select_columns'), ('save', 'save_file')]:
+            child = self.connect(self.add_node(html_id, original_id))
+
+            self.assertEqual(child.response_data['parquet_file_id'], self.parent_doc.id)
+            stats = child.response_data['stats']
+            self.assertEqual((stats['rows'], stats['columns'], stats['column_names']), (3, 3, ['a', 'b', 'c']))
+            self.assertEqual(child.response_data['html_table'], self.parent.response_data['html_table'])
+            self.assertFalse(Document.objects.filter(title=html_id).exists())
+
+
+class SelectColumnsTestCase(TransformTestCase):
+    """Test select_columns runs"""
+
+    def setUp(self):
+        super().setUp()
+        self.child = self.connect(self.add_node('select', 'select_columns'))
+
+    def test_run_materializes_selected_columns(self):
+        response = select_columns({'node_item_id': self.child.id, 'selected_columns': ['c', 'a']})
+
+        self.assertNotEqual(response['parquet_file_id'], self.parent_doc.id)
+        pd.testing.assert_frame_equal(self.read_artifact(response), self.df[['c', 'a']])
+
+    def test_only_selected_columns_are_read(self):
+        with mock.patch('node_editor.utils.artifacts.pq.read_table', wraps=pq.read_table) as read_table:
+            select_columns({'node_item_id': self.child.id, 'selected_columns': ['b']})
+        self.assertEqual(read_table.call_args.kwargs['columns'], ['b'])
+
+    def test_local_artifact_is_memory_mapped(self):
+        with mock.patch('node_editor.utils.artifacts.pq.read_table', wraps=pq.read_table) as read_table:
+            select_columns({'node_item_id': self.child.id, 'selected_columns': ['a']})
+
+        self.assertEqual(read_table.call_args.args[0], self.parent_doc.file.path)
+        self.assertTrue(read_table.call_args.kwargs['memory_map'])
+        self.assertTrue(read_table.call_args.kwargs['pre_buffer'])
+
+    def test_remote_storage_reads_the_stream(self):
+        with mock.patch('node_editor.utils.artifacts.local_path', return_value=None), \
+                mock.patch('node_editor.utils.artifacts.pq.read_table', wraps=pq.read_table) as read_table:
+            response = select_columns({'node_item_id': self.child.id, 'selected_columns': ['b', 'c']})
+
+        self.assertNotIsInstance(read_table.call_args.args[0], str)
+        pd.testing.assert_frame_equal(self.read_artifact(response), self.df[['b', 'c']])
+
+    def test_missing_columns_raise_before_loading_data(self):
+        with mock.patch('node_editor.utils.select_columns.read_parquet_table') as read_table:
+            with self.assertRaises(ValueError):
+                select_columns({'node_item_id': self.child.id, 'selected_columns': ['a', 'nope']})
+        read_table.assert_not_called()
+
+
+class NodeArtifactTestCase(TransformTestCase):
+    """Test the NodeArtifact record of a node's parquet"""
+
+    def setUp(self):
+        super().setUp()
+        self.child = self.connect(self.add_node('select', 'select_columns'))
+
+    def test_run_records_artifact(self):
+        response = run_reader('select_columns', {'node_item_id': self.child.id, 'selected_columns': ['c', 'a']})
+
+        artifact = NodeArtifact.objects.get(node_item=self.child)
+        self.assertEqual(artifact.document_id, response['parquet_file_id'])
+        self.assertEqual(artifact.fingerprint, response['fingerprint'])
+        self.assertEqual(artifact.row_count, 3)
+        self.assertEqual(artifact.schema, [{'name': 'c', 'type': 'double'}, {'name': 'a', 'type': 'int64'}])
+        self.assertEqual(artifact.byte_size, artifact.document.file.size)
+
+    def test_rerun_replaces_file_of_same_document(self):
+        first = select_columns({'node_item_id': self.child.id, 'selected_columns': ['a']})
+        # The title no longer identifies the artifact
+        Document.objects.filter(id=first['parquet_file_id']).update(title='renamed')
+
+        second = select_columns({'node_item_id': self.child.id, 'selected_columns': ['b']})
+
+        self.assertEqual(second['parquet_file_id'], first['parquet_file_id'])
+        self.assertEqual(NodeArtifact.objects.get(node_item=self.child).schema, [{'name': 'b', 'type': 'string'}])
+        pd.testing.assert_frame_equal(self.read_artifact(second), self.df[['b']])
+
+    def test_disconnect_deletes_artifact(self):
+        response = select_columns({'node_item_id': self.child.id, 'selected_columns': ['a']})
+
+        Connection.objects.filter(targetId=self.child.html_id).delete()
+
+        self.assertFalse(Document.objects.filter(id=response['parquet_file_id']).exists())
+        self.assertFalse(NodeArtifact.objects.filter(node_item=self.child).exists())
+        self.assertTrue(Document.objects.filter(id=self.parent_doc.id).exists())
+
+
+class ParquetPreviewTestCase(TransformTestCase):
+    """Test the metadata-only stats and preview builder"""
+
+    def test_stats_from_footer(self):
+        stats = parquet_preview(self.parent_doc)['stats']
+
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['column_types'], {'a': 'int64', 'b': 'string', 'c': 'double'})
+        self.assertEqual(stats['null_counts'], {'a': 0, 'b': 0, 'c': 1})
+
+    def test_preview_reads_only_first_rows(self):
+        df = pd.DataFrame({'a': range(1000)})
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False, engine='pyarrow', row_group_size=100)
+        doc = Document.objects.create(
+            title='big', file=ContentFile(buffer.getvalue(), name='big.parquet'), collection=self.collection,
+        )
+
+        with mock.patch('pyarrow.parquet.ParquetFile.read') as read:
+            preview = parquet_preview(doc)
+
+        read.assert_not_called()
+        self.assertEqual(preview['stats']['rows'], 1000)
+        self.assertEqual(preview['html_table'].count('</tr>'), 1 + 5)  # header + preview rows
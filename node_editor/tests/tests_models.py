@@ -4,7 +4,7 @@ from wagtail.images.tests.utils import get_test_image_file
 from wagtail.images.models import Image
 from wagtail.documents.models import Document
 
-from node_editor.models import NodeCategory, Node, Workflow, NodeItem, Connection
+from node_editor.models import NodeCategory, Node, Workflow, NodeItem, Connection, NodeArtifact
 
 
 class NodeModelsTestCase(TestCase):
@@ -73,6 +73,7 @@ class NodeModelsTestCase(TestCase):
 
         # Create a Document
         self.document = Document.objects.create(title=self.node_item1.html_id, file=image_file)
+        NodeArtifact.objects.create(node_item=self.node_item1, document=self.document)
 
     def test_node_category_creation(self):
         self.assertEqual(NodeCategory.objects.count(), 1)
@@ -112,7 +113,7 @@ class NodeModelsTestCase(TestCase):
         self.assertEqual(Connection.objects.filter(sourceId="item1").count(), 0)
         self.assertEqual(Connection.objects.filter(targetId="item1").count(), 0)
 
-        # Document with title = html_id should be deleted
+        # The node's artifact document should be deleted
         self.assertEqual(Document.objects.filter(title="item1").count(), 0)
 
         # NodeItem itself should be deleted
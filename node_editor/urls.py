@@ -8,9 +8,15 @@ from .views import (
     WorkflowListCreate,
     WorkflowDetail,
     WorkflowBulkDelete,
+    WorkflowRun,
+    WorkflowPlan,
     NodeItemListCreate,
     NodeItemDetail,
     NodeItemUpdateFormData,
+    NodeItemRun,
+    NodeRunDetail,
+    NodeRunEvents,
+    ArtifactCacheStats,
     ConnectionListCreate,
     ConnectionNodeDetail,
     DownloadFile
@@ -25,9 +31,15 @@ urlpatterns = [
     path('', WorkflowListCreate.as_view()),
     path('<int:pk>/', WorkflowDetail.as_view()),
     path('bulk_delete/', WorkflowBulkDelete.as_view()),
+    path('<int:pk>/run/', WorkflowRun.as_view()),
+    path('<int:pk>/plan/', WorkflowPlan.as_view()),
     path('node_item/', NodeItemListCreate.as_view()),
     path('node_item/<int:pk>/', NodeItemDetail.as_view()),
     path('node_item/form_data/<int:pk>/', NodeItemUpdateFormData.as_view()),
+    path('node_item/run/<int:pk>/', NodeItemRun.as_view()),
+    path('run/<uuid:pk>/', NodeRunDetail.as_view()),
+    path('run/<uuid:pk>/events/', NodeRunEvents.as_view()),
+    path('artifact_cache/', ArtifactCacheStats.as_view()),
     path('connection/', ConnectionListCreate.as_view()),
     path('connection/<int:pk>/', ConnectionNodeDetail.as_view()),
     path('download_file/', DownloadFile.as_view()),
@@ -0,0 +1,312 @@
+"""
+Shared helpers for node data files: the uploaded source Documents and the
+per-node parquet artifacts kept in the Wagtail "Parquet" collection.
+
+Decoded parquet columns go through the process-wide Arrow cache
+(node_editor.table_cache), so repeated reads of the same artifact skip decoding.
+Behind it, decoded artifacts are kept once per host in shared memory
+(node_editor.shm_cache) and memory-mapped by every process.
+"""
+import os
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from wagtail.documents.models import Document
+from wagtail.models import Collection
+
+from node_editor import shm_cache
+from node_editor.cancellation import unless_cancelled
+from node_editor.models import NodeArtifact
+from node_editor.table_cache import DEFAULT_MAX_BYTES, get_table_cache
+
+
+# Dataset scans of local artifacts: memory-mapped files, pre-buffered column chunks
+_MMAP_FILESYSTEM = pafs.LocalFileSystem(use_mmap=True)
+_PARQUET_FORMAT = ds.ParquetFileFormat(
+    default_fragment_scan_options=ds.ParquetFragmentScanOptions(pre_buffer=True),
+)
+
+
+def local_path(document):
+    """
+    Filesystem path of a Document's file when the storage is local (FileSystemStorage),
+    otherwise None. pyarrow reads native paths much faster than Django file wrappers.
+    """
+    try:
+        path = document.file.path
+    except NotImplementedError:
+        return None
+    return path if document.file.storage.exists(document.file.name) else None
+
+
+@contextmanager
+def open_document(document):
+    """
+    Binary source for a Document's file. On local storage this is a pyarrow memory
+    map of the real path, which pyarrow readers consume without copying through
+    Python (it is also a seekable file object for pandas/openpyxl); remote
+    backends fall back to the storage's stream.
+    """
+    path = local_path(document)
+    if path:
+        with pa.memory_map(path) as source:
+            yield source
+        return
+    with document.file.open(mode='rb') as f:
+        yield f
+
+
+def table_cache():
+    """Process-wide Arrow column cache sized from settings (0 disables it)."""
+    return get_table_cache(getattr(settings, 'ARROW_TABLE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES), _release_shared)
+
+
+def shared_cache():
+    """
+    Host-wide shared-memory artifact cache from settings, or None when it is
+    disabled (budget 0) or its directory isn't usable.
+    """
+    directory = getattr(settings, 'ARTIFACT_SHM_CACHE_DIR', '/dev/shm')
+    max_bytes = getattr(settings, 'ARTIFACT_SHM_CACHE_MAX_BYTES', shm_cache.DEFAULT_MAX_BYTES)
+    if max_bytes <= 0 or not directory or not os.path.isdir(directory) or not os.access(directory, os.W_OK):
+        return None
+    return shm_cache.SharedArtifactCache(directory, max_bytes)
+
+
+def _release_shared(artifact_id, version):
+    cache = shared_cache()
+    if cache is not None:
+        cache.release(artifact_id, version)
+
+
+def _load_columns(document, version, names, decode):
+    """
+    Columns names (None for all) of a parquet Document, mapped from the host-wide
+    shared-memory cache; only columns no process has decoded yet are decoded,
+    with decode(names).
+    """
+    cache = shared_cache()
+    if cache is None:
+        return decode(names)
+    return cache.get_table(document.id, version, names, decode)
+
+
+def artifact_version(document):
+    """
+    Identifies the current content of a Document's file for caching: its name plus
+    mtime and size on local storage, the stored hash or size elsewhere.
+    """
+    path = local_path(document)
+    if path:
+        stat = os.stat(path)
+        return (document.file.name, stat.st_mtime_ns, stat.st_size)
+    return (document.file.name, document.file_hash or document.file_size)
+
+
+@contextmanager
+def stored_file(filename, content):
+    """
+    Write content to the Documents storage and yield the name it was stored
+    under. Nothing is locked while the file is copied; the caller points a
+    Document at it afterwards. The file is deleted again if the block raises
+    (RunCancelled included), so an abandoned save leaves nothing behind.
+    """
+    field = Document._meta.get_field('file')
+    name = field.storage.save(field.generate_filename(None, filename), content)
+    try:
+        yield name
+    except BaseException:
+        field.storage.delete(name)
+        raise
+
+
+def replace_document_file(document, name):
+    """
+    Point document at the already stored file name. The previous file is deleted
+    once the change is committed; readers that still have it open keep working on
+    local storage. The stored hash and size are reset so Wagtail recomputes them
+    for the new content (memo keys use them).
+    """
+    old_name = document.file.name
+    storage = document.file.storage
+    document.file = name
+    document.file_hash = ''
+    document.file_size = None
+    document.save()
+    if old_name and old_name != name:
+        transaction.on_commit(lambda: storage.delete(old_name))
+
+
+_parquet_collection_id = None
+
+
+def parquet_collection():
+    """The "Parquet" collection; its id is cached per process so it is found by primary key."""
+    global _parquet_collection_id
+    if _parquet_collection_id is not None:
+        collection = Collection.objects.filter(pk=_parquet_collection_id).first()
+        if collection is not None:
+            return collection
+    collection, _ = Collection.objects.get_or_create(name='Parquet')
+    _parquet_collection_id = collection.pk
+    return collection
+
+
+def save_parquet_document(node_item, content, run_id=None):
+    """
+    Store content (a Django File, e.g. a ContentFile or an open temp file) as the
+    node's parquet Document, replacing the previous file if there is one, and
+    record it (size, row count, schema) as the node's NodeArtifact. Raises
+    RunCancelled instead when run_id's NodeRun was cancelled.
+
+    The file is written and its footer read first; run_id's row lock is only held
+    for the status check and the Document/NodeArtifact update, so concurrent saves
+    of one workflow run and a cancel don't wait behind the copy.
+    """
+    with stored_file(f'{node_item.html_id}.parquet', content) as name:
+        stored = Document(file=name)
+        row_count, schema = parquet_metadata(stored)
+        byte_size = stored.file.size
+        with unless_cancelled(run_id):
+            document = _record_parquet_document(node_item, name, {
+                # Set by node_editor.memo once the run's fingerprint is known
+                'fingerprint': None,
+                'byte_size': byte_size,
+                'row_count': row_count,
+                'schema': [{'name': field.name, 'type': str(field.type)} for field in schema],
+                'accessed': timezone.now(),
+            })
+    table_cache().evict(document.id)
+    cache = shared_cache()
+    if cache is not None:
+        cache.evict(document.id)
+    return document
+
+
+def _record_parquet_document(node_item, name, defaults):
+    artifact = NodeArtifact.objects.select_related('document').filter(node_item=node_item).first()
+    if artifact:
+        document = artifact.document
+        replace_document_file(document, name)
+    else:
+        document = Document.objects.create(
+            title=node_item.html_id,
+            file=name,
+            collection=parquet_collection()
+        )
+    NodeArtifact.objects.update_or_create(node_item=node_item, defaults={'document': document, **defaults})
+    return document
+
+
+def touch_artifact(document_id):
+    """Mark the artifact stored in a Document as used now."""
+    NodeArtifact.objects.filter(document_id=document_id).update(accessed=timezone.now())
+
+
+@contextmanager
+def open_parquet_file(document):
+    """
+    pyarrow ParquetFile for a Document; opening it only reads the footer. Local
+    files are memory-mapped, and the column chunks of a read are pre-buffered
+    (coalesced, concurrent reads) in both cases.
+    """
+    path = local_path(document)
+    if path:
+        yield pq.ParquetFile(path, memory_map=True, pre_buffer=True)
+        return
+    with document.file.open(mode='rb') as f:
+        yield pq.ParquetFile(f, pre_buffer=True)
+
+
+def parquet_metadata(document):
+    """(row count, arrow schema) of a parquet Document, read from the file footer only."""
+    with open_parquet_file(document) as parquet_file:
+        return parquet_file.metadata.num_rows, parquet_file.schema_arrow
+
+
+def read_parquet_table(document, columns=None):
+    """
+    Decode a parquet Document into an Arrow table. With columns, only those column
+    chunks are read and decoded; columns already in the cache are not decoded again.
+    """
+    return _cached_table(
+        document, columns, lambda path, names: pq.read_table(path, columns=names, memory_map=True, pre_buffer=True),
+    )
+
+
+def scan_parquet(document, columns=None):
+    """
+    Arrow table from one pyarrow dataset scan of a parquet Document, projected to
+    columns so only those column chunks are read (and only when not cached).
+    """
+    return _cached_table(
+        document, columns,
+        lambda path, names: ds.dataset(path, format=_PARQUET_FORMAT, filesystem=_MMAP_FILESYSTEM).to_table(
+            columns=names,
+        ),
+    )
+
+
+def _cached_table(document, columns, read_local):
+    """
+    Columns (None for all) of a parquet Document through the caches. Columns
+    missing from them are decoded with read_local(path, names) on local storage,
+    from the storage's stream otherwise.
+    """
+    if columns is not None:
+        # A repeated name would be looked up, decoded and cached once per occurrence
+        columns = list(dict.fromkeys(columns))
+
+    def decode(names):
+        path = local_path(document)
+        if path:
+            return read_local(path, names)
+        with document.file.open(mode='rb') as f:
+            return pq.read_table(f, columns=names, pre_buffer=True)
+
+    touch_artifact(document.id)
+    version = artifact_version(document)
+    return table_cache().get_table(
+        document.id, version, columns, lambda names: _load_columns(document, version, names, decode),
+    )
+
+
+def init_from_parent(node_item):
+    """
+    On connection created: point the node at its parent's parquet instead of copying
+    it. Schema and stats come from the parquet footer; the preview is the parent's
+    (or rebuilt from the first row group if the parent has none).
+    A node writes its own parquet only when it actually transforms the data.
+    """
+    empty = {'html_table': '', 'stats': {'rows': 0, 'columns': 0, 'column_names': []}}
+    if not node_item.parent:
+        return {**empty, 'message': 'No parent connected.'}
+
+    parent_response = node_item.parent.response_data or {}
+    parquet_file_id = parent_response.get('parquet_file_id')
+    if parquet_file_id is None:
+        return {**empty, 'message': 'Run the parent node first.'}
+
+    try:
+        parquet_doc = Document.objects.get(id=parquet_file_id)
+    except Document.DoesNotExist:
+        return {**empty, 'message': 'Parent parquet document not found.'}
+
+    # Imported here: preview builds on the helpers in this module
+    from node_editor.utils.preview import parquet_preview
+
+    preview = parquet_preview(parquet_doc)
+    return {
+        'html_table': parent_response.get('html_table') or preview['html_table'],
+        'stats': preview['stats'],
+        'parquet_file_id': parquet_doc.id,
+        'parquet_file_url': parquet_doc.file.url,
+        'parquet_file_title': parquet_doc.title,
+        'parquet_source': 'parent',
+    }
@@ -0,0 +1,76 @@
+"""
+Shared preview/stats builder for node response_data.
+
+Row count, column names, types and null counts come from the parquet footer;
+the preview rows are decoded from the start of the first row group only, so the
+cost is proportional to the preview, not to the dataset.
+"""
+from node_editor.utils.artifacts import open_parquet_file
+
+PREVIEW_ROWS = 5
+
+
+def _null_counts(metadata, schema):
+    """Null count per top-level column from row group statistics (None if unknown)."""
+    counts = {name: 0 for name in schema.names}
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            name = column.path_in_schema
+            if name not in counts:
+                # Leaf of a nested column; the top-level count isn't in the footer
+                counts[name.split('.')[0]] = None
+                continue
+            stats = column.statistics
+            if counts[name] is None or stats is None or not stats.has_null_count:
+                counts[name] = None
+            else:
+                counts[name] += stats.null_count
+    return counts
+
+
+def parquet_preview(document):
+    """html_table and stats for a parquet Document without loading the dataset."""
+    with open_parquet_file(document) as parquet_file:
+        metadata = parquet_file.metadata
+        schema = parquet_file.schema_arrow
+        null_counts = _null_counts(metadata, schema)
+        preview = schema.empty_table()
+        if metadata.num_row_groups:
+            first_batch = next(
+                parquet_file.iter_batches(batch_size=PREVIEW_ROWS, row_groups=[0]), None
+            )
+            if first_batch is not None:
+                preview = first_batch
+
+    return _preview(preview, metadata.num_rows, schema, null_counts)
+
+
+def table_preview(table):
+    """html_table and stats for an Arrow table that is already in memory."""
+    null_counts = {name: table.column(name).null_count for name in table.schema.names}
+    return _preview(table.slice(0, PREVIEW_ROWS), table.num_rows, table.schema, null_counts)
+
+
+def _preview(preview, rows, schema, null_counts):
+    return {
+        'html_table': preview.to_pandas().head(PREVIEW_ROWS).to_html(index=False),
+        'stats': {
+            'rows': rows,
+            'columns': len(schema.names),
+            'column_names': schema.names,
+            'column_types': {field.name: str(field.type) for field in schema},
+            'null_counts': null_counts,
+        },
+    }
+
+
+def parquet_response(parquet_doc):
+    """Standard response_data for a node whose output is parquet_doc."""
+    return {
+        **parquet_preview(parquet_doc),
+        'parquet_file_id': parquet_doc.id,
+        'parquet_file_url': parquet_doc.file.url,
+        'parquet_file_title': parquet_doc.title
+    }
@@ -1,54 +1,142 @@
 """
 Python Code node: executes user Python code with input_df from upstream data.
 Returns response_data with html_table, stats, parquet for pipeline compatibility.
+
+With formData input_mode "batches" the code gets input_batches (DataFrame chunks)
+instead of input_df and can set output_batches, so inputs larger than memory
+can be transformed chunk by chunk.
+
+Responses carry 'advice': vectorization warnings for the submitted code (see
+node_editor.advisor), ranked by the node's previous profiled run of the same code.
 """
 import io
-import subprocess
-import sys
+import os
 import tempfile
 import time
 from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files import File
 from wagtail.documents.models import Document
-from wagtail.models import Collection
 
+from node_editor.advisor import analyze_code, rank_by_profile
+from node_editor.cancellation import CancelCheck, RunCancelled, cancel_check
 from node_editor.models import NodeItem
+from node_editor.progress import progress_reporter
+from node_editor.sandbox import (
+    DEFAULT_MAX_OUTPUT_CHARS,
+    DEFAULT_MAX_RSS_MB,
+    DEFAULT_MAX_RUNS,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PROFILE_TOP,
+    SandboxCancelled,
+    SandboxError,
+    SandboxTimeout,
+    code_hash,
+    get_pool,
+    write_ipc,
+)
+from node_editor.scheduler import (
+    DEFAULT_MAX_CONCURRENT,
+    DEFAULT_QUEUE_TIMEOUT,
+    QueueTimeout,
+    Scheduler,
+)
+from node_editor.utils.artifacts import local_path, read_parquet_table, save_parquet_document
+from node_editor.utils.preview import parquet_response
 
 DEFAULT_TIMEOUT = 60
-RUNNER_SCRIPT = """
-import sys
+DEFAULT_SHM_DIR = '/dev/shm'
+INPUT_MODES = {'dataframe', 'batches'}
+MAX_PROFILE_TOP = 100
 
-input_path = sys.argv[1]
-output_path = sys.argv[2]
-code_path = sys.argv[3]
 
-import pandas as pd
+def _sandbox_pool():
+    """Warm worker pool configured from settings."""
+    return get_pool(
+        size=getattr(settings, 'PYTHON_NODE_POOL_SIZE', DEFAULT_POOL_SIZE),
+        max_runs=getattr(settings, 'PYTHON_NODE_WORKER_MAX_RUNS', DEFAULT_MAX_RUNS),
+        max_rss_mb=getattr(settings, 'PYTHON_NODE_WORKER_MAX_RSS_MB', DEFAULT_MAX_RSS_MB),
+    )
 
-with open(code_path, 'r', encoding='utf-8') as f:
-    code = f.read()
 
-input_df = pd.read_parquet(input_path)
+def _scheduler():
+    """Host-wide admission control configured from settings."""
+    return Scheduler(
+        state_path=getattr(settings, 'PYTHON_NODE_SCHEDULER_STATE', None),
+        max_concurrent=getattr(settings, 'PYTHON_NODE_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT),
+        queue_timeout=getattr(settings, 'PYTHON_NODE_QUEUE_TIMEOUT_SECONDS', DEFAULT_QUEUE_TIMEOUT),
+    )
 
-globs = {
-    'input_df': input_df,
-    'pd': pd,
-    'pandas': pd,
-}
-exec(code, globs)
 
-output_df = globs.get('output_df')
-if output_df is None:
-    raise NameError("output_df must be defined by your code")
-if not isinstance(output_df, pd.DataFrame):
-    raise TypeError("output_df must be a pandas DataFrame")
-output_df.to_parquet(output_path, index=False, engine='pyarrow')
-"""
+def _output_listener(form_data):
+    """Store output chunks as run events while the code runs, when this is a NodeRun."""
+    run_id = form_data.get('run_id')
+    if not run_id:
+        return None
+    from node_editor.runs import RunEventWriter
+
+    return RunEventWriter(run_id, form_data.get('node_item_id'))
+
+
+def _cancel_poll(form_data):
+    """should_cancel for the sandbox: kills the worker once the NodeRun is cancelled."""
+    run_id = form_data.get('run_id')
+    return CancelCheck(run_id).cancelled if run_id else None
+
+
+def _run_options(form_data):
+    """
+    formData input_mode: 'dataframe' (default, whole input as input_df) or 'batches'
+    (input_batches iterator of DataFrame chunks of batch_size rows), and profile /
+    profile_top to run the code under cProfile.
+    Returns (job fields, error_response).
+    """
+    input_mode = form_data.get('input_mode') or 'dataframe'
+    if input_mode not in INPUT_MODES:
+        return None, _error_response(f'Invalid input_mode "{input_mode}". Choose dataframe or batches.')
+    options = {'input_mode': input_mode}
+    if form_data.get('profile'):
+        options['profile'] = True
+        try:
+            options['profile_top'] = min(int(form_data.get('profile_top') or DEFAULT_PROFILE_TOP), MAX_PROFILE_TOP)
+        except (TypeError, ValueError):
+            return None, _error_response('profile_top must be a number of functions.')
+    if form_data.get('batch_size') is not None:
+        try:
+            batch_size = int(form_data['batch_size'])
+        except (TypeError, ValueError):
+            batch_size = 0
+        if batch_size <= 0:
+            return None, _error_response('batch_size must be a positive number of rows.')
+        options['batch_size'] = batch_size
+    return options, None
 
 
-def _error_response(error_msg, stdout='', stderr='', execution_time_ms=0):
+def _profile_data(result, code, **extra_phases):
+    """
+    response_data['profile']: per-phase timings and the top functions by cumulative
+    time, with the hash of the code they were measured on.
+    """
+    return {
+        'code_hash': code_hash(code),
+        'phases_ms': {**result['phases'], **extra_phases},
+        'functions': result.get('profile') or [],
+    }
+
+
+def _resource_limits():
+    """Per-run RLIMIT_AS / RLIMIT_CPU for the sandbox worker (0 disables a limit)."""
+    return {
+        'memory_mb': getattr(settings, 'PYTHON_NODE_MEMORY_LIMIT_MB', 0),
+        'cpu_seconds': getattr(settings, 'PYTHON_NODE_CPU_LIMIT_SECONDS', 0),
+    }
+
+
+def _error_response(error_msg, stdout='', stderr='', execution_time_ms=0, queue_wait_ms=0):
     """Build error response_data dict (no raise)."""
     execution_log = stdout
     if stderr:
@@ -59,19 +147,31 @@ def _error_response(error_msg, stdout='', stderr='', execution_time_ms=0):
         'error': error_msg,
         'execution_log': execution_log or error_msg,
         'execution_time_ms': execution_time_ms,
+        'queue_wait_ms': queue_wait_ms,
         'status': 'error',
     }
 
 
-def _load_input_dataframe(form_data):
+def _shm_dir():
+    """Directory for handoff files: RAM-backed /dev/shm when usable, else the default temp dir."""
+    shm = getattr(settings, 'PYTHON_NODE_SHM_DIR', DEFAULT_SHM_DIR)
+    if shm and os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
+
+
+def _resolve_input(form_data, tmp):
     """
-    Resolve input DataFrame from parent's parquet (like select_columns/save_file),
+    Resolve the input from parent's parquet (like select_columns/save_file),
     then input_data.parquet_file_id, then html_table fallback.
-    Returns (df, error_response) - if error_response is not None, df is None.
+    A parquet on local disk is passed to the worker as is; anything else is
+    written to tmp as an Arrow IPC file.
+    Returns (job input fields, error_response) - if error_response is not None, the fields are None.
     """
     input_data = form_data.get('input_data') or {}
     node_item_id = form_data.get('node_item_id')
     node_item = NodeItem.objects.get(id=node_item_id)
+    ipc_path = str(tmp / 'input.arrow')
 
     # Prefer parent's parquet first (same as select_columns, save_file)
     parquet_file_id = None
@@ -84,19 +184,23 @@ def _load_input_dataframe(form_data):
     if parquet_file_id is not None:
         try:
             parquet_doc = Document.objects.get(id=parquet_file_id)
-            with parquet_doc.file.open(mode='rb') as f:
-                return pd.read_parquet(f), None
         except Document.DoesNotExist:
             return None, _error_response(
                 f'Parquet document with id {parquet_file_id} does not exist.'
             )
+        path = local_path(parquet_doc)
+        if path:
+            return {'input_path': path, 'input_format': 'parquet'}, None
+        write_ipc(read_parquet_table(parquet_doc), ipc_path)
+        return {'input_path': ipc_path, 'input_format': 'ipc'}, None
 
     html_table = input_data.get('html_table', '')
     if html_table:
         try:
             dfs = pd.read_html(io.StringIO(html_table))
             if dfs:
-                return dfs[0], None
+                write_ipc(pa.Table.from_pandas(dfs[0], preserve_index=False), ipc_path)
+                return {'input_path': ipc_path, 'input_format': 'ipc'}, None
         except Exception as e:
             return None, _error_response(f'Failed to parse html_table: {e}')
 
@@ -109,33 +213,13 @@ def _load_input_dataframe(form_data):
     )
 
 
-def _persist_parquet(node_item, output_df):
-    """Persist output_df to Wagtail Parquet collection (same pattern as read_csv)."""
-    parquet_buffer = io.BytesIO()
-    output_df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-    parquet_buffer.seek(0)
-
-    collection, _ = Collection.objects.get_or_create(name='Parquet')
-    parquet_filename = f'{node_item.html_id}.parquet'
-
-    existing_doc = Document.objects.filter(
-        title=node_item.html_id,
-        collection=collection
-    ).first()
-
-    parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
-
-    if existing_doc:
-        existing_doc.file.save(parquet_filename, parquet_file, save=True)
-        parquet_doc = existing_doc
-    else:
-        parquet_doc = Document.objects.create(
-            title=node_item.html_id,
-            file=parquet_file,
-            collection=collection
-        )
-
-    return parquet_doc
+def _ipc_to_parquet(ipc_path, parquet_path):
+    """Encode the worker's IPC output as parquet, one memory-mapped record batch at a time."""
+    with pa.memory_map(str(ipc_path)) as source:
+        reader = pa.ipc.open_file(source)
+        with pq.ParquetWriter(str(parquet_path), reader.schema) as writer:
+            for i in range(reader.num_record_batches):
+                writer.write_batch(reader.get_batch(i))
 
 
 def python_code(form_data):
@@ -161,10 +245,17 @@ def python_code(form_data):
     except NodeItem.DoesNotExist:
         return _error_response(f'NodeItem with id {node_item_id} does not exist.')
 
-    input_df, err = _load_input_dataframe(form_data)
+    run_options, err = _run_options(form_data)
     if err is not None:
         return err
 
+    # Measurements from the previous run of this node rank the warnings, if it was
+    # profiled with the same code (line numbers move when the code is edited)
+    advice = analyze_code(code)
+    previous_profile = (node_item.response_data or {}).get('profile') or {}
+    if previous_profile.get('code_hash') == code_hash(code):
+        advice = rank_by_profile(advice, previous_profile)
+
     timeout_seconds = getattr(
         settings, 'PYTHON_NODE_TIMEOUT_SECONDS', DEFAULT_TIMEOUT
     )
@@ -172,81 +263,126 @@ def python_code(form_data):
     start = time.perf_counter()
     stdout = ''
     stderr = ''
+    progress = progress_reporter(form_data)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory(dir=_shm_dir()) as tmpdir:
         tmp = Path(tmpdir)
-        input_path = tmp / 'input.parquet'
-        output_path = tmp / 'output.parquet'
-        code_path = tmp / 'code.py'
-        runner_path = tmp / 'runner.py'
+        output_path = tmp / 'output.arrow'
+
+        job_input, err = _resolve_input(form_data, tmp)
+        if err is not None:
+            return err
 
+        queue_wait_ms = 0
         try:
-            input_df.to_parquet(input_path, index=False, engine='pyarrow')
-            code_path.write_text(code, encoding='utf-8')
-            runner_path.write_text(RUNNER_SCRIPT, encoding='utf-8')
-
-            result = subprocess.run(
-                [sys.executable, str(runner_path), str(input_path), str(output_path), str(code_path)],
-                capture_output=True,
-                text=True,
-                timeout=timeout_seconds,
-                cwd=str(tmp),
+            progress.phase('queue')
+            with _scheduler().slot(
+                node_item.workflow.user_id, timeout_seconds, check_cancel=cancel_check(form_data.get('run_id')),
+            ) as queue_wait_ms:
+                # Execution time excludes the time spent waiting for a slot
+                start = time.perf_counter()
+                progress.phase('execute')
+                result = _sandbox_pool().run(
+                    {
+                        **job_input,
+                        'code': code,
+                        'output_path': str(output_path),
+                        'cwd': str(tmp),
+                        'limits': _resource_limits(),
+                        **run_options,
+                    },
+                    timeout=timeout_seconds,
+                    on_output=_output_listener(form_data),
+                    max_output_chars=getattr(settings, 'PYTHON_NODE_LOG_MAX_CHARS', DEFAULT_MAX_OUTPUT_CHARS),
+                    should_cancel=_cancel_poll(form_data),
+                )
+            stdout = result['stdout']
+            stderr = result['stderr']
+        except QueueTimeout:
+            return _error_response(
+                'No execution slot became free in time; the server is busy. Try again shortly.',
+                queue_wait_ms=int((time.perf_counter() - start) * 1000),
             )
-            stdout = result.stdout or ''
-            stderr = result.stderr or ''
-        except subprocess.TimeoutExpired as e:
+        except SandboxCancelled:
+            # Nothing is persisted; the temp dir with any partial output is removed on exit
+            raise RunCancelled()
+        except SandboxTimeout as e:
             elapsed_ms = int((time.perf_counter() - start) * 1000)
-            return _error_response(
+            response_data = _error_response(
                 f'Execution timed out after {timeout_seconds} seconds.',
-                stdout=getattr(e, 'stdout', '') or '',
-                stderr=getattr(e, 'stderr', '') or '',
+                stdout=e.stdout,
+                stderr=e.stderr,
+                execution_time_ms=elapsed_ms,
+                queue_wait_ms=queue_wait_ms,
+            )
+            # Row-at-a-time loops are the usual reason code runs out of time
+            response_data['advice'] = advice
+            return response_data
+        except SandboxError as e:
+            elapsed_ms = int((time.perf_counter() - start) * 1000)
+            return _error_response(
+                str(e),
+                stdout=e.stdout,
+                stderr=e.stderr,
                 execution_time_ms=elapsed_ms,
+                queue_wait_ms=queue_wait_ms,
             )
         except Exception as e:
             elapsed_ms = int((time.perf_counter() - start) * 1000)
-            return _error_response(str(e), execution_time_ms=elapsed_ms)
+            return _error_response(str(e), execution_time_ms=elapsed_ms, queue_wait_ms=queue_wait_ms)
 
         elapsed_ms = int((time.perf_counter() - start) * 1000)
 
-        if result.returncode != 0:
-            error_msg = stderr.strip().split('\n')[-1] if stderr else f'Process exited with code {result.returncode}'
-            return _error_response(
+        if not result['ok']:
+            error_msg = stderr.strip().split('\n')[-1] if stderr else 'Execution failed.'
+            response_data = _error_response(
                 error_msg,
                 stdout=stdout,
                 stderr=stderr,
                 execution_time_ms=elapsed_ms,
+                queue_wait_ms=queue_wait_ms,
             )
+            response_data['advice'] = advice
+            if run_options.get('profile'):
+                response_data['profile'] = _profile_data(result, code)
+            return response_data
 
-        # Read output BEFORE exiting the with block (temp dir is deleted on exit)
+        # Persist output BEFORE exiting the with block (temp dir is deleted on exit)
         try:
-            output_df = pd.read_parquet(output_path)
+            persist_start = time.perf_counter()
+            progress.phase('write')
+            parquet_path = tmp / 'output.parquet'
+            _ipc_to_parquet(output_path, parquet_path)
+            with open(parquet_path, 'rb') as f:
+                parquet_doc = save_parquet_document(node_item, File(f), form_data.get('run_id'))
+            response_data = parquet_response(parquet_doc)
+            if run_options.get('profile'):
+                response_data['profile'] = _profile_data(
+                    result, code, persist_ms=round((time.perf_counter() - persist_start) * 1000, 3)
+                )
+        except RunCancelled:
+            raise
         except Exception as e:
             return _error_response(
                 f'Failed to read output: {e}',
                 stdout=stdout,
                 stderr=stderr,
                 execution_time_ms=elapsed_ms,
+                queue_wait_ms=queue_wait_ms,
             )
 
-        parquet_doc = _persist_parquet(node_item, output_df)
-
         execution_log = stdout
         if stderr:
             execution_log = f"{stdout}\n[stderr]\n{stderr}".strip() if stdout else f"[stderr]\n{stderr}"
 
+        progress.done()
         return {
-            'html_table': output_df.head().to_html(index=False),
-            'stats': {
-                'rows': len(output_df),
-                'columns': len(output_df.columns),
-                'column_names': list(output_df.columns),
-            },
-            'parquet_file_id': parquet_doc.id,
-            'parquet_file_url': parquet_doc.file.url,
-            'parquet_file_title': parquet_doc.title,
+            **response_data,
             'stdout': stdout,
             'stderr': stderr,
             'execution_log': execution_log,
             'execution_time_ms': elapsed_ms,
+            'queue_wait_ms': queue_wait_ms,
+            'advice': advice,
             'status': 'success',
         }
@@ -1,9 +1,90 @@
 import pandas as pd
 import io
+import re
+import tempfile
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core.files import File
 from django.core.files.base import ContentFile
 from wagtail.documents.models import Document
-from wagtail.models import Collection
+from node_editor.cancellation import RunCancelled, cancel_check
 from node_editor.models import NodeItem
+from node_editor.progress import progress_reporter
+from node_editor.utils.artifacts import open_document, save_parquet_document
+from node_editor.utils.preview import parquet_response
+
+# Files at least this large are streamed unless formData sets "streaming" explicitly
+DEFAULT_STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+STREAMING_BLOCK_SIZE = 16 * 1024 * 1024
+
+_CONVERSION_ERROR = re.compile(r'In CSV column #(\d+)')
+
+
+class _ColumnTypeMismatch(Exception):
+    """A later block held values that don't fit the type inferred for a column."""
+
+    def __init__(self, column):
+        super().__init__(column)
+        self.column = column
+
+
+def _use_streaming(form_data, original_doc):
+    streaming = form_data.get("streaming")
+    if streaming is not None:
+        return bool(streaming)
+    threshold = getattr(
+        settings, 'READ_CSV_STREAMING_THRESHOLD_BYTES', DEFAULT_STREAMING_THRESHOLD_BYTES
+    )
+    return original_doc.get_file_size() >= threshold
+
+
+def _write_csv_batches(source, parquet_path, column_types, check_cancel, progress):
+    """
+    Read the CSV in record batches (multithreaded) and append each batch to a
+    ParquetWriter. check_cancel() runs between batches, and the bytes consumed
+    from source (its read position) and rows are reported to progress.
+    """
+    position = 0
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=STREAMING_BLOCK_SIZE, use_threads=True),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types),
+    )
+    try:
+        with pq.ParquetWriter(parquet_path, reader.schema) as writer:
+            for batch in reader:
+                check_cancel()
+                writer.write_batch(batch)
+                consumed = source.tell() - position
+                position += consumed
+                progress.advance(bytes_read=consumed, rows=batch.num_rows)
+    except pa.ArrowInvalid as e:
+        match = _CONVERSION_ERROR.search(str(e))
+        if not match:
+            raise
+        raise _ColumnTypeMismatch(reader.schema.names[int(match.group(1))]) from e
+    finally:
+        reader.close()
+
+
+def _stream_csv_to_parquet(original_doc, parquet_path, check_cancel, progress):
+    """
+    Stream the CSV into parquet_path. pyarrow infers column types from the first
+    block; when a later block doesn't fit, that column is re-read as string.
+    """
+    column_types = {}
+    total_bytes = original_doc.get_file_size()
+    while True:
+        progress.phase('parse', total_bytes=total_bytes, restart=True)
+        try:
+            with open_document(original_doc) as f:
+                return _write_csv_batches(f, parquet_path, column_types, check_cancel, progress)
+        except _ColumnTypeMismatch as e:
+            if e.column in column_types:
+                raise ValueError(f'Column {e.column!r} could not be read.')
+            column_types[e.column] = pa.string()
 
 
 def read_csv(form_data):
@@ -12,62 +93,47 @@ def read_csv(form_data):
         document_id = form_data.get("file_id")
         original_doc = Document.objects.get(id=document_id)
 
-        # 2. Load CSV content into DataFrame
-        with original_doc.file.open(mode='rb') as f:
-            df = pd.read_csv(f)
-
-        # 3. Convert DataFrame to in-memory Parquet
-        parquet_buffer = io.BytesIO()
-        df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-        parquet_buffer.seek(0)
-
-        # 4. Get or create "Parquet" collection
-        collection, _ = Collection.objects.get_or_create(name="Parquet")
-
-        # 5. Get NodeItem
+        # 2. Get NodeItem
         node_item_id = form_data.get("node_item_id")
         node_item = NodeItem.objects.get(id=node_item_id)
-        parquet_filename = f"{node_item.html_id}.parquet"
+        check_cancel = cancel_check(form_data.get('run_id'))
+        progress = progress_reporter(form_data)
 
-        # 6. Check if a Document with this node already exists
-        existing_doc = Document.objects.filter(
-            title=node_item.html_id,
-            collection=collection
-        ).first()
+        if _use_streaming(form_data, original_doc):
+            # 3a. Stream CSV record batches straight into a Parquet file on disk
+            with tempfile.NamedTemporaryFile(suffix='.parquet') as tmp:
+                _stream_csv_to_parquet(original_doc, tmp.name, check_cancel, progress)
+                check_cancel()
+                progress.phase('write')
+                parquet_doc = save_parquet_document(node_item, File(tmp), form_data.get('run_id'))
+        else:
+            # 3b. Load CSV content into DataFrame
+            file_size = original_doc.get_file_size()
+            progress.phase('parse', total_bytes=file_size)
+            with open_document(original_doc) as f:
+                df = pd.read_csv(f)
+            progress.advance(bytes_read=file_size, rows=len(df))
 
-        # 7. Create a Django file from the Parquet buffer
-        parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
+            # 4. Convert DataFrame to in-memory Parquet
+            progress.phase('convert')
+            parquet_buffer = io.BytesIO()
+            df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
+            check_cancel()
+            progress.phase('write')
+            parquet_doc = save_parquet_document(node_item, ContentFile(parquet_buffer.getvalue()), form_data.get('run_id'))
 
-        if existing_doc:
-            # Update existing document (replace file)
-            existing_doc.file.save(parquet_filename, parquet_file, save=True)
-            parquet_doc = existing_doc
-        else:
-            # Create new document
-            parquet_doc = Document.objects.create(
-                title=node_item.html_id,
-                file=parquet_file,
-                collection=collection
-            )
-
-        # 8. Return DataFrame preview and document info
-        return {
-            'html_table': df.head().to_html(index=False),
-            'stats': {
-                'rows': len(df),
-                'columns': len(df.columns),
-                'column_names': list(df.columns)
-            },
-            'parquet_file_id': parquet_doc.id,
-            'parquet_file_url': parquet_doc.file.url,
-            'parquet_file_title': parquet_doc.title
-        }
+        # 5. Return preview and stats (from the parquet footer) and document info
+        response_data = parquet_response(parquet_doc)
+        progress.done()
+        return response_data
 
+    except RunCancelled:
+        raise
     except Document.DoesNotExist:
         raise ValueError(f"Document with id {document_id} does not exist.")
     except NodeItem.DoesNotExist:
         raise ValueError(f"NodeItem with id {node_item_id} does not exist.")
-    except pd.errors.ParserError:
+    except (pd.errors.ParserError, pa.ArrowInvalid):
         raise ValueError("The file is not a valid CSV.")
     except Exception as e:
         raise RuntimeError(f"An error occurred: {e}")
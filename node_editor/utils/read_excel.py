@@ -1,9 +1,326 @@
+import datetime
+import itertools
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import pandas as pd
 import io
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.files import File
 from django.core.files.base import ContentFile
+from django.db import connection
 from wagtail.documents.models import Document
-from wagtail.models import Collection
+from node_editor.cancellation import RunCancelled, cancel_check
 from node_editor.models import NodeItem
+from node_editor.progress import progress_reporter
+from node_editor.utils.artifacts import local_path, open_document, save_parquet_document
+from node_editor.utils.preview import parquet_response
+
+# Rows used to infer each column's type before batches are built
+SAMPLE_ROWS = 1000
+BATCH_ROWS = 50_000
+MAX_PARALLEL_SHEETS = 4
+# Added when several sheets are combined into one table
+SHEET_COLUMN = 'sheet_name'
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _selected_sheets(form_data):
+    sheets = form_data.get('sheets') or form_data.get('sheet') or []
+    if isinstance(sheets, str):
+        sheets = [sheets]
+    return list(sheets)
+
+
+@contextmanager
+def _open_workbook(original_doc):
+    """Open the workbook read-only; each caller (thread) gets its own file handle."""
+    path = local_path(original_doc)
+    handle = None if path else original_doc.file.storage.open(original_doc.file.name, 'rb')
+    workbook = openpyxl.load_workbook(path or handle, read_only=True, data_only=True)
+    try:
+        yield workbook
+    finally:
+        workbook.close()
+        if handle is not None:
+            handle.close()
+
+
+def _column_names(header):
+    """Header row to unique column names, the way pandas names them."""
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f'Unnamed: {i}' if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _infer_type(values):
+    """Arrow type for a column from a sample of its cell values."""
+    present = [v for v in values if v is not None]
+    if not present:
+        return pa.string()
+    if all(isinstance(v, bool) for v in present):
+        return pa.bool_()
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        return pa.int64()
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return pa.float64()
+    if all(isinstance(v, datetime.datetime) for v in present):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+class _SchemaMismatch(Exception):
+    """
+    Cells after the sample don't fit the sheet's schema: column_types holds the
+    widened type of every such column and width the widest row, for the next pass.
+    """
+
+    def __init__(self, column_types, width):
+        super().__init__(', '.join(column_types))
+        self.column_types = column_types
+        self.width = width
+
+
+def _fits(value, arrow_type):
+    """Whether a cell converts to arrow_type without losing anything."""
+    if value is None or pa.types.is_string(arrow_type):
+        return True
+    if pa.types.is_boolean(arrow_type):
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if pa.types.is_integer(arrow_type):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return isinstance(value, int) and INT64_MIN <= value <= INT64_MAX
+    if pa.types.is_floating(arrow_type):
+        return isinstance(value, (int, float))
+    if pa.types.is_timestamp(arrow_type):
+        return isinstance(value, datetime.datetime)
+    return False
+
+
+def _widen(arrow_type, value):
+    """The next type up (int64 -> float64 -> string) that holds value."""
+    if pa.types.is_integer(arrow_type) and isinstance(value, float):
+        return pa.float64()
+    return pa.string()
+
+
+def _convert(value, arrow_type):
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return str(value)
+    if pa.types.is_integer(arrow_type):
+        return int(value)
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    return value
+
+
+def _widened_types(rows, schema, widened):
+    """
+    Add to widened the wider type of every column with a cell in rows that doesn't
+    fit its type (the one already in widened, else the schema's).
+    """
+    for i, field in enumerate(schema):
+        arrow_type = widened.get(field.name, field.type)
+        for row in rows:
+            if pa.types.is_string(arrow_type):
+                break
+            if not _fits(row[i], arrow_type):
+                arrow_type = widened[field.name] = _widen(arrow_type, row[i])
+
+
+def _build_batch(rows, schema):
+    """Record batch from row tuples whose cells all fit the schema."""
+    arrays = [
+        pa.array([_convert(row[i], field.type) for row in rows], type=field.type)
+        for i, field in enumerate(schema)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _trimmed(row):
+    """row without its trailing empty cells."""
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return row[:end]
+
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_sheet(original_doc, sheet_name, parquet_path, column_types, width, check_cancel, progress):
+    """
+    One pass over a sheet: types come from the first SAMPLE_ROWS rows unless
+    column_types overrides them, and the width from the header and the widest
+    sampled row unless width does; cells right of the header are named as pandas
+    names them ("Unnamed: N"). When later cells don't fit, the rest of the sheet
+    is only checked and _SchemaMismatch raised with everything the next pass
+    needs. Returns (schema, rows written).
+    """
+    with _open_workbook(original_doc) as workbook:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = tuple(next(rows, None) or ())
+        data = (_trimmed(row) for row in rows if any(v is not None for v in row))
+        sample = list(itertools.islice(data, SAMPLE_ROWS))
+        if width is None:
+            width = max([len(header)] + [len(row) for row in sample])
+        names = _column_names(header[:width] + (None,) * (width - len(header)))
+        widest = width
+
+        def fitted(row_iter):
+            nonlocal widest
+            for row in row_iter:
+                widest = max(widest, len(row))
+                row = row[:width]
+                yield row + (None,) * (width - len(row))
+
+        sample = list(fitted(sample))
+        schema = pa.schema([
+            (name, column_types.get(name) or _infer_type([row[i] for row in sample]))
+            for i, name in enumerate(names)
+        ])
+
+        widened = {}
+        total_rows = 0
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            for rows in _chunks(itertools.chain(sample, fitted(data)), BATCH_ROWS):
+                check_cancel()
+                _widened_types(rows, schema, widened)
+                if widened:
+                    # Keep checking the rest, so one more pass reads the sheet
+                    continue
+                batch = _build_batch(rows, schema)
+                writer.write_batch(batch)
+                progress.advance(rows=batch.num_rows)
+                total_rows += batch.num_rows
+            if total_rows == 0 and not widened:
+                writer.write_batch(_build_batch([], schema))
+    if widened or widest > width:
+        # The sheet is read again; don't count these rows twice
+        progress.advance(rows=-total_rows)
+        raise _SchemaMismatch({**column_types, **widened}, widest)
+    return schema, total_rows
+
+
+def _sheet_to_parquet(original_doc, sheet_name, parquet_path, check_cancel, progress):
+    """
+    Stream one sheet into parquet_path with openpyxl read-only row iteration.
+    Column types are inferred from the first SAMPLE_ROWS rows; when later cells
+    don't fit, their columns are widened (int64 -> float64 -> string), rows
+    wider than the sample add columns, and the sheet is read again, as read_csv
+    does. check_cancel() runs between batches and written rows are reported to
+    progress.
+    """
+    column_types, width = {}, None
+    while True:
+        try:
+            schema, total_rows = _write_sheet(
+                original_doc, sheet_name, parquet_path, column_types, width, check_cancel, progress,
+            )
+        except _SchemaMismatch as e:
+            column_types, width = e.column_types, e.width
+            continue
+        return {'sheet': sheet_name, 'path': parquet_path, 'schema': schema, 'rows': total_rows}
+
+
+def _combined_schema(results):
+    """One schema for several sheets; conflicting column types widen to float64 or string."""
+    types = {}
+    for result in results:
+        for field in result['schema']:
+            types.setdefault(field.name, set()).add(field.type)
+    fields = [pa.field(SHEET_COLUMN, pa.string())]
+    for name, candidates in types.items():
+        if len(candidates) == 1:
+            arrow_type = candidates.pop()
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in candidates):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def _combine_sheets(results, parquet_path):
+    """Append each sheet's parquet batches to one file under a shared schema."""
+    schema = _combined_schema(results)
+    with pq.ParquetWriter(parquet_path, schema) as writer:
+        for result in results:
+            for batch in pq.ParquetFile(result['path']).iter_batches(batch_size=BATCH_ROWS):
+                arrays = []
+                for field in schema:
+                    if field.name == SHEET_COLUMN:
+                        arrays.append(pa.array([result['sheet']] * batch.num_rows, type=pa.string()))
+                    elif field.name in batch.schema.names:
+                        arrays.append(batch.column(field.name).cast(field.type))
+                    else:
+                        arrays.append(pa.nulls(batch.num_rows, type=field.type))
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+def _total_rows(workbook, sheets):
+    """Data rows in the sheets according to their stored dimensions, or None if unknown."""
+    total = 0
+    for sheet in sheets:
+        max_row = workbook[sheet].max_row
+        if not max_row:
+            return None
+        total += max_row - 1
+    return total
+
+
+def _stream_excel_to_parquet(original_doc, sheets, parquet_path, check_cancel, progress):
+    """
+    Parse the selected sheets in parallel and write them to parquet_path.
+    """
+    with _open_workbook(original_doc) as workbook:
+        available = workbook.sheetnames
+        sheets = sheets or available[:1]
+        missing = [s for s in sheets if s not in available]
+        if missing:
+            raise ValueError(f'Sheets not found in workbook: {missing}. Available: {available}')
+        progress.phase('parse', total_rows=_total_rows(workbook, sheets))
+
+    if len(sheets) == 1:
+        _sheet_to_parquet(original_doc, sheets[0], parquet_path, check_cancel, progress)
+        return
+
+    def convert(args):
+        try:
+            return _sheet_to_parquet(original_doc, *args, check_cancel, progress)
+        finally:
+            # Cancel checks give this thread its own DB connection; don't leak it
+            connection.close()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sheet_paths = [os.path.join(tmpdir, f'sheet_{i}.parquet') for i in range(len(sheets))]
+        with ThreadPoolExecutor(max_workers=min(len(sheets), MAX_PARALLEL_SHEETS)) as pool:
+            results = list(pool.map(convert, zip(sheets, sheet_paths)))
+        check_cancel()
+        progress.phase('convert')
+        _combine_sheets(results, parquet_path)
 
 
 def read_excel(form_data):
@@ -12,58 +329,46 @@ def read_excel(form_data):
         document_id = form_data.get("file_id")
         original_doc = Document.objects.get(id=document_id)
 
-        # 2. Load CSV content into DataFrame
-        with original_doc.file.open(mode='rb') as f:
-            df = pd.read_excel(f)
-            df = df.astype(str)
-
-        # 3. Convert DataFrame to in-memory Parquet
-        parquet_buffer = io.BytesIO()
-        df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-        parquet_buffer.seek(0)
-
-        # 4. Get or create "Parquet" collection
-        collection, _ = Collection.objects.get_or_create(name="Parquet")
-
-        # 5. Get NodeItem
+        # 2. Get NodeItem
         node_item_id = form_data.get("node_item_id")
         node_item = NodeItem.objects.get(id=node_item_id)
-        parquet_filename = f"{node_item.html_id}.parquet"
 
-        # 6. Check if a Document with this node already exists
-        existing_doc = Document.objects.filter(
-            title=node_item.html_id,
-            collection=collection
-        ).first()
+        sheets = _selected_sheets(form_data)
+        check_cancel = cancel_check(form_data.get('run_id'))
+        progress = progress_reporter(form_data)
 
-        # 7. Create a Django file from the Parquet buffer
-        parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
-
-        if existing_doc:
-            # Update existing document (replace file)
-            existing_doc.file.save(parquet_filename, parquet_file, save=True)
-            parquet_doc = existing_doc
+        if form_data.get("streaming", True):
+            # 3a. Stream typed record batches from the workbook into Parquet on disk
+            with tempfile.TemporaryDirectory() as tmpdir:
+                parquet_path = os.path.join(tmpdir, 'output.parquet')
+                _stream_excel_to_parquet(original_doc, sheets, parquet_path, check_cancel, progress)
+                check_cancel()
+                progress.phase('write')
+                with open(parquet_path, 'rb') as f:
+                    parquet_doc = save_parquet_document(node_item, File(f), form_data.get('run_id'))
         else:
-            # Create new document
-            parquet_doc = Document.objects.create(
-                title=node_item.html_id,
-                file=parquet_file,
-                collection=collection
-            )
+            # 3b. Load the sheet into a DataFrame (all values as text)
+            progress.phase('parse')
+            with open_document(original_doc) as f:
+                df = pd.read_excel(f, sheet_name=sheets[0] if sheets else 0)
+                df = df.astype(str)
+            progress.advance(rows=len(df))
+
+            # 4. Convert DataFrame to in-memory Parquet
+            progress.phase('convert')
+            parquet_buffer = io.BytesIO()
+            df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
+            check_cancel()
+            progress.phase('write')
+            parquet_doc = save_parquet_document(node_item, ContentFile(parquet_buffer.getvalue()), form_data.get('run_id'))
 
-        # 8. Return DataFrame preview and document info
-        return {
-            'html_table': df.head().to_html(index=False),
-            'stats': {
-                'rows': len(df),
-                'columns': len(df.columns),
-                'column_names': list(df.columns)
-            },
-            'parquet_file_id': parquet_doc.id,
-            'parquet_file_url': parquet_doc.file.url,
-            'parquet_file_title': parquet_doc.title
-        }
+        # 5. Return preview and stats (from the parquet footer) and document info
+        response_data = parquet_response(parquet_doc)
+        progress.done()
+        return response_data
 
+    except RunCancelled:
+        raise
     except Document.DoesNotExist:
         raise ValueError(f"Document with id {document_id} does not exist.")
     except NodeItem.DoesNotExist:
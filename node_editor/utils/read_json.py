@@ -1,72 +1,157 @@
 import pandas as pd
 import json
 import io
+import tempfile
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+from django.core.files import File
 from django.core.files.base import ContentFile
 from wagtail.documents.models import Document
-from wagtail.models import Collection
+from node_editor.cancellation import RunCancelled, cancel_check
 from node_editor.models import NodeItem
+from node_editor.progress import progress_reporter
+from node_editor.utils.artifacts import open_document, save_parquet_document
+from node_editor.utils.preview import parquet_response
 
+VALID_JSON_FORMATS = {'json', 'ndjson'}
+# Read size while sniffing the first two lines for NDJSON
+SNIFF_CHUNK_SIZE = 8 * 1024 * 1024
+PARSE_BLOCK_SIZE = 16 * 1024 * 1024
 
-def read_json(form_data):
+
+def _is_json_object(line):
+    """Whether a line is one complete JSON object."""
+    if not line.startswith(b'{'):
+        return False
     try:
-        # 1. Get the original Wagtail document
-        document_id = form_data.get("file_id")
-        original_doc = Document.objects.get(id=document_id)
+        json.loads(line)
+    except ValueError:
+        return False
+    return True
+
+
+def _lines(f, head):
+    """
+    Non-empty lines (stripped) of a binary file whose first head bytes were already
+    read; read on in SNIFF_CHUNK_SIZE chunks, so a line longer than a chunk still
+    comes out whole.
+    """
+    pending = []
+    chunk = head
+    while chunk:
+        *ends, rest = chunk.split(b'\n')
+        for end in ends:
+            line = b''.join(pending + [end]).strip()
+            pending = []
+            if line:
+                yield line
+        pending.append(rest)
+        chunk = f.read(SNIFF_CHUNK_SIZE)
+    line = b''.join(pending).strip()
+    if line:
+        yield line
+
+
+def _detect_json_format(original_doc):
+    """
+    'ndjson' when the first two non-empty lines are each a complete JSON object,
+    'json' otherwise (a top-level array, a pretty-printed or minified document).
+    Only as much is read as it takes to decide.
+    """
+    with open_document(original_doc) as f:
+        head = f.read(SNIFF_CHUNK_SIZE)
+        if not head.lstrip().startswith(b'{'):
+            return 'json'
+        objects = 0
+        for line in _lines(f, head):
+            if not _is_json_object(line):
+                return 'json'
+            objects += 1
+            if objects == 2:
+                return 'ndjson'
+    return 'json'
+
 
-        # 2. Load JSON content
-        with original_doc.file.open(mode='r') as f:
-            json_data = json.load(f)
+def _flatten_structs(table):
+    """Flatten nested struct columns into 'parent.child' columns."""
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+    return table
 
-        # 3. Convert to DataFrame
-        df = pd.DataFrame(json_data)
 
-        # 4. Convert DataFrame to in-memory Parquet
-        parquet_buffer = io.BytesIO()
-        df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-        parquet_buffer.seek(0)
+def _read_ndjson_table(original_doc):
+    """Parse newline-delimited JSON with pyarrow's block-parallel reader."""
+    read_options = pa_json.ReadOptions(use_threads=True, block_size=PARSE_BLOCK_SIZE)
+    with open_document(original_doc) as f:
+        table = pa_json.read_json(f, read_options=read_options)
+    return _flatten_structs(table)
 
-        # 5. Get or create "Parquet" collection
-        collection, _ = Collection.objects.get_or_create(name="Parquet")
 
-        # 6. Get NodeItem
+def _read_json_dataframe(original_doc, json_format):
+    """Fallback: whole-document json.load (or pandas lines reader for NDJSON)."""
+    with open_document(original_doc) as source, io.TextIOWrapper(source, encoding='utf-8') as f:
+        if json_format == 'ndjson':
+            return pd.read_json(f, lines=True)
+        json_data = json.load(f)
+    return pd.DataFrame(json_data)
+
+
+def read_json(form_data):
+    try:
+        # 1. Get the original Wagtail document
+        document_id = form_data.get("file_id")
+        original_doc = Document.objects.get(id=document_id)
+
+        # 2. Get NodeItem
         node_item_id = form_data.get("node_item_id")
         node_item = NodeItem.objects.get(id=node_item_id)
-        parquet_filename = f"{node_item.html_id}.parquet"
+        check_cancel = cancel_check(form_data.get('run_id'))
+        progress = progress_reporter(form_data)
+        file_size = original_doc.get_file_size()
 
-        # 7. Check if a Document with this node already exists
-        existing_doc = Document.objects.filter(
-            title=node_item.html_id,
-            collection=collection
-        ).first()
+        # 3. Work out whether this is NDJSON or a single JSON document
+        json_format = (form_data.get("json_format") or '').lower().strip()
+        if json_format not in VALID_JSON_FORMATS:
+            json_format = _detect_json_format(original_doc)
 
-        # 8. Create a Django file from the Parquet buffer
-        parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
+        progress.phase('parse', total_bytes=file_size)
+        table = None
+        if json_format == 'ndjson':
+            try:
+                table = _read_ndjson_table(original_doc)
+            except pa.ArrowInvalid:
+                # e.g. a field that changes type between records
+                table = None
 
-        if existing_doc:
-            # Update existing document (replace file)
-            existing_doc.file.save(parquet_filename, parquet_file, save=True)
-            parquet_doc = existing_doc
+        if table is not None:
+            progress.advance(bytes_read=file_size, rows=table.num_rows)
+            # 4a. Write the Arrow table straight to a Parquet file on disk
+            with tempfile.NamedTemporaryFile(suffix='.parquet') as tmp:
+                check_cancel()
+                progress.phase('convert')
+                pq.write_table(table, tmp.name)
+                check_cancel()
+                progress.phase('write')
+                parquet_doc = save_parquet_document(node_item, File(tmp), form_data.get('run_id'))
         else:
-            # Create new document
-            parquet_doc = Document.objects.create(
-                title=node_item.html_id,
-                file=parquet_file,
-                collection=collection
-            )
-
-        # 9. Return DataFrame preview and document info
-        return {
-            'html_table': df.head().to_html(index=False),
-            'stats': {
-                'rows': len(df),
-                'columns': len(df.columns),
-                'column_names': list(df.columns)
-            },
-            'parquet_file_id': parquet_doc.id,
-            'parquet_file_url': parquet_doc.file.url,
-            'parquet_file_title': parquet_doc.title
-        }
+            # 4b. Load JSON content and convert to DataFrame
+            df = _read_json_dataframe(original_doc, json_format)
+            progress.advance(bytes_read=file_size, rows=len(df))
+            progress.phase('convert')
+            parquet_buffer = io.BytesIO()
+            df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
+            check_cancel()
+            progress.phase('write')
+            parquet_doc = save_parquet_document(node_item, ContentFile(parquet_buffer.getvalue()), form_data.get('run_id'))
+
+        # 5. Return preview and stats (from the parquet footer) and document info
+        response_data = parquet_response(parquet_doc)
+        progress.done()
+        return response_data
 
+    except RunCancelled:
+        raise
     except Document.DoesNotExist:
         raise ValueError(f"Document with id {document_id} does not exist.")
     except NodeItem.DoesNotExist:
@@ -1,86 +1,32 @@
-import pandas as pd
-import io
-from django.core.files.base import ContentFile
+import tempfile
+import pyarrow.parquet as pq
+from django.core.files import File
 from wagtail.documents.models import Document
-from wagtail.models import Collection
+from node_editor.cancellation import RunCancelled
 from node_editor.models import NodeItem
+from node_editor.progress import progress_reporter
+from node_editor.utils.artifacts import (
+    init_from_parent,
+    parquet_metadata,
+    read_parquet_table,
+    save_parquet_document,
+)
+from node_editor.utils.preview import parquet_response
 
 
 def init_select_columns_from_parent(node_item):
     """
-    On connection created: copy parent's parquet to this node and set response_data
-    with column names and HTML table preview. Called when target is a select_columns node.
+    On connection created: reference parent's parquet and set response_data with
+    column names and HTML table preview. Called when target is a select_columns node.
     """
-    if not node_item.parent:
-        return {
-            'html_table': '',
-            'stats': {'rows': 0, 'columns': 0, 'column_names': []},
-            'message': 'No parent connected.',
-        }
-
-    parent_response = node_item.parent.response_data or {}
-    parquet_file_id = parent_response.get('parquet_file_id')
-
-    if parquet_file_id is None:
-        return {
-            'html_table': '',
-            'stats': {'rows': 0, 'columns': 0, 'column_names': []},
-            'message': 'Run the parent node first.',
-        }
-
-    try:
-        parquet_doc = Document.objects.get(id=parquet_file_id)
-    except Document.DoesNotExist:
-        return {
-            'html_table': '',
-            'stats': {'rows': 0, 'columns': 0, 'column_names': []},
-            'message': 'Parent parquet document not found.',
-        }
-
-    with parquet_doc.file.open(mode='rb') as f:
-        df = pd.read_parquet(f)
-
-    parquet_buffer = io.BytesIO()
-    df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-    parquet_buffer.seek(0)
-
-    collection, _ = Collection.objects.get_or_create(name='Parquet')
-    parquet_filename = f'{node_item.html_id}.parquet'
-
-    existing_doc = Document.objects.filter(
-        title=node_item.html_id,
-        collection=collection
-    ).first()
-
-    parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
-
-    if existing_doc:
-        existing_doc.file.save(parquet_filename, parquet_file, save=True)
-        parquet_doc = existing_doc
-    else:
-        parquet_doc = Document.objects.create(
-            title=node_item.html_id,
-            file=parquet_file,
-            collection=collection
-        )
-
-    return {
-        'html_table': df.head().to_html(index=False),
-        'stats': {
-            'rows': len(df),
-            'columns': len(df.columns),
-            'column_names': list(df.columns)
-        },
-        'parquet_file_id': parquet_doc.id,
-        'parquet_file_url': parquet_doc.file.url,
-        'parquet_file_title': parquet_doc.title
-    }
+    return init_from_parent(node_item)
 
 
 def select_columns(form_data):
     """
     Always read from the parent's parquet file, select columns, and write the
     result to this node's own parquet (updating this node's Document).
+    Only the selected columns are decoded from the parent's parquet.
     """
     try:
         node_item_id = form_data.get('node_item_id')
@@ -99,55 +45,33 @@ def select_columns(form_data):
             )
 
         parquet_doc = Document.objects.get(id=parquet_file_id)
-        with parquet_doc.file.open(mode='rb') as f:
-            df = pd.read_parquet(f)
 
         selected_columns = form_data.get('selected_columns') or form_data.get('columns') or []
         if not selected_columns:
             raise ValueError('No columns selected. Please select at least one column.')
 
-        missing = [c for c in selected_columns if c not in df.columns]
+        # Validate against the parquet schema (footer only) before loading any data
+        _, schema = parquet_metadata(parquet_doc)
+        missing = [c for c in selected_columns if c not in schema.names]
         if missing:
             raise ValueError(f'Columns not found in data: {missing}')
 
-        df_selected = df[selected_columns].copy()
-
-        parquet_buffer = io.BytesIO()
-        df_selected.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-        parquet_buffer.seek(0)
+        progress = progress_reporter(form_data)
+        progress.phase('parse')
+        table = read_parquet_table(parquet_doc, columns=selected_columns)
+        progress.advance(rows=table.num_rows)
 
-        collection, _ = Collection.objects.get_or_create(name='Parquet')
-        parquet_filename = f'{node_item.html_id}.parquet'
-
-        existing_doc = Document.objects.filter(
-            title=node_item.html_id,
-            collection=collection
-        ).first()
-
-        parquet_file = ContentFile(parquet_buffer.read(), name=parquet_filename)
-
-        if existing_doc:
-            existing_doc.file.save(parquet_filename, parquet_file, save=True)
-            parquet_doc = existing_doc
-        else:
-            parquet_doc = Document.objects.create(
-                title=node_item.html_id,
-                file=parquet_file,
-                collection=collection
-            )
+        progress.phase('write')
+        with tempfile.NamedTemporaryFile(suffix='.parquet') as tmp:
+            pq.write_table(table, tmp.name)
+            parquet_doc = save_parquet_document(node_item, File(tmp), form_data.get('run_id'))
 
-        return {
-            'html_table': df_selected.head().to_html(index=False),
-            'stats': {
-                'rows': len(df_selected),
-                'columns': len(df_selected.columns),
-                'column_names': list(df_selected.columns)
-            },
-            'parquet_file_id': parquet_doc.id,
-            'parquet_file_url': parquet_doc.file.url,
-            'parquet_file_title': parquet_doc.title
-        }
+        response_data = parquet_response(parquet_doc)
+        progress.done()
+        return response_data
 
+    except RunCancelled:
+        raise
     except Document.DoesNotExist:
         raise ValueError(f'Parquet document with id {parquet_file_id} does not exist.')
     except NodeItem.DoesNotExist:
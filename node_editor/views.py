@@ -1,21 +1,33 @@
+import json
 import os
+import uuid
 from pathlib import Path
 from urllib import request as urllib_request
 
-from rest_framework import generics, status
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, renderers, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import NodeCategory, Node, Workflow, NodeItem, Connection
+from .models import NodeCategory, Node, Workflow, NodeItem, Connection, NodeRun
 from .serializers import (
     NodeCategorySerializer,
     NodeSerializer,
     WorkflowSerializer,
     NodeItemSerializer,
-    ConnectionSerializer
+    ConnectionSerializer,
+    NodeRunSerializer
 )
 
-from .dispatcher import get_reader_function
+from .executor import workflow_graph, WorkflowCycleError
+from .planner import build_plan, explain
+from .cancellation import RunCancelled, cancel_run
+from .runs import (
+    DEFAULT_EVENT_STREAM_MAX_SECONDS, run_node_inline, start_node_run, start_workflow_run, stream_run_events,
+)
+from .utils.artifacts import shared_cache, table_cache
 
 
 class NodeCategoryListCreate(generics.ListCreateAPIView):
@@ -59,6 +71,41 @@ class WorkflowBulkDelete(generics.GenericAPIView):
         return Workflow(ids, status=status.HTTP_200_OK)
 
 
+class WorkflowRun(APIView):
+    """Queue a server-side run of every node of a workflow in dependency order."""
+
+    def post(self, request, pk):
+        workflow = get_object_or_404(Workflow, pk=pk)
+        try:
+            workflow_graph(workflow)
+        except WorkflowCycleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        options = {
+            'lazy': bool(request.data.get('lazy', False)),
+            'preview': list(request.data.get('preview') or []),
+        }
+        run = start_workflow_run(workflow, options)
+        return Response(NodeRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+
+class WorkflowPlan(APIView):
+    """Explain how a lazy run of the workflow would fuse its nodes (?preview=id1,id2)."""
+
+    def get(self, request, pk):
+        workflow = get_object_or_404(Workflow, pk=pk)
+        try:
+            node_items, edges, order = workflow_graph(workflow)
+        except WorkflowCycleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        preview = [h for h in request.query_params.get('preview', '').split(',') if h]
+        plan = build_plan(node_items, edges, order, preview)
+        return Response({
+            'workflow_id': workflow.id,
+            'order': order,
+            'steps': explain(node_items, order, plan),
+        })
+
+
 class NodeItemListCreate(generics.ListCreateAPIView):
     queryset = NodeItem.objects.all()
     serializer_class = NodeItemSerializer
@@ -69,13 +116,50 @@ class NodeItemDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = NodeItemSerializer
 
 
-from .dispatcher import get_reader_function
+def _requested_run_id(request_data):
+    """
+    (run id, error response) for a request that may pick its NodeRun's id, so the
+    client can cancel the run before the response arrives.
+    """
+    run_id = request_data.get('run_id')
+    if run_id is None:
+        return uuid.uuid4(), None
+    try:
+        run_id = uuid.UUID(str(run_id))
+    except ValueError:
+        return None, Response({'error': 'Invalid run_id.'}, status=status.HTTP_400_BAD_REQUEST)
+    if NodeRun.objects.filter(pk=run_id).exists():
+        return None, Response({'error': 'run_id is already in use.'}, status=status.HTTP_400_BAD_REQUEST)
+    return run_id, None
 
 
 class NodeItemUpdateFormData(generics.RetrieveUpdateAPIView):
+    """
+    PATCH saves the node and queues a run of it (202 with the run, as NodeItemRun);
+    poll NodeRunDetail or stream its events for the result. PUT runs the node in
+    the request and answers with the updated node: the bundled editor replaces
+    its node with that response.
+    """
     queryset = NodeItem.objects.all()
     serializer_class = NodeItemSerializer
 
+    def patch(self, request, *args, **kwargs):
+        instance = self.get_object()
+        request_data = request.data.copy()
+        form_data = request_data.get('formData', {})
+        run_id, error = _requested_run_id(request_data)
+        if error is not None:
+            return error
+
+        # response_data is the run's to set
+        request_data.pop('response_data', None)
+        serializer = self.get_serializer(instance, data=request_data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+
+        run = start_node_run(instance, form_data, run_id)
+        return Response(NodeRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop("partial", False)
         instance = self.get_object()
@@ -83,13 +167,17 @@ class NodeItemUpdateFormData(generics.RetrieveUpdateAPIView):
 
         # Safely access the formData from request
         form_data = request_data.get('formData', {})
-        original_id = instance.original_id
 
-        # Get the appropriate reader function using the dispatcher
-        reader_function = get_reader_function(original_id)
+        # The client may pick the run id so it can cancel the run while this request is in flight
+        run_id, error = _requested_run_id(request_data)
+        if error is not None:
+            return error
 
-        # Execute the function if found, otherwise return empty dict
-        response_data = reader_function(form_data) if reader_function else {}
+        # Run the node's reader function (skipped when its inputs are unchanged)
+        try:
+            run, response_data, leader = run_node_inline(instance, form_data, run_id)
+        except RunCancelled as e:
+            return Response({'error': str(e), 'run_id': str(run_id)}, status=status.HTTP_409_CONFLICT)
 
         # Update the instance and save
         request_data["response_data"] = response_data
@@ -101,7 +189,93 @@ class NodeItemUpdateFormData(generics.RetrieveUpdateAPIView):
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
 
-        return Response(serializer.data)
+        data = {**serializer.data, 'run_id': str(run.pk)}
+        if leader is not None:
+            # An identical request was already running; this one got its result
+            data['coalesced_with'] = str(leader.pk)
+        return Response(data)
+
+
+class NodeItemRun(APIView):
+    """Save formData and queue a run of the node; poll NodeRunDetail for the result."""
+
+    def post(self, request, pk):
+        instance = get_object_or_404(NodeItem, pk=pk)
+        form_data = request.data.get('formData', {})
+        instance.formData = form_data
+        instance.save(update_fields=['formData'])
+
+        run = start_node_run(instance, form_data)
+        return Response(NodeRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+
+class NodeRunDetail(generics.RetrieveAPIView):
+    """GET a run's status and result; DELETE cancels it if it is still queued or running."""
+    queryset = NodeRun.objects.all()
+    serializer_class = NodeRunSerializer
+
+    def delete(self, request, pk):
+        run = self.get_object()
+        if not cancel_run(run):
+            return Response(
+                {'error': f'Run already {run.status}.', **NodeRunSerializer(run).data},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(NodeRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ArtifactCacheStats(APIView):
+    """
+    GET this process's Arrow column cache counters, plus the host-wide shared-memory
+    cache's under 'shared'; DELETE empties both (files still in use are kept).
+    """
+
+    def get(self, request):
+        return Response(self._stats())
+
+    def delete(self, request):
+        table_cache().clear()
+        cache = shared_cache()
+        if cache is not None:
+            cache.clear()
+        return Response(self._stats())
+
+    def _stats(self):
+        cache = shared_cache()
+        return {**table_cache().stats(), 'shared': cache.stats() if cache is not None else None}
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """Lets EventSource clients (Accept: text/event-stream) pass content negotiation."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode('utf-8')
+
+
+class NodeRunEvents(APIView):
+    """
+    Stream a run's output as server-sent events. The stream is a long poll that ends
+    after RUN_EVENT_STREAM_MAX_SECONDS; clients resume with Last-Event-ID or ?after=.
+    """
+    renderer_classes = [renderers.JSONRenderer, EventStreamRenderer]
+
+    def get(self, request, pk):
+        run = get_object_or_404(NodeRun, pk=pk)
+        after = request.query_params.get('after') or request.headers.get('Last-Event-ID') or 0
+        try:
+            after = int(after)
+        except ValueError:
+            return Response({'error': 'Invalid event id.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_seconds = getattr(settings, 'RUN_EVENT_STREAM_MAX_SECONDS', DEFAULT_EVENT_STREAM_MAX_SECONDS)
+        response = StreamingHttpResponse(
+            stream_run_events(run.pk, after, max_seconds),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
 
 class ConnectionListCreate(generics.ListCreateAPIView):
@@ -61,6 +61,8 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework_simplejwt",
     "corsheaders",
+    "django_tasks",
+    "django_tasks.backends.database",
 ]
 
 ############### New Settings ################
@@ -243,3 +245,58 @@ WAGTAILADMIN_BASE_URL = "http://example.com"
 WAGTAILDOCS_EXTENSIONS = ['csv', 'docx', 'key', 'odt', 'pdf', 'pptx', 'rtf', 'txt', 'xlsx', 'zip', 'apk', 'exe']
 
 WAGTAILIMAGES_EXTENSIONS = ["gif", "jpg", "jpeg", "png", "webp", "svg"]
+
+
+# Node editor
+
+# Node and workflow runs are queued here and executed by `python manage.py db_worker`
+TASKS = {
+    "default": {
+        "BACKEND": "django_tasks.backends.database.DatabaseBackend",
+    }
+}
+
+# Max threads used to run independent branches of a workflow concurrently
+WORKFLOW_RUN_MAX_WORKERS = int(os.getenv("WORKFLOW_RUN_MAX_WORKERS", 4))
+
+# CSV uploads at least this large are streamed into parquet in record batches
+READ_CSV_STREAMING_THRESHOLD_BYTES = int(os.getenv("READ_CSV_STREAMING_THRESHOLD_BYTES", 64 * 1024 * 1024))
+
+# python_code runs in warm, pre-forked sandbox workers (see node_editor/sandbox.py)
+PYTHON_NODE_POOL_SIZE = int(os.getenv("PYTHON_NODE_POOL_SIZE", 2))
+# Workers are replaced after this many runs or once their RSS exceeds this size;
+# imported modules persist between runs of a worker, 1 gives every run a fresh process
+PYTHON_NODE_WORKER_MAX_RUNS = int(os.getenv("PYTHON_NODE_WORKER_MAX_RUNS", 100))
+PYTHON_NODE_WORKER_MAX_RSS_MB = int(os.getenv("PYTHON_NODE_WORKER_MAX_RSS_MB", 1024))
+# Arrow IPC handoff files between python_code and its workers (falls back to the temp dir)
+PYTHON_NODE_SHM_DIR = os.getenv("PYTHON_NODE_SHM_DIR", "/dev/shm")
+
+# Host-wide cap on concurrent python_code executions; extra runs queue (FIFO per user)
+PYTHON_NODE_MAX_CONCURRENT = int(os.getenv("PYTHON_NODE_MAX_CONCURRENT", 4))
+PYTHON_NODE_QUEUE_TIMEOUT_SECONDS = int(os.getenv("PYTHON_NODE_QUEUE_TIMEOUT_SECONDS", 300))
+# Shared by every process that runs python_code; must be on a filesystem they all
+# see (docker-compose mounts one volume into web and worker for it)
+PYTHON_NODE_SCHEDULER_STATE = os.getenv("PYTHON_NODE_SCHEDULER_STATE", "/tmp/ruzivoflow-python-node.json")
+# Per-run RLIMIT_AS and RLIMIT_CPU for user code (0 disables)
+PYTHON_NODE_MEMORY_LIMIT_MB = int(os.getenv("PYTHON_NODE_MEMORY_LIMIT_MB", 4096))
+PYTHON_NODE_CPU_LIMIT_SECONDS = int(os.getenv("PYTHON_NODE_CPU_LIMIT_SECONDS", 120))
+# stdout/stderr kept in python_code response_data (last N characters of each)
+PYTHON_NODE_LOG_MAX_CHARS = int(os.getenv("PYTHON_NODE_LOG_MAX_CHARS", 64 * 1024))
+# A node run waits at most this long for an identical running one before running
+# itself; runs started longer ago are presumed dead and never attached to
+NODE_RUN_SINGLE_FLIGHT_MAX_WAIT_SECONDS = int(os.getenv("NODE_RUN_SINGLE_FLIGHT_MAX_WAIT_SECONDS", 900))
+# Longest a run's event stream stays open (a long poll: each open stream holds a
+# gunicorn thread); clients resume with Last-Event-ID
+RUN_EVENT_STREAM_MAX_SECONDS = int(os.getenv("RUN_EVENT_STREAM_MAX_SECONDS", 25))
+# Decoded parquet columns kept per server process (see node_editor/table_cache.py; 0 disables)
+ARROW_TABLE_CACHE_MAX_BYTES = int(os.getenv("ARROW_TABLE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Decoded artifacts shared by every process on the host as memory-mapped Arrow
+# IPC files (see node_editor/shm_cache.py; 0 disables)
+ARTIFACT_SHM_CACHE_DIR = os.getenv("ARTIFACT_SHM_CACHE_DIR", "/dev/shm")
+ARTIFACT_SHM_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_SHM_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Orphaned artifact documents/files older than this are removed by `manage.py gc_artifacts`
+ARTIFACT_GC_MIN_AGE_SECONDS = int(os.getenv("ARTIFACT_GC_MIN_AGE_SECONDS", 3600))
+# How often the self-rescheduling collect_artifact_garbage task runs (0 stops it)
+ARTIFACT_GC_INTERVAL_SECONDS = int(os.getenv("ARTIFACT_GC_INTERVAL_SECONDS", 6 * 3600))
+# Finished NodeRuns and their events are deleted by the same collection after this long
+NODE_RUN_RETENTION_SECONDS = int(os.getenv("NODE_RUN_RETENTION_SECONDS", 7 * 24 * 3600))